@@ -1,26 +1,161 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional
+from itertools import repeat
+from typing import FrozenSet, List, Optional
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from passlib.hash import bcrypt as bcrypt_hash
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session, joinedload
 import models
-from database import get_db
+from cache import TTLCache
+from ip_whitelist import whitelist
+from database import get_db, get_async_db
+
+logger = logging.getLogger(__name__)
 
 SECRET_KEY = "secret_key_for_prototype_only"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Verified token -> Principal. Bounded so a token flood cannot grow memory;
+# short TTL bounds staleness when another process changes roles.
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("OMS_PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("OMS_PRINCIPAL_CACHE_SIZE", "10000"))
+
+# bcrypt cost factor. Stored hashes with a different cost are re-hashed on next login.
+BCRYPT_ROUNDS = int(os.getenv("OMS_BCRYPT_ROUNDS", "12"))
+# Max concurrent bcrypt computations. bcrypt releases the GIL, so these run in parallel
+# without ever blocking the event loop; the cap keeps a login storm from taking every core.
+PASSWORD_HASH_WORKERS = int(os.getenv("OMS_PASSWORD_HASH_WORKERS", "4"))
+# Processes for bulk hashing (staff import). Separate from the login pool, so one per core.
+BULK_HASH_WORKERS = int(os.getenv("OMS_BULK_HASH_WORKERS", "0")) or os.cpu_count() or 1
+
+# Enforce the IP whitelist on /token and the POS APIs. Off for the public prototype demo.
+IP_WHITELIST_ENABLED = os.getenv("OMS_IP_WHITELIST_ENABLED", "0") == "1"
+
+# Level Guard: which roles each role may create
+ALLOWED_CREATION = {
+    "Admin": ["Admin", "Operator", "Area Mgr", "Store Mgr", "Cashier"],
+    "Operator": ["Area Mgr", "Store Mgr", "Cashier"],
+    "Store Mgr": ["Cashier"]
+}
+
+pwd_context = None
+password_executor = None
+# Bulk imports hash in worker processes, created on first use and shut down
+# with the app. Spawned, not forked: a fork would copy the parent's threads,
+# locks and open database connections into every worker.
+bulk_hash_executor = None
+_bulk_hash_lock = threading.Lock()
+
+def configure_password_hashing(rounds: int, workers: int):
+    global pwd_context, password_executor
+    pwd_context = CryptContext(
+        schemes=["bcrypt"], deprecated="auto",
+        bcrypt__default_rounds=rounds, bcrypt__min_rounds=rounds, bcrypt__max_rounds=rounds
+    )
+    old_executor = password_executor
+    password_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pwhash")
+    if old_executor:
+        old_executor.shutdown(wait=False)
+
+configure_password_hashing(BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+@dataclass(frozen=True)
+class Principal:
+    # Compact, immutable view of the authenticated user. Safe to share across requests.
+    id: int
+    username: str
+    role_name: Optional[str]
+    outlet_id: Optional[int]
+    operator_id: Optional[int]
+    permissions: FrozenSet[str]
+
+    @classmethod
+    def from_user(cls, user: models.User) -> "Principal":
+        return cls(
+            id=user.id,
+            username=user.username,
+            role_name=user.role.name if user.role else None,
+            outlet_id=user.outlet_id,
+            operator_id=user.operator_id,
+            permissions=frozenset(p.code for p in user.role.permissions) if user.role else frozenset()
+        )
+
+principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL_SECONDS)
+
+def invalidate_principals(user_id: Optional[int] = None):
+    # Role/permission edits affect every holder of the role, so they clear everything.
+    # User edits only drop that user's cached tokens.
+    if user_id is None:
+        principal_cache.clear()
+    else:
+        principal_cache.discard_where(lambda p: p.id == user_id)
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+# --- Pooled variants: use these from request handlers ---
+
+async def verify_password_async(plain_password, hashed_password):
+    # Returns (valid, new_hash). new_hash is set when the stored hash uses another cost.
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, pwd_context.verify_and_update, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, pwd_context.hash, password)
+
+def get_password_hash_pooled(password):
+    # Sync endpoints already run on a threadpool worker; wait on the bounded pool
+    # so bulk user edits share the same bcrypt concurrency cap as logins.
+    return password_executor.submit(pwd_context.hash, password).result()
+
+def _hash_in_worker(password, rounds):
+    return bcrypt_hash.using(rounds=rounds).hash(password)
+
+def hash_passwords_bulk(passwords: List[str]) -> List[str]:
+    # Thousands of hashes at once (staff import): spread over a process pool so the
+    # request's hashing does not compete with logins for password_executor slots.
+    if not passwords:
+        return []
+    rounds = pwd_context.handler("bcrypt").default_rounds
+    chunksize = max(1, len(passwords) // (BULK_HASH_WORKERS * 4))
+    return list(_bulk_hash_pool().map(_hash_in_worker, passwords, repeat(rounds), chunksize=chunksize))
+
+def _bulk_hash_pool() -> ProcessPoolExecutor:
+    # Sync endpoints run on a threadpool: two imports at once must not build two pools
+    global bulk_hash_executor
+    with _bulk_hash_lock:
+        if bulk_hash_executor is None:
+            bulk_hash_executor = ProcessPoolExecutor(
+                max_workers=BULK_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return bulk_hash_executor
+
+def shutdown_bulk_hashing():
+    # Called from the app lifespan on exit; the next import starts a fresh pool
+    global bulk_hash_executor
+    with _bulk_hash_lock:
+        executor, bulk_hash_executor = bulk_hash_executor, None
+    if executor:
+        executor.shutdown(wait=True, cancel_futures=True)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -31,49 +166,97 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def check_ip_whitelist(request: Request, db: Session = Depends(get_db)):
-    client_ip = request.client.host
-    # In prototype, localhost might be ::1 or 127.0.0.1
-    if client_ip == "::1":
-        client_ip = "127.0.0.1"
-        
-    allowed = db.query(models.IPWhitelist).filter(models.IPWhitelist.ip_address == client_ip).first()
-    if not allowed:
-        print(f"Blocked IP: {client_ip}") # Debug log
-        raise HTTPException(status_code=403, detail="Access denied: IP not whitelisted")
+def _client_ip(request: Request):
+    return request.client.host if request.client else None
+
+def _reject_ip(client_ip):
+    logger.warning("ip_blocked ip=%s", client_ip)
+    raise HTTPException(status_code=403, detail="Access denied: IP not whitelisted")
+
+def check_ip_whitelist(request: Request, db: Session, outlet_id: Optional[int] = None):
+    # Global entries admit any caller; outlet entries only admit callers scoped to that outlet.
+    # Served from the in-memory index; db is only touched when the index needs a refresh.
+    if not IP_WHITELIST_ENABLED:
+        return True
+    whitelist.ensure_loaded(db)
+    if not whitelist.is_allowed(_client_ip(request), outlet_id):
+        _reject_ip(_client_ip(request))
     return True
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
+async def check_ip_whitelist_async(request: Request, db: AsyncSession, outlet_id: Optional[int] = None):
+    if not IP_WHITELIST_ENABLED:
+        return True
+    await whitelist.ensure_loaded_async(db)
+    if not whitelist.is_allowed(_client_ip(request), outlet_id):
+        _reject_ip(_client_ip(request))
+    return True
+
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def _decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
-            print("Auth Error: Username is None in token payload")
-            raise credentials_exception
+            logger.info("auth_rejected reason=missing_subject")
+            raise _credentials_exception()
     except JWTError as e:
-        print(f"Auth Error: JWTError - {e}")
-        raise credentials_exception
-    
-    # Eager load role and permissions
-    user = db.query(models.User).options(joinedload(models.User.role).joinedload(models.Role.permissions)).filter(models.User.username == username).first()
-    
+        logger.info('auth_rejected reason=invalid_token error="%s"', e)
+        raise _credentials_exception()
+    return payload
+
+def _cache_principal(token: str, payload: dict, user: Optional[models.User]) -> Principal:
     if user is None:
-        print(f"Auth Error: User {username} not found in DB")
-        raise credentials_exception
+        logger.info("auth_rejected reason=unknown_user username=%s", payload.get("sub"))
+        raise _credentials_exception()
+    principal = Principal.from_user(user)
+    # Never serve a token from cache past its own expiry
+    principal_cache.set(token, principal, ttl=payload.get("exp", 0) - time.time())
+    return principal
+
+# Eager load role and permissions
+_user_options = joinedload(models.User.role).joinedload(models.Role.permissions)
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Principal:
+    # Sync (runs in the threadpool) for the admin CRUD endpoints
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+    payload = _decode_token(token)
+    user = db.query(models.User).options(_user_options).filter(models.User.username == payload["sub"]).first()
+    return _cache_principal(token, payload, user)
+
+async def get_current_user_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> Principal:
+    # Same contract and cache as get_current_user, without blocking the event loop
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+    payload = _decode_token(token)
+    result = await db.execute(select(models.User).options(_user_options).where(models.User.username == payload["sub"]))
+    user = result.unique().scalars().first()
+    return _cache_principal(token, payload, user)
+
+def check_permission(user: Principal, permission_code: str) -> Principal:
+    if not user.role_name:
+        raise HTTPException(status_code=403, detail="User has no role assigned")
+    
+    if permission_code not in user.permissions:
+        raise HTTPException(status_code=403, detail=f"Missing permission: {permission_code}")
     return user
 
-def require_permission(permission_code: str):
-    def dependency(user: models.User = Depends(get_current_user)):
-        if not user.role:
-            raise HTTPException(status_code=403, detail="User has no role assigned")
-        
-        has_perm = any(p.code == permission_code for p in user.role.permissions)
-        if not has_perm:
-            raise HTTPException(status_code=403, detail=f"Missing permission: {permission_code}")
+def require_permission(permission_code: str, user_dependency=get_current_user):
+    async def dependency(user: Principal = Depends(user_dependency)):
+        return check_permission(user, permission_code)
+    return dependency
+
+def require_whitelisted_ip(user_dependency=get_current_user_async):
+    # Wraps a user dependency so the IP check runs against the caller's outlet scope
+    async def dependency(request: Request, user: Principal = Depends(user_dependency), db: AsyncSession = Depends(get_async_db)):
+        await check_ip_whitelist_async(request, db, outlet_id=user.outlet_id)
         return user
     return dependency
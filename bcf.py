@@ -0,0 +1,130 @@
+import os
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import models
+
+# BCF float movements between an outlet and its terminals.
+#
+# Escrow mode (OMS_BCF_ESCROW_CHUNK > 0): the outlet pre-allocates float to each
+# terminal in chunks. Deposits draw from the terminal's Terminal.bcf_escrow, settles
+# return into it, and the hot Outlet row is only written on refill or overflow.
+# The outlet's BCF is always Outlet.bcf_balance + sum(Terminal.bcf_escrow).
+# Escrow goes back to the outlet row when a terminal is deleted or swept offline.
+
+ESCROW_CHUNK = float(os.getenv("OMS_BCF_ESCROW_CHUNK", "0"))
+# Escrow at or above this is handed back to the outlet, down to one chunk
+ESCROW_HIGH_WATER = 2 * ESCROW_CHUNK
+
+def escrow_enabled() -> bool:
+    return ESCROW_CHUNK > 0
+
+def _debit_outlet(outlet_id: int, amount: float):
+    return (
+        update(models.Outlet)
+        .where(models.Outlet.id == outlet_id, models.Outlet.bcf_balance >= amount)
+        .values(bcf_balance=models.Outlet.bcf_balance - amount)
+    )
+
+def _credit_outlet(outlet_id: int, amount: float):
+    return (
+        update(models.Outlet)
+        .where(models.Outlet.id == outlet_id)
+        .values(bcf_balance=models.Outlet.bcf_balance + amount)
+    )
+
+def _debit_escrow(terminal_id: int, amount: float):
+    return (
+        update(models.Terminal)
+        .where(models.Terminal.id == terminal_id, models.Terminal.bcf_escrow >= amount)
+        .values(bcf_escrow=models.Terminal.bcf_escrow - amount)
+    )
+
+def _credit_escrow(terminal_id: int, amount: float):
+    return (
+        update(models.Terminal)
+        .where(models.Terminal.id == terminal_id)
+        .values(bcf_escrow=models.Terminal.bcf_escrow + amount)
+    )
+
+async def take(db: AsyncSession, outlet_id: int, terminal_id: int, amount: float) -> bool:
+    # Move `amount` of BCF out of the outlet's float for a deposit on terminal_id.
+    # False when the outlet (including the terminal's escrow) cannot cover it.
+    if not escrow_enabled():
+        return (await db.execute(_debit_outlet(outlet_id, amount))).rowcount == 1
+
+    if (await db.execute(_debit_escrow(terminal_id, amount))).rowcount == 1:
+        return True
+
+    # Refill: a whole chunk if the outlet has it, otherwise just the shortfall
+    refill = max(ESCROW_CHUNK, amount)
+    if (await db.execute(_debit_outlet(outlet_id, refill))).rowcount != 1:
+        escrow = await db.scalar(select(models.Terminal.bcf_escrow).where(models.Terminal.id == terminal_id)) or 0.0
+        refill = amount - escrow
+        if refill > 0 and (await db.execute(_debit_outlet(outlet_id, refill))).rowcount != 1:
+            return False
+    if refill > 0:
+        await db.execute(_credit_escrow(terminal_id, refill))
+    return (await db.execute(_debit_escrow(terminal_id, amount))).rowcount == 1
+
+async def give(db: AsyncSession, outlet_id: int, terminal_id: int, amount: float):
+    # Return `amount` of BCF to the outlet's float after a settle on terminal_id
+    if not escrow_enabled():
+        await db.execute(_credit_outlet(outlet_id, amount))
+        return
+
+    escrow = await db.scalar(_credit_escrow(terminal_id, amount).returning(models.Terminal.bcf_escrow))
+    if escrow is not None and escrow >= ESCROW_HIGH_WATER:
+        excess = escrow - ESCROW_CHUNK
+        await db.execute(_debit_escrow(terminal_id, excess))
+        await db.execute(_credit_outlet(outlet_id, excess))
+
+async def take_many(db: AsyncSession, outlet_id: int, items) -> list:
+    # items: [(terminal_id, amount)]. Without escrow, one outlet debit covers the whole
+    # batch when it can; otherwise each item is tried in order.
+    if items and not escrow_enabled():
+        if (await db.execute(_debit_outlet(outlet_id, sum(a for _, a in items)))).rowcount == 1:
+            return [True] * len(items)
+    return [await take(db, outlet_id, terminal_id, amount) for terminal_id, amount in items]
+
+async def give_many(db: AsyncSession, outlet_id: int, items):
+    if not items:
+        return
+    if not escrow_enabled():
+        await db.execute(_credit_outlet(outlet_id, sum(a for _, a in items)))
+        return
+    for terminal_id, amount in items:
+        await give(db, outlet_id, terminal_id, amount)
+
+def reclaim(db: Session, outlet_id: int, terminal_id: int = None):
+    # Sweep terminal escrow back into the outlet row (sync; admin edits and deletes)
+    query = select(func.coalesce(func.sum(models.Terminal.bcf_escrow), 0.0)).where(models.Terminal.outlet_id == outlet_id)
+    sweep = update(models.Terminal).where(models.Terminal.outlet_id == outlet_id, models.Terminal.bcf_escrow != 0)
+    if terminal_id is not None:
+        query = query.where(models.Terminal.id == terminal_id)
+        sweep = sweep.where(models.Terminal.id == terminal_id)
+    amount = db.scalar(query)
+    if amount:
+        db.execute(sweep.values(bcf_escrow=0.0))
+        db.execute(_credit_outlet(outlet_id, amount))
+    return amount
+
+async def release(db: AsyncSession, terminals) -> float:
+    # Hand the escrow of idle terminals going offline back to their outlets (heartbeat sweep).
+    # Conditional on the escrow still being what was read, like any other escrow move.
+    released = 0.0
+    for terminal_id, outlet_id, amount in [(t.id, t.outlet_id, t.bcf_escrow) for t in terminals]:
+        if amount and (await db.execute(_debit_escrow(terminal_id, amount))).rowcount == 1:
+            await db.execute(_credit_outlet(outlet_id, amount))
+            released += amount
+    return released
+
+def outlet_total(outlet_id: int):
+    # Exact BCF for one outlet: unallocated float plus everything held in terminal escrow
+    escrow = (
+        select(func.coalesce(func.sum(models.Terminal.bcf_escrow), 0.0))
+        .where(models.Terminal.outlet_id == outlet_id)
+        .scalar_subquery()
+    )
+    return select(models.Outlet.bcf_balance + escrow).where(models.Outlet.id == outlet_id)
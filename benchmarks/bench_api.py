@@ -0,0 +1,210 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+
+import httpx
+from sqlalchemy import select
+
+import auth
+import main
+import models
+import seed
+from benchmarks.common import StatementCounter, summarize, temp_database
+
+# Latency, throughput and SQL statements per request for the API hot paths, driven
+# in-process through an ASGI transport against a dataset built by seed.generate.
+#   python -m benchmarks.bench_api --outlets 5 --terminals 20 --months 1 --requests 200
+#   python -m benchmarks.bench_api --output results.json
+#   python -m benchmarks.bench_api --baseline benchmarks/baseline.json   # exit 1 on regression
+# Re-record the baseline (default parameters) after a change that moves SQL/request:
+#   python -m benchmarks.bench_api --save-baseline benchmarks/baseline.json
+# The gate is the deterministic part: SQL statements per request and errors. Latency
+# depends on the machine, so each scenario's p95 is expressed relative to a control
+# request (write-behind stats: cached auth, no SQL) measured in the same run, and a slowdown
+# of that ratio is only reported unless --gate-latency is given.
+
+PASSWORD = seed.SCALE_PASSWORD
+# Cache expiry (principals, dashboards) makes SQL/request drift slightly between runs
+SQL_SLACK = 0.5
+SCENARIOS = ("control", "token", "pos_terminals", "deposit", "settle", "dashboard_outlet", "dashboard_operator",
+             "dashboard_admin", "users", "operators", "outlets", "terminals", "transactions")
+
+def prepare(Session, args) -> dict:
+    db = Session()
+    generated = seed.generate(db, args.operators, args.outlets, args.terminals, args.players, args.months,
+                              args.txns_per_day, args.seed, batch_size=args.batch_size, log=lambda msg: None)
+    roles = seed.ensure_roles(db)
+    db.add(models.User(username="bench-admin", hashed_password=auth.get_password_hash(PASSWORD), role=roles["Admin"]))
+    db.commit()
+    outlet_id = generated["outlets"][0]
+    terminal_ids = list(db.scalars(select(models.Terminal.id).where(models.Terminal.outlet_id == outlet_id).order_by(models.Terminal.id)))
+    tag = f"S{args.seed}"
+    # dashboard_outlet must measure the (uncached) single-outlet path, not fall back to the operator scope
+    manager_outlet = db.scalar(select(models.User.outlet_id).where(models.User.username == f"{tag}-manager{outlet_id}"))
+    assert manager_outlet == outlet_id, f"seeded manager is scoped to outlet {manager_outlet}, expected {outlet_id}"
+    db.close()
+    return {
+        "terminal_ids": terminal_ids,
+        "transactions": generated["transactions"],
+        "users": {
+            "cashier": f"{tag}-cashier{outlet_id}",
+            "manager": f"{tag}-manager{outlet_id}",
+            "operator": f"{tag}-op1",
+            "admin": "bench-admin",
+        },
+    }
+
+async def measure(calls, concurrency):
+    # calls: zero-argument coroutine functions, each one request
+    sem = asyncio.Semaphore(concurrency)
+    latencies, errors = [], []
+
+    async def one(call):
+        async with sem:
+            start = time.perf_counter()
+            try:
+                resp = await call()
+                if resp.status_code >= 400:
+                    errors.append(resp.status_code)
+            except Exception as e:
+                errors.append(type(e).__name__)
+            latencies.append(time.perf_counter() - start)
+
+    with StatementCounter() as counter:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(c) for c in calls))
+        elapsed = time.perf_counter() - start
+    stats = summarize(latencies, elapsed)
+    stats["errors"] = len(errors)
+    stats["sql_per_request"] = round(counter.count / len(calls), 2) if calls else 0.0
+    return stats
+
+async def run(ctx, args) -> dict:
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        headers = {}
+        for role, username in ctx["users"].items():
+            resp = await client.post("/token", data={"username": username, "password": PASSWORD})
+            resp.raise_for_status()
+            headers[role] = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+        terminals = ctx["terminal_ids"]
+        n = args.requests
+
+        def get(url, role, **params):
+            return lambda: client.get(url, params=params, headers=headers[role])
+
+        def post(url, role, **kwargs):
+            return lambda: client.post(url, headers=headers[role], **kwargs)
+
+        async def bind_all():
+            for i, tid in enumerate(terminals):
+                resp = await client.post("/api/bind_terminal", data={"terminal_id": tid, "phone": f"07{i:08d}"}, headers=headers["cashier"])
+                resp.raise_for_status()
+
+        scenarios = {
+            "control": lambda: [get("/api/system/write_behind", "admin") for _ in range(n)],
+            "token": lambda: [post("/token", "cashier", data={"username": ctx["users"]["cashier"], "password": PASSWORD}) for _ in range(n)],
+            "pos_terminals": lambda: [get("/api/pos/terminals", "cashier") for _ in range(n)],
+            "deposit": lambda: [post("/api/deposit", "cashier", json={"terminal_id": terminals[i % len(terminals)], "amount": 100}) for i in range(n)],
+            # One settle per bound terminal
+            "settle": lambda: [post("/api/settle", "cashier", json={"terminal_id": tid}) for tid in terminals],
+            "dashboard_outlet": lambda: [get("/api/dashboard", "manager") for _ in range(n)],
+            "dashboard_operator": lambda: [get("/api/dashboard", "operator") for _ in range(n)],
+            "dashboard_admin": lambda: [get("/api/dashboard", "admin") for _ in range(n)],
+            "users": lambda: [get("/api/users", "admin") for _ in range(n)],
+            "operators": lambda: [get("/api/operators", "admin") for _ in range(n)],
+            "outlets": lambda: [get("/api/outlets", "admin") for _ in range(n)],
+            "terminals": lambda: [get("/api/terminals", "operator") for _ in range(n)],
+            "transactions": lambda: [get("/api/transactions", "operator", limit=100) for _ in range(n)],
+        }
+
+        results, bound = {}, False
+        for name in args.scenarios:
+            if name in ("deposit", "settle") and not bound:
+                await bind_all()
+                bound = True
+            results[name] = await measure(scenarios[name](), args.concurrency)
+            bound = bound and name != "settle"
+            print(f"{name:20s} p50={results[name]['p50_ms']:8.2f}ms p95={results[name]['p95_ms']:8.2f}ms "
+                  f"p99={results[name]['p99_ms']:8.2f}ms {results[name]['rps']:8.1f} req/s "
+                  f"sql/req={results[name]['sql_per_request']:6.2f} errors={results[name]['errors']}")
+        control = results["control"]["p95_ms"] or 0.01
+        for stats in results.values():
+            stats["p95_vs_control"] = round(stats["p95_ms"] / control, 2)
+        return results
+
+def compare(results, baseline, tolerance):
+    # -> (regressions, slowdowns). Regressions: more SQL per request, more errors.
+    # Slowdowns: p95 relative to the control request grew by more than `tolerance`.
+    regressions, slowdowns = [], []
+    for name, stats in results.items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        if stats["sql_per_request"] > base["sql_per_request"] + SQL_SLACK:
+            regressions.append(f"{name}: sql/request {base['sql_per_request']} -> {stats['sql_per_request']}")
+        if stats["errors"] > base["errors"]:
+            regressions.append(f"{name}: errors {base['errors']} -> {stats['errors']}")
+        if name != "control" and "p95_vs_control" in base and stats["p95_vs_control"] > base["p95_vs_control"] * (1 + tolerance):
+            slowdowns.append(f"{name}: p95 {base['p95_vs_control']}x -> {stats['p95_vs_control']}x control")
+    return regressions, slowdowns
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark the API hot paths in-process")
+    parser.add_argument("--operators", type=int, default=1)
+    parser.add_argument("--outlets", type=int, default=5, help="Per operator")
+    parser.add_argument("--terminals", type=int, default=20, help="Per outlet")
+    parser.add_argument("--players", type=int, default=2000)
+    parser.add_argument("--months", type=int, default=1)
+    parser.add_argument("--txns-per-day", type=int, default=20, help="Per terminal")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=200, help="Per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument("--output", help="Write results as JSON")
+    parser.add_argument("--baseline", help="Compare against a saved result file")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed growth of p95 relative to the control request")
+    parser.add_argument("--gate-latency", action="store_true", help="Also exit 1 when p95 relative to control slows down")
+    parser.add_argument("--save-baseline", help="Write results as the new baseline")
+    args = parser.parse_args()
+    # Relative latency needs the control request in every run
+    args.scenarios = ["control"] + [name for name in args.scenarios if name != "control"]
+    # httpx logs every request at INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    # Login cost is measured by bench_login; keep bcrypt out of the way here
+    auth.configure_password_hashing(4, 1)
+    auth.principal_cache.clear()
+
+    with temp_database() as Session:
+        ctx = prepare(Session, args)
+        results = asyncio.run(run(ctx, args))
+
+    params = {k: getattr(args, k) for k in ("operators", "outlets", "terminals", "players", "months", "txns_per_day", "seed", "requests", "concurrency")}
+    report = {"params": {**params, "transactions": ctx["transactions"]}, "scenarios": results}
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("params") != report["params"]:
+            print("warning: baseline was recorded with different parameters")
+        regressions, slowdowns = compare(results, baseline, args.tolerance)
+        if args.gate_latency:
+            regressions, slowdowns = regressions + slowdowns, []
+        for line in slowdowns:
+            print(f"slower (advisory) {line}")
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against baseline")
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+import auth
+import database
+import main
+import models
+from benchmarks.common import summarize, temp_database
+
+# Concurrent /api/deposit throughput per database engine profile.
+#   python -m benchmarks.bench_deposit --terminals 50 --deposits 2000 --concurrency 32
+#   python -m benchmarks.bench_deposit --profiles server --url postgresql://oms@localhost/oms_bench
+
+PASSWORD = "1234"
+
+def seed_floor(Session, terminals):
+    db = Session()
+    perm = models.Permission(code="POS_OPERATE", description="Operate POS")
+    role = models.Role(name="Cashier", permissions=[perm])
+    operator = models.Operator(name="BenchOperator")
+    db.add_all([role, operator])
+    db.flush()
+    outlet = models.Outlet(name="Bench Outlet", operator_id=operator.id, bcf_balance=1e12)
+    db.add(outlet)
+    db.flush()
+    db.add(models.User(username="cashier", hashed_password=auth.get_password_hash(PASSWORD), role=role, outlet_id=outlet.id))
+    ids = []
+    for i in range(terminals):
+        player = models.Player(phone=f"09{i:08d}", nickname=f"Player_{i}")
+        db.add(player)
+        db.flush()
+        db.add(models.Wallet(player_id=player.id, outlet_id=outlet.id, balance=0.0))
+        t = models.Terminal(code=f"B-{i:04d}", outlet_id=outlet.id, status=models.TerminalStatus.OCCUPIED, current_player_id=player.id)
+        db.add(t)
+        db.flush()
+        ids.append(t.id)
+    db.commit()
+    db.close()
+    return ids
+
+async def run(terminal_ids, deposits, concurrency):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        resp = await client.post("/token", data={"username": "cashier", "password": PASSWORD})
+        headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+        sem = asyncio.Semaphore(concurrency)
+        latencies, errors = [], []
+
+        async def one(i):
+            async with sem:
+                start = time.perf_counter()
+                try:
+                    r = await client.post("/api/deposit", json={"terminal_id": terminal_ids[i % len(terminal_ids)], "amount": 10}, headers=headers)
+                    if r.status_code != 200:
+                        errors.append(r.status_code)
+                except Exception as e:
+                    errors.append(type(e).__name__)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(deposits)))
+        elapsed = time.perf_counter() - start
+        stats = summarize(latencies, elapsed)
+        stats["errors"] = len(errors)
+        return stats
+
+def check_balances(Session, expected_total):
+    db = Session()
+    total = sum(w.balance for w in db.query(models.Wallet))
+    db.close()
+    return total == expected_total
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent deposits per engine profile")
+    parser.add_argument("--profiles", nargs="+", default=["sqlite_default", "sqlite_wal"], choices=database.PROFILES)
+    parser.add_argument("--url", default=None, help="Database URL for the server profile (tables are dropped!)")
+    parser.add_argument("--terminals", type=int, default=50)
+    parser.add_argument("--deposits", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+    auth.configure_password_hashing(4, 1)
+
+    results = []
+    for profile in args.profiles:
+        if profile == "server" and not args.url:
+            print("server: skipped (pass --url)")
+            continue
+        auth.principal_cache.clear()
+        with temp_database(profile, args.url if profile == "server" else None) as Session:
+            terminal_ids = seed_floor(Session, args.terminals)
+            stats = asyncio.run(run(terminal_ids, args.deposits, args.concurrency))
+            stats["balances_consistent"] = check_balances(Session, 10.0 * (args.deposits - stats["errors"]))
+        results.append({"profile": profile, **stats})
+        print(f"{profile:15s} {stats['rps']:8.1f} deposits/s  p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms "
+              f"p99={stats['p99_ms']}ms errors={stats['errors']} consistent={stats['balances_consistent']}")
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main_cli()
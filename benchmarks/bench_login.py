@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+import auth
+import main
+import models
+from benchmarks.common import summarize, temp_database
+
+# Login latency/throughput per bcrypt cost, plus how long a cheap request waits
+# on the event loop while the login storm is running.
+#   python -m benchmarks.bench_login --rounds 10 12 --workers 4 --logins 64
+
+PASSWORD = "1234"
+
+def seed_users(Session, count):
+    db = Session()
+    hashes = list(auth.password_executor.map(auth.get_password_hash, [PASSWORD] * count))
+    db.add_all(models.User(username=f"cashier{i}", hashed_password=h) for i, h in enumerate(hashes))
+    db.commit()
+    db.close()
+
+async def run(logins, concurrency, users):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        sem = asyncio.Semaphore(concurrency)
+        login_latencies, probe_latencies = [], []
+        done = asyncio.Event()
+
+        async def login(i):
+            async with sem:
+                start = time.perf_counter()
+                resp = await client.post("/token", data={"username": f"cashier{i % users}", "password": PASSWORD})
+                login_latencies.append(time.perf_counter() - start)
+                assert resp.status_code == 200, resp.text
+
+        async def probe():
+            # Cheap async endpoint; its latency is the event-loop stall
+            while not done.is_set():
+                start = time.perf_counter()
+                await client.get("/openapi.json")
+                probe_latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.01)
+
+        probe_task = asyncio.create_task(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*(login(i) for i in range(logins)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await probe_task
+        return summarize(login_latencies, elapsed), summarize(probe_latencies, elapsed)
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark /token under concurrent logins")
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 12])
+    parser.add_argument("--workers", type=int, default=auth.PASSWORD_HASH_WORKERS)
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=16)
+    args = parser.parse_args()
+
+    results = []
+    for rounds in args.rounds:
+        auth.configure_password_hashing(rounds, args.workers)
+        with temp_database() as Session:
+            seed_users(Session, args.users)
+            login_stats, probe_stats = asyncio.run(run(args.logins, args.concurrency, args.users))
+        results.append({"rounds": rounds, "workers": args.workers, "login": login_stats, "probe": probe_stats})
+        print(f"rounds={rounds:2d} workers={args.workers}  "
+              f"login p50={login_stats['p50_ms']}ms p95={login_stats['p95_ms']}ms p99={login_stats['p99_ms']}ms "
+              f"{login_stats['rps']} logins/s  |  loop probe p99={probe_stats['p99_ms']}ms max={probe_stats['max_ms']}ms")
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main_cli()
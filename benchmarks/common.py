@@ -0,0 +1,94 @@
+import contextlib
+import os
+import shutil
+import tempfile
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+import database
+import models
+
+# Shared helpers for the scripts in benchmarks/. Run them from the repo root:
+#   python -m benchmarks.bench_login
+
+@contextlib.contextmanager
+def temp_database(profile: str = None, url: str = None):
+    # Fresh database wired into the app through dependency overrides.
+    # Without a url, a throwaway SQLite file is used.
+    # main is imported here: importing it creates tables in the default database,
+    # which scripts that only drive an external server must not do.
+    import main
+    tmpdir = None
+    if url is None:
+        tmpdir = tempfile.mkdtemp(prefix="oms-bench-")
+        url = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    engine, async_engine = database.create_engines(url, profile)
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    AsyncSession_ = async_sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+    def override_get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def override_get_async_db():
+        async with AsyncSession_() as db:
+            yield db
+
+    main.app.dependency_overrides[database.get_db] = override_get_db
+    main.app.dependency_overrides[database.get_async_db] = override_get_async_db
+    # Lifespan loops and the SSE stream open their own sessions
+    default_sessions, main.AsyncSessionLocal = main.AsyncSessionLocal, AsyncSession_
+    try:
+        yield Session
+    finally:
+        main.app.dependency_overrides.clear()
+        main.AsyncSessionLocal = default_sessions
+        engine.dispose()
+        # Pooled aiosqlite connections belong to the (closed) benchmark event loop
+        async_engine.sync_engine.dispose(close=False)
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+def summarize(latencies, elapsed):
+    # latencies in seconds -> milliseconds summary
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else 0.0,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+    }
+
+class StatementCounter:
+    # Counts SQL statements on every engine, sync and async, while active
+    def __init__(self):
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(Engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(Engine, "before_cursor_execute", self._on_execute)
@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import sessionmaker
+
+import database
+import models
+import seed
+from benchmarks.common import summarize
+
+# Whole-floor cashier workload against a real uvicorn server, ramped step by step to
+# find where throughput stops growing. Each simulated cashier owns one terminal and
+# loops bind -> 1-4 deposits -> settle; every outlet also runs the pos.html poll.
+#   python -m benchmarks.load_floor --outlets 4 --terminals 10 --steps 1 2 4 8 16 32 --step-seconds 20
+#   python -m benchmarks.load_floor --server-workers 4 --env OMS_BCF_ESCROW_CHUNK=5000 --output floor.json
+# "database is locked" counts are read from the server log: they are requests whose
+# SQLite busy_timeout ran out. Waits that eventually got the lock are not visible here.
+
+POLL_SECONDS = 5.0  # POLL_INTERVAL_MS in templates/pos.html
+DEPOSIT_AMOUNTS = (100, 200, 500, 1000)
+LOCK_ERROR = "database is locked"
+
+def prepare(url, args) -> list:
+    # Dataset for the server; returns [(cashier username, [terminal ids])] per outlet
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", database.apply_sqlite_pragmas)
+    models.Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    generated = seed.generate(db, 1, args.outlets, args.terminals, args.players, args.months, args.txns_per_day,
+                              args.seed, log=lambda msg: None)
+    floor = []
+    for oid in generated["outlets"]:
+        terminal_ids = list(db.scalars(select(models.Terminal.id).where(models.Terminal.outlet_id == oid).order_by(models.Terminal.id)))
+        floor.append((f"S{args.seed}-cashier{oid}", terminal_ids))
+    db.close()
+    engine.dispose()
+    return floor
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(url, args, log_file):
+    port = free_port()
+    # Worker count through WEB_CONCURRENCY (uvicorn's --workers default) so the app sees it
+    env = dict(os.environ, OMS_DATABASE_URL=url, WEB_CONCURRENCY=str(args.server_workers))
+    env.update(kv.split("=", 1) for kv in args.env)
+    cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+           "--log-level", "warning"]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.Popen(cmd, cwd=root, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("uvicorn exited during startup; see the server log")
+        try:
+            if httpx.get(f"{base_url}/openapi.json", timeout=1).status_code == 200:
+                return proc, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("uvicorn did not start within 60s")
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}  # op -> [seconds]
+        self.errors = {}  # op -> count
+        self.status = {}  # status code / exception name -> count
+
+    async def call(self, op, request):
+        start = time.perf_counter()
+        try:
+            resp = await request
+            code = resp.status_code
+        except httpx.HTTPError as e:
+            resp, code = None, type(e).__name__
+        self.latencies.setdefault(op, []).append(time.perf_counter() - start)
+        self.status[code] = self.status.get(code, 0) + 1
+        if resp is None or resp.status_code >= 400:
+            self.errors[op] = self.errors.get(op, 0) + 1
+        return resp
+
+async def cashier(client, rec, headers, terminal_id, phone, stop, rng, think):
+    # One terminal's play cycles until the step ends; a started cycle is finished
+    cycles = 0
+    while not stop.is_set():
+        resp = await rec.call("bind", client.post("/api/bind_terminal", data={"terminal_id": terminal_id, "phone": phone}, headers=headers))
+        if resp is not None and resp.status_code == 200:
+            for _ in range(rng.randint(1, 4)):
+                await asyncio.sleep(think)
+                await rec.call("deposit", client.post("/api/deposit", json={"terminal_id": terminal_id, "amount": rng.choice(DEPOSIT_AMOUNTS)}, headers=headers))
+            await asyncio.sleep(think)
+            await rec.call("settle", client.post("/api/settle", json={"terminal_id": terminal_id}, headers=headers))
+            cycles += 1
+        elif resp is not None and resp.status_code == 400:
+            # Still bound from a failed settle: release it and start over
+            await rec.call("settle", client.post("/api/settle", json={"terminal_id": terminal_id}, headers=headers))
+        await asyncio.sleep(think)
+    return cycles
+
+async def poller(client, rec, headers, stop):
+    while not stop.is_set():
+        await rec.call("poll", client.get("/api/pos/terminals", headers=headers))
+        try:
+            await asyncio.wait_for(stop.wait(), POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+async def run_step(base_url, tokens, slots, concurrency, args, step_no):
+    rec = Recorder()
+    stop = asyncio.Event()
+    limits = httpx.Limits(max_connections=concurrency + len(tokens) + 8)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        tasks = [asyncio.create_task(poller(client, rec, headers, stop)) for headers in tokens.values()]
+        workers = []
+        for i, (username, terminal_id) in enumerate(slots[:concurrency]):
+            rng = random.Random(args.seed * 1000003 + step_no * 1009 + i)
+            workers.append(asyncio.create_task(
+                cashier(client, rec, tokens[username], terminal_id, f"06{i:08d}", stop, rng, args.think_ms / 1000.0)
+            ))
+        start = time.perf_counter()
+        await asyncio.sleep(args.step_seconds)
+        stop.set()
+        cycles = sum(await asyncio.gather(*workers))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    all_latencies = [x for values in rec.latencies.values() for x in values]
+    total = len(all_latencies)
+    errors = sum(rec.errors.values())
+    return {
+        "concurrency": concurrency,
+        **summarize(all_latencies, elapsed),
+        "cycles_per_s": round(cycles / elapsed, 2),
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "errors": errors,
+        "status": {str(k): v for k, v in sorted(rec.status.items(), key=lambda kv: str(kv[0]))},
+        "ops": {op: {**summarize(values, elapsed), "errors": rec.errors.get(op, 0)} for op, values in rec.latencies.items()},
+    }
+
+def saturation_point(steps, gain=0.05):
+    # First step whose throughput is within `gain` of the best seen so far
+    best = None
+    for step in steps:
+        if best is not None and step["rps"] < best["rps"] * (1 + gain):
+            return best["concurrency"]
+        if best is None or step["rps"] > best["rps"]:
+            best = step
+    return None
+
+async def login_all(base_url, usernames):
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        tokens = {}
+        for username in usernames:
+            resp = await client.post("/token", data={"username": username, "password": seed.SCALE_PASSWORD})
+            resp.raise_for_status()
+            tokens[username] = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+        return tokens
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Ramp a simulated cashier floor against uvicorn")
+    parser.add_argument("--outlets", type=int, default=4)
+    parser.add_argument("--terminals", type=int, default=10, help="Per outlet")
+    parser.add_argument("--players", type=int, default=1000)
+    parser.add_argument("--months", type=int, default=1, help="History generated before the run")
+    parser.add_argument("--txns-per-day", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--steps", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32], help="Concurrent cashiers per step")
+    parser.add_argument("--step-seconds", type=float, default=15)
+    parser.add_argument("--think-ms", type=float, default=50, help="Pause between a cashier's actions")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--server-workers", type=int, default=1)
+    parser.add_argument("--env", nargs="*", default=[], metavar="KEY=VALUE", help="Extra server settings, e.g. OMS_LOG_WRITE_BEHIND=1")
+    parser.add_argument("--keep-log", action="store_true", help="Keep the temp dir with the database and server log")
+    parser.add_argument("--output", help="Write results as JSON")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="oms-floor-")
+    url = f"sqlite:///{os.path.join(tmpdir, 'floor.db')}"
+    log_path = os.path.join(tmpdir, "server.log")
+    floor = prepare(url, args)
+    # Cashier slots interleaved across outlets, so each step spreads over the floor
+    slots = [(username, tids[i]) for i in range(args.terminals) for username, tids in floor]
+    if max(args.steps) > len(slots):
+        print(f"note: only {len(slots)} terminals; larger steps are capped")
+
+    results = []
+    with open(log_path, "w") as log_file:
+        proc, base_url = start_server(url, args, log_file)
+        try:
+            tokens = asyncio.run(login_all(base_url, [username for username, _ in floor]))
+            for step_no, concurrency in enumerate(args.steps):
+                concurrency = min(concurrency, len(slots))
+                log_file.flush()
+                log_offset = os.path.getsize(log_path)
+                step = asyncio.run(run_step(base_url, tokens, slots, concurrency, args, step_no))
+                with open(log_path, errors="replace") as f:
+                    f.seek(log_offset)
+                    step["lock_errors"] = f.read().count(LOCK_ERROR)
+                results.append(step)
+                print(f"c={concurrency:4d} {step['rps']:8.1f} req/s {step['cycles_per_s']:7.2f} cycles/s "
+                      f"p50={step['p50_ms']}ms p95={step['p95_ms']}ms p99={step['p99_ms']}ms "
+                      f"errors={step['error_rate']:.2%} locked={step['lock_errors']}")
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    knee = saturation_point(results)
+    print(f"saturation: {'~' + str(knee) + ' concurrent cashiers' if knee else 'not reached'}")
+    report = {"params": {k: v for k, v in vars(args).items() if k not in ("output", "keep_log")},
+              "steps": results, "saturation_concurrency": knee}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.keep_log:
+        print(f"database and server log kept in {tmpdir}")
+    else:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main_cli()
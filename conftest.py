@@ -0,0 +1,170 @@
+import os
+import tempfile
+
+# Importing main creates tables in the default database; keep that out of the working tree
+os.environ.setdefault("OMS_DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='oms-test-'), 'import.db')}")
+
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+import auth
+import bcf
+import database
+import heartbeats
+import idempotency
+import main
+import models
+import pairing
+import rollups
+from ip_whitelist import whitelist
+
+PASSWORD = "1234"
+PASSWORD_HASH = auth.get_password_hash(PASSWORD)
+
+ROLE_PERMISSIONS = {
+    "Admin": ["DASHBOARD_VIEW", "POS_OPERATE", "FINANCE_VIEW", "BCF_MANAGE", "SETTINGS_MANAGE", "USER_CREATE"],
+    "Operator": ["DASHBOARD_VIEW", "POS_OPERATE", "FINANCE_VIEW", "BCF_MANAGE", "SETTINGS_MANAGE", "USER_CREATE"],
+    "Area Mgr": ["DASHBOARD_VIEW", "FINANCE_VIEW"],
+    "Store Mgr": ["DASHBOARD_VIEW", "POS_OPERATE", "FINANCE_VIEW"],
+    "Cashier": ["POS_OPERATE"]
+}
+
+class QueryCounter:
+    # Counts statements across sync and async engines
+    def __init__(self, *engines):
+        self.engines = [getattr(e, "sync_engine", e) for e in engines]
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        for engine in self.engines:
+            event.listen(engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        for engine in self.engines:
+            event.remove(engine, "before_cursor_execute", self._on_execute)
+
+@pytest.fixture
+def db_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    # Same connection settings as the default sqlite_wal profile
+    event.listen(engine, "connect", database.apply_sqlite_pragmas)
+    models.Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def async_db_engine(db_engine):
+    # Same file as db_engine. NullPool: TestClient runs each test on its own event loop.
+    engine = create_async_engine(database.to_async_url(str(db_engine.url)), poolclass=NullPool)
+    event.listen(engine.sync_engine, "connect", database.apply_sqlite_pragmas)
+    return engine
+
+@pytest.fixture
+def db(db_engine):
+    session = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)()
+    yield session
+    session.close()
+
+@pytest.fixture
+def client(db_engine, async_db_engine, monkeypatch):
+    TestSession = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+    AsyncTestSession = async_sessionmaker(bind=async_db_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+    def override_get_db():
+        session = TestSession()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    async def override_get_async_db():
+        async with AsyncTestSession() as session:
+            yield session
+
+    main.app.dependency_overrides[database.get_db] = override_get_db
+    main.app.dependency_overrides[database.get_async_db] = override_get_async_db
+    # Lifespan loops and the SSE stream open their own sessions
+    monkeypatch.setattr(main, "AsyncSessionLocal", AsyncTestSession)
+    # Tests flush the heartbeat buffer themselves; keep the background loop from racing them
+    monkeypatch.setattr(heartbeats, "FLUSH_SECONDS", 3600)
+    # Tokens minted in the same second are identical across tests
+    auth.principal_cache.clear()
+    rollups.dashboard_cache.clear()
+    idempotency.response_cache.clear()
+    whitelist.loaded_at = None
+    with TestClient(main.app) as c:
+        yield c
+    main.app.dependency_overrides.clear()
+    auth.principal_cache.clear()
+
+@pytest.fixture
+def org(db):
+    # Roles, one operator with one outlet, and one user per role
+    perms = {code: models.Permission(code=code, description=code) for code in ROLE_PERMISSIONS["Admin"]}
+    roles = {}
+    for name, codes in ROLE_PERMISSIONS.items():
+        roles[name] = models.Role(name=name, permissions=[perms[c] for c in codes])
+    db.add_all(roles.values())
+
+    operator = models.Operator(name="TestOperator", wallet_balance=1000000.0)
+    db.add(operator)
+    db.flush()
+    outlet = models.Outlet(name="Test Outlet", operator_id=operator.id, bcf_balance=50000.0)
+    db.add(outlet)
+    db.flush()
+
+    users = {
+        "admin": models.User(username="admin", role=roles["Admin"]),
+        "operator": models.User(username="operator", role=roles["Operator"], operator_id=operator.id),
+        "manager": models.User(username="manager", role=roles["Store Mgr"], operator_id=operator.id, outlet_id=outlet.id),
+        "cashier": models.User(username="cashier", role=roles["Cashier"], operator_id=operator.id, outlet_id=outlet.id),
+    }
+    for u in users.values():
+        u.hashed_password = PASSWORD_HASH
+    db.add_all(users.values())
+    db.commit()
+    return {"operator": operator, "outlet": outlet, "roles": roles, "users": users}
+
+def login(client, username):
+    resp = client.post("/token", data={"username": username, "password": PASSWORD})
+    assert resp.status_code == 200, resp.text
+    return {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+def add_terminals(db, outlet, count=3):
+    terminals = [models.Terminal(code=f"T-{i:02d}", name=f"{i}號機", outlet_id=outlet.id, status=models.TerminalStatus.IDLE) for i in range(1, count + 1)]
+    db.add_all(terminals)
+    db.commit()
+    return terminals
+
+def pair(db, terminal, token):
+    # What redeeming a pairing code leaves on the terminal
+    terminal.is_paired, terminal.hardware_id = True, f"HW-{token}"
+    terminal.device_token_hash = pairing.hash_device_token(token)
+    db.commit()
+    return token
+
+@pytest.fixture
+def escrow(monkeypatch):
+    monkeypatch.setattr(bcf, "ESCROW_CHUNK", 1000.0)
+    monkeypatch.setattr(bcf, "ESCROW_HIGH_WATER", 2000.0)
+
+def outlet_bcf_total(db, outlet):
+    db.expire_all()
+    return db.get(models.Outlet, outlet.id).bcf_balance + sum(t.bcf_escrow for t in db.query(models.Terminal))
+
+def run_with_session(engine, fn, *args):
+    async def go():
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            return await fn(session, *args)
+    return asyncio.run(go())
@@ -1,14 +1,92 @@
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./oms.db"
+SQLALCHEMY_DATABASE_URL = os.getenv("OMS_DATABASE_URL", "sqlite:///./oms.db")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+# Engine profiles
+#   sqlite_wal     - SQLite tuned for concurrent POS traffic (default for sqlite:// URLs)
+#   sqlite_default - SQLite with driver defaults (rollback journal, full fsync); kept for comparison
+#   server         - pooled client/server database such as PostgreSQL (default otherwise)
+PROFILES = ("sqlite_wal", "sqlite_default", "server")
+
+def default_profile(url: str) -> str:
+    return "sqlite_wal" if url.startswith("sqlite") else "server"
+
+DB_PROFILE = os.getenv("OMS_DB_PROFILE") or default_profile(SQLALCHEMY_DATABASE_URL)
+
+# Applied on every new connection in the sqlite_wal profile
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",  # readers no longer block the writer
+    "synchronous": "NORMAL",  # fsync at checkpoints, not every commit; safe with WAL
+    "busy_timeout": int(os.getenv("OMS_SQLITE_BUSY_TIMEOUT_MS", "5000")),  # wait for the write lock instead of failing
+    "cache_size": -int(os.getenv("OMS_SQLITE_CACHE_KB", "65536")),  # negative = KiB
+    "mmap_size": int(os.getenv("OMS_SQLITE_MMAP_BYTES", str(256 * 1024 * 1024))),
+    "temp_store": "MEMORY",
+}
+
+# Connection pool for the server profile (and the pooled SQLite connections)
+POOL_SETTINGS = {
+    "pool_size": int(os.getenv("OMS_DB_POOL_SIZE", "10")),
+    "max_overflow": int(os.getenv("OMS_DB_MAX_OVERFLOW", "20")),
+    "pool_timeout": float(os.getenv("OMS_DB_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.getenv("OMS_DB_POOL_RECYCLE", "1800")),
+    "pool_pre_ping": os.getenv("OMS_DB_POOL_PRE_PING", "1") == "1",
+}
+
+# Async drivers for the same database, used by the POS hot path
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+def to_async_url(url: str) -> str:
+    scheme, rest = url.split(":", 1)
+    dialect = scheme.split("+", 1)[0]
+    return ASYNC_DRIVERS.get(dialect, scheme) + ":" + rest
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+def create_engines(url: str = SQLALCHEMY_DATABASE_URL, profile: str = None):
+    # Returns (sync engine, async engine) for one database, configured by profile
+    profile = profile or default_profile(url)
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown database profile: {profile}")
+
+    kwargs = {}
+    if url.startswith("sqlite"):
+        kwargs["connect_args"] = {"check_same_thread": False}
+    if profile in ("sqlite_wal", "server"):
+        pool = dict(POOL_SETTINGS)
+        if profile == "sqlite_wal":
+            # Local file: nothing to pre-ping or recycle
+            pool.pop("pool_recycle")
+            pool["pool_pre_ping"] = False
+        kwargs.update(pool)
+
+    sync_engine = create_engine(url, **kwargs)
+    async_kwargs = {k: v for k, v in kwargs.items() if k != "connect_args"}
+    async_engine = create_async_engine(to_async_url(url), **async_kwargs)
+
+    if profile == "sqlite_wal":
+        event.listen(sync_engine, "connect", apply_sqlite_pragmas)
+        event.listen(async_engine.sync_engine, "connect", apply_sqlite_pragmas)
+    return sync_engine, async_engine
+
+engine, async_engine = create_engines(SQLALCHEMY_DATABASE_URL, DB_PROFILE)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async session for endpoints that must not block the event loop.
+# expire_on_commit=False: attributes stay readable after commit without lazy IO.
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -17,3 +95,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
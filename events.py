@@ -0,0 +1,85 @@
+import asyncio
+import threading
+from collections import defaultdict
+from typing import Optional
+
+import models
+
+# In-process pub/sub for POS terminal state.
+# Subscribers are SSE streams (one asyncio.Queue per open pos.html), grouped by outlet_id.
+# publish() is safe to call from sync endpoints running in the threadpool.
+# Events never leave the process: with several server workers a stream only sees
+# changes handled by its own worker, and pos.html falls back on a slow resync poll.
+# Run a single worker (the default) for live boards; main warns at startup otherwise.
+
+SUBSCRIBER_QUEUE_SIZE = 100
+
+# Queued in place of the backlog when a subscriber falls behind: the client refetches the whole outlet
+RESYNC = object()
+
+class TerminalEventBroker:
+    def __init__(self):
+        self._subscribers = defaultdict(set)  # outlet_id -> {(loop, queue)}
+        self._lock = threading.Lock()
+
+    def subscribe(self, outlet_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[outlet_id].add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, outlet_id: int, queue: asyncio.Queue):
+        with self._lock:
+            subs = self._subscribers.get(outlet_id)
+            if not subs:
+                return
+            for entry in [s for s in subs if s[1] is queue]:
+                subs.discard(entry)
+            if not subs:
+                del self._subscribers[outlet_id]
+
+    def subscriber_count(self, outlet_id: int = None) -> int:
+        with self._lock:
+            if outlet_id is not None:
+                return len(self._subscribers.get(outlet_id, ()))
+            return sum(len(s) for s in self._subscribers.values())
+
+    def publish(self, outlet_id: int, payload: dict):
+        with self._lock:
+            subs = list(self._subscribers.get(outlet_id, ()))
+        for loop, queue in subs:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, payload)
+            except RuntimeError:
+                # Loop already closed (client gone during shutdown)
+                pass
+
+def _offer(queue: asyncio.Queue, payload: dict):
+    # Slow consumer: never block the publisher. Each event is the snapshot of one terminal,
+    # so dropping any of them would lose that terminal's state; instead discard the whole
+    # backlog (this event included) and tell the client to reload every terminal.
+    if queue.full():
+        while not queue.empty():
+            queue.get_nowait()
+        payload = RESYNC
+    queue.put_nowait(payload)
+
+def terminal_snapshot(t: models.Terminal, player: Optional[models.Player], balance: float) -> dict:
+    # Event payload and /api/pos/terminals row for one terminal
+    player_info = None
+    if t.status == models.TerminalStatus.OCCUPIED and player:
+        player_info = {
+            "nickname": player.nickname,
+            "id": player.id,
+            "phone": player.phone
+        }
+    return {
+        "id": t.id,
+        "name": t.name,
+        "code": t.code,
+        "status": t.status,
+        "player": player_info,
+        "credits": balance if player_info else 0.0
+    }
+
+terminal_events = TerminalEventBroker()
@@ -0,0 +1,94 @@
+import csv
+import datetime
+import io
+import json
+import zlib
+from typing import Iterator, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import models
+from transactions import naive_utc
+
+# Streaming exports for finance. Rows come off a server-side cursor in batches
+# (yield_per) and are written out chunk by chunk, so memory stays flat no matter
+# how many rows match. The CSV header goes out before the query even runs.
+
+FORMATS = ("csv", "ndjson")
+# Rows per server-side fetch and per chunk sent to the client
+EXPORT_BATCH_ROWS = 1000
+
+TRANSACTION_COLUMNS = ["id", "timestamp", "type", "amount", "outlet_id", "terminal_id", "player_id", "staff_id"]
+BCF_LOG_COLUMNS = ["id", "timestamp", "type", "amount", "from_user_id", "target_outlet_id"]
+
+def _value(v):
+    if isinstance(v, datetime.datetime):
+        return v.isoformat()
+    return v
+
+def _encode_csv(rows, header=None) -> str:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if header:
+        writer.writerow(header)
+    writer.writerows([_value(v) for v in row] for row in rows)
+    return buf.getvalue()
+
+def _encode_ndjson(rows, names) -> str:
+    return "".join(json.dumps(dict(zip(names, map(_value, row)))) + "\n" for row in rows)
+
+def _text_chunks(db: Session, query, names, fmt: str) -> Iterator[str]:
+    if fmt == "csv":
+        yield _encode_csv([], header=names)
+    result = db.execute(query.execution_options(yield_per=EXPORT_BATCH_ROWS))
+    for rows in result.partitions():
+        yield _encode_csv(rows) if fmt == "csv" else _encode_ndjson(rows, names)
+
+def stream_rows(db: Session, query, names, fmt: str, compress: bool = False) -> Iterator[bytes]:
+    if not compress:
+        for chunk in _text_chunks(db, query, names, fmt):
+            yield chunk.encode()
+        return
+    # gzip container; sync-flush each chunk so the client receives data as it is produced
+    gz = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in _text_chunks(db, query, names, fmt):
+        yield gz.compress(chunk.encode()) + gz.flush(zlib.Z_SYNC_FLUSH)
+    yield gz.flush()
+
+def export_response(db: Session, query, names, fmt: str, compress: bool, basename: str) -> StreamingResponse:
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {fmt}")
+    filename = f"{basename}.{fmt}" + (".gz" if compress else "")
+    media_type = "application/gzip" if compress else ("text/csv" if fmt == "csv" else "application/x-ndjson")
+    return StreamingResponse(
+        stream_rows(db, query, names, fmt, compress),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-Accel-Buffering": "no"}
+    )
+
+def transaction_export_query(scoped):
+    # scoped: transactions.scoped_query(...); same filters, plain columns, oldest first
+    Txn = models.Transaction
+    return scoped.with_only_columns(*[getattr(Txn, c) for c in TRANSACTION_COLUMNS]).order_by(Txn.timestamp, Txn.id)
+
+def bcf_log_export_query(user, outlet_id: Optional[int] = None,
+                         start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None):
+    Log = models.BCFLog
+    query = select(*[getattr(Log, c) for c in BCF_LOG_COLUMNS])
+    if user.outlet_id:
+        if outlet_id is not None and outlet_id != user.outlet_id:
+            raise HTTPException(status_code=403, detail="Permission denied")
+        query = query.where(Log.target_outlet_id == user.outlet_id)
+    elif user.role_name != "Admin":
+        operator_outlets = select(models.Outlet.id).where(models.Outlet.operator_id == user.operator_id)
+        query = query.where(Log.target_outlet_id.in_(operator_outlets))
+    if outlet_id is not None:
+        query = query.where(Log.target_outlet_id == outlet_id)
+    if start is not None:
+        query = query.where(Log.timestamp >= naive_utc(start))
+    if end is not None:
+        query = query.where(Log.timestamp < naive_utc(end))
+    return query.order_by(Log.timestamp, Log.id)
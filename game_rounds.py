@@ -0,0 +1,166 @@
+import datetime
+import json
+import math
+import os
+from typing import List, Optional
+
+from fastapi import HTTPException, Request
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+import rollups
+from pairing import hash_device_token
+from transactions import naive_utc
+
+# Game round ingestion. A paired terminal posts NDJSON batches of its own rounds,
+# authenticated by the device token it received at pairing (X-Device-Token header):
+#   {"round_id": "...", "bet": 10, "win": 4, "ts": "<ISO 8601>", "hardware_id": "<optional, must match>"}
+# A batch is appended to game_rounds with one multi-row insert (re-sent rounds are
+# skipped by the (terminal, round_ref) key), and folded into Terminal and
+# OutletRollup totals, all in one commit. The body is capped while it streams in,
+# and round times far from now are refused so they cannot land in arbitrary buckets.
+
+DEVICE_TOKEN_HEADER = "X-Device-Token"
+MAX_INGEST_LINES = int(os.getenv("OMS_ROUNDS_MAX_LINES", "10000"))
+MAX_INGEST_BYTES = int(os.getenv("OMS_ROUNDS_MAX_BYTES", str(2 * 1024 * 1024)))
+# Accepted round times: up to MAX_AGE_HOURS old (devices buffer while offline), barely in the future
+MAX_AGE_HOURS = float(os.getenv("OMS_ROUNDS_MAX_AGE_HOURS", "72"))
+MAX_FUTURE_SECONDS = float(os.getenv("OMS_ROUNDS_MAX_FUTURE_SECONDS", "300"))
+MAX_ROUND_REF = 64
+
+_rounds = models.GameRound.__table__
+_terminals = models.Terminal.__table__
+
+# One UPDATE folds the whole batch into the terminal's totals
+_add_totals = (
+    update(_terminals)
+    .where(_terminals.c.id == bindparam("tid"))
+    .values(
+        bet_total=_terminals.c.bet_total + bindparam("bet"),
+        win_total=_terminals.c.win_total + bindparam("win"),
+        round_count=_terminals.c.round_count + bindparam("n"),
+    )
+)
+
+async def authenticate(db: AsyncSession, token: Optional[str]):
+    # -> (id, outlet_id, hardware_id) of the paired, active terminal holding this token
+    if not token:
+        raise HTTPException(status_code=401, detail=f"{DEVICE_TOKEN_HEADER} required")
+    terminal = (await db.execute(
+        select(models.Terminal.id, models.Terminal.outlet_id, models.Terminal.hardware_id, models.Terminal.is_active)
+        .where(models.Terminal.device_token_hash == hash_device_token(token), models.Terminal.is_paired == True)
+    )).first()
+    if terminal is None:
+        raise HTTPException(status_code=401, detail="Invalid device token")
+    if not terminal.is_active:
+        raise HTTPException(status_code=403, detail="Terminal is disabled")
+    return terminal
+
+async def read_body(request: Request) -> bytes:
+    # Stops reading as soon as the batch is over MAX_INGEST_BYTES
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > MAX_INGEST_BYTES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_INGEST_BYTES} bytes per batch")
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > MAX_INGEST_BYTES:
+            raise HTTPException(status_code=413, detail=f"At most {MAX_INGEST_BYTES} bytes per batch")
+    return bytes(body)
+
+def parse_lines(body: bytes) -> List[tuple]:
+    # -> [(line number, event dict or None, error or None)]; blank lines are skipped
+    try:
+        text = body.decode("utf-8")
+    except UnicodeDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Unreadable round batch: {e}")
+    parsed = []
+    for n, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            event = json.loads(line)
+        except ValueError:
+            parsed.append((n, None, "Invalid JSON"))
+            continue
+        if isinstance(event, dict):
+            parsed.append((n, event, None))
+        else:
+            parsed.append((n, None, "Expected a JSON object"))
+    if len(parsed) > MAX_INGEST_LINES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_INGEST_LINES} rounds per batch")
+    return parsed
+
+def _amount(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value < 0:
+        return None
+    return float(value)
+
+def _validate(event: dict, hardware_id: Optional[str], now: datetime.datetime):
+    # -> (round_ref, bet, win, played_at) or an error string
+    if event.get("hardware_id") is not None and event["hardware_id"] != hardware_id:
+        return "hardware_id does not match the device"
+    round_ref = event.get("round_id")
+    if isinstance(round_ref, int) and not isinstance(round_ref, bool):
+        round_ref = str(round_ref)
+    if not isinstance(round_ref, str) or not 1 <= len(round_ref) <= MAX_ROUND_REF:
+        return "round_id is required"
+    bet, win = _amount(event.get("bet")), _amount(event.get("win"))
+    if bet is None or win is None:
+        return "bet and win must be non-negative numbers"
+    played_at = now
+    if event.get("ts") is not None:
+        try:
+            played_at = naive_utc(datetime.datetime.fromisoformat(event["ts"]))
+        except (TypeError, ValueError):
+            return "Invalid ts"
+        if not now - datetime.timedelta(hours=MAX_AGE_HOURS) <= played_at <= now + datetime.timedelta(seconds=MAX_FUTURE_SECONDS):
+            return "ts out of range"
+    return round_ref, bet, win, played_at
+
+def _insert_new(dialect_name: str):
+    # Multi-row insert that skips rounds already stored; RETURNING gives only the new ones
+    if dialect_name == "postgresql":
+        stmt = postgresql.insert(_rounds).on_conflict_do_nothing(index_elements=["terminal_id", "round_ref"])
+    elif dialect_name == "sqlite":
+        stmt = sqlite.insert(_rounds).on_conflict_do_nothing(index_elements=["terminal_id", "round_ref"])
+    else:
+        stmt = insert(_rounds)
+    return stmt.returning(_rounds.c.terminal_id, _rounds.c.outlet_id, _rounds.c.bet, _rounds.c.win, _rounds.c.played_at)
+
+async def ingest(db: AsyncSession, terminal, lines: List[tuple]) -> dict:
+    # terminal: the authenticated (id, outlet_id, hardware_id) every round belongs to
+    now = datetime.datetime.utcnow()
+    rejected, rows, seen = [], [], set()
+    duplicates = 0
+    for n, event, error in lines:
+        checked = error or _validate(event, terminal.hardware_id, now)
+        if isinstance(checked, str):
+            rejected.append({"line": n, "error": checked})
+            continue
+        round_ref, bet, win, played_at = checked
+        if round_ref in seen:
+            duplicates += 1
+            continue
+        seen.add(round_ref)
+        rows.append({"terminal_id": terminal.id, "outlet_id": terminal.outlet_id, "round_ref": round_ref,
+                     "bet": bet, "win": win, "played_at": played_at})
+
+    # Append, then fold the rounds actually stored into the running totals
+    stored = []
+    if rows:
+        stored = (await db.execute(_insert_new(db.get_bind().dialect.name), rows)).all()
+        if stored:
+            await db.execute(_add_totals, {
+                "tid": terminal.id, "bet": sum(r.bet for r in stored), "win": sum(r.win for r in stored), "n": len(stored),
+            })
+            await rollups.record_rounds(db, [(outlet_id, played_at, bet, win) for _, outlet_id, bet, win, played_at in stored])
+        await db.commit()
+
+    return {
+        "accepted": len(stored),
+        "duplicates": duplicates + len(rows) - len(stored),
+        "rejected": rejected,
+    }
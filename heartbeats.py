@@ -0,0 +1,124 @@
+import asyncio
+import datetime
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import bcf
+import models
+from events import terminal_events, terminal_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Terminal heartbeats. Pings only touch an in-memory map (hardware_id -> last
+# ping); a background loop writes the map out as one batched UPDATE per flush
+# interval and marks silent terminals OFFLINE. Each worker process keeps its
+# own buffer; flushes only ever move last_seen forward in practice. Status
+# changes are pushed to open POS screens like any other terminal change.
+
+FLUSH_SECONDS = float(os.getenv("OMS_HEARTBEAT_FLUSH_SECONDS", "5"))
+OFFLINE_AFTER_SECONDS = float(os.getenv("OMS_TERMINAL_OFFLINE_SECONDS", "90"))
+SWEEP_SECONDS = float(os.getenv("OMS_TERMINAL_SWEEP_SECONDS", "15"))
+# Bound on distinct pending hardware ids; excess pings are dropped until the next flush
+MAX_PENDING = 100000
+
+_terminals = models.Terminal.__table__
+
+# Core (not ORM) statement so a list of parameter sets runs as one executemany
+_touch = (
+    update(_terminals)
+    .where(_terminals.c.hardware_id == bindparam("hw"))
+    .values(last_seen=bindparam("seen"))
+)
+
+def _snapshots(terminals):
+    # (outlet_id, payload) per changed terminal, taken before the commit so nothing is reloaded
+    return [(t.outlet_id, terminal_snapshot(t, None, 0.0)) for t in terminals]
+
+class HeartbeatBuffer:
+    def __init__(self):
+        self._pending = {}  # hardware_id -> datetime (UTC)
+        self._lock = threading.Lock()
+
+    def record(self, hardware_id: str, seen: datetime.datetime = None) -> bool:
+        seen = seen or datetime.datetime.utcnow()
+        with self._lock:
+            if hardware_id not in self._pending and len(self._pending) >= MAX_PENDING:
+                return False
+            self._pending[hardware_id] = seen
+        return True
+
+    def drain(self) -> dict:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    async def flush(self, db: AsyncSession) -> int:
+        # One executemany UPDATE and one commit, however many pings arrived
+        pending = self.drain()
+        if not pending:
+            return 0
+        await db.execute(_touch, [{"hw": hw, "seen": seen} for hw, seen in pending.items()])
+        # A ping brings an offline machine back; busy machines keep their state.
+        # Only terminals that pinged in this batch can be OFFLINE with so recent a last_seen.
+        revived = (await db.scalars(
+            update(models.Terminal)
+            .where(
+                models.Terminal.status == models.TerminalStatus.OFFLINE,
+                models.Terminal.last_seen >= min(pending.values()),
+            )
+            .values(status=models.TerminalStatus.IDLE)
+            .returning(models.Terminal)
+        )).all()
+        changes = _snapshots(revived)
+        await db.commit()
+        for outlet_id, payload in changes:
+            terminal_events.publish(outlet_id, payload)
+        return len(pending)
+
+async def sweep(db: AsyncSession, now: datetime.datetime = None) -> int:
+    # Idle terminals silent for OFFLINE_AFTER_SECONDS go OFFLINE. Occupied ones are left
+    # alone so the cashier can still settle the player's credits. Terminals that have
+    # never sent a heartbeat are not judged. Terminals going offline hand their BCF
+    # escrow back to the outlet, so float never sits on a machine nobody uses.
+    cutoff = (now or datetime.datetime.utcnow()) - datetime.timedelta(seconds=OFFLINE_AFTER_SECONDS)
+    offline = (await db.scalars(
+        update(models.Terminal)
+        .where(
+            models.Terminal.status == models.TerminalStatus.IDLE,
+            models.Terminal.last_seen != None,
+            models.Terminal.last_seen < cutoff,
+        )
+        .values(status=models.TerminalStatus.OFFLINE)
+        .returning(models.Terminal)
+    )).all()
+    await bcf.release(db, offline)
+    changes = _snapshots(offline)
+    await db.commit()
+    for outlet_id, payload in changes:
+        terminal_events.publish(outlet_id, payload)
+    return len(offline)
+
+async def run(session_factory):
+    # Background loop (started from the app lifespan)
+    last_sweep = time.monotonic()
+    while True:
+        await asyncio.sleep(FLUSH_SECONDS)
+        try:
+            async with session_factory() as db:
+                await heartbeat_buffer.flush(db)
+                if time.monotonic() - last_sweep >= SWEEP_SECONDS:
+                    last_sweep = time.monotonic()
+                    await sweep(db)
+        except Exception:
+            logger.exception("heartbeat_flush_failed")
+
+heartbeat_buffer = HeartbeatBuffer()
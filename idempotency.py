@@ -0,0 +1,117 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import logging
+import os
+from typing import NamedTuple, Optional
+
+from fastapi import HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Idempotency-Key support for the POS writes (bind, deposit, settle).
+# The response of a completed write is stored in idempotency_records in the same
+# transaction as the write, so a write and its record commit or fail together.
+# A retry with the same key gets the stored response and touches no balances.
+# Two copies racing each other both run, but only one can insert the record;
+# the loser's whole transaction rolls back and it replays the winner's response.
+# A key reused with different request parameters is rejected with 422, never replayed.
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+TTL_SECONDS = float(os.getenv("OMS_IDEMPOTENCY_TTL_SECONDS", "86400"))
+CACHE_SIZE = int(os.getenv("OMS_IDEMPOTENCY_CACHE_SIZE", "10000"))
+PURGE_SECONDS = 3600
+
+Record = models.IdempotencyRecord
+
+# Hot replays are served without a DB read
+response_cache = TTLCache(maxsize=CACHE_SIZE, ttl=TTL_SECONDS)
+
+class ScopedKey(NamedTuple):
+    key: str
+    request_hash: str
+
+def scoped_key(request: Request, user, endpoint: str, params) -> Optional[ScopedKey]:
+    # params: the parsed request (model or dict); its hash is stored with the record
+    key = request.headers.get(HEADER)
+    if not key:
+        return None
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"{HEADER} too long")
+    canonical = json.dumps(jsonable_encoder(params), sort_keys=True, separators=(",", ":"))
+    # Keys are per user and per endpoint
+    return ScopedKey(f"{user.id}:{endpoint}:{key}", hashlib.sha256(canonical.encode()).hexdigest())
+
+def _check(key: ScopedKey, request_hash: str):
+    if request_hash != key.request_hash:
+        raise HTTPException(status_code=422, detail=f"{HEADER} was already used for a different request")
+
+def replay(response: dict) -> JSONResponse:
+    return JSONResponse(response, headers={"Idempotent-Replayed": "true"})
+
+async def lookup(db: AsyncSession, key: Optional[ScopedKey]) -> Optional[dict]:
+    if key is None:
+        return None
+    cached = response_cache.get(key.key)
+    if cached is not None:
+        _check(key, cached[0])
+        return cached[1]
+    row = (await db.execute(select(Record.response, Record.request_hash, Record.expires_at).where(Record.key == key.key))).first()
+    if row is None:
+        return None
+    if row.expires_at <= datetime.datetime.utcnow():
+        # Stale: drop it so this request can store a fresh record (commits with the write)
+        await db.execute(delete(Record).where(Record.key == key.key))
+        return None
+    _check(key, row.request_hash)
+    response = json.loads(row.response)
+    response_cache.set(key.key, (row.request_hash, response))
+    return response
+
+async def commit(db: AsyncSession, key: Optional[ScopedKey], response: dict):
+    # Commit the pending write together with its record.
+    # Returns (response to send, applied). applied is False when a concurrent
+    # request with the same key won; nothing of this request was committed.
+    if key is None:
+        await db.commit()
+        return response, True
+    now = datetime.datetime.utcnow()
+    db.add(Record(
+        key=key.key, request_hash=key.request_hash, response=json.dumps(response),
+        created_at=now, expires_at=now + datetime.timedelta(seconds=TTL_SECONDS),
+    ))
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        winner = await lookup(db, key)
+        if winner is None:
+            raise
+        return winner, False
+    response_cache.set(key.key, (key.request_hash, response))
+    return response, True
+
+async def purge_expired(db: AsyncSession) -> int:
+    result = await db.execute(delete(Record).where(Record.expires_at <= datetime.datetime.utcnow()))
+    await db.commit()
+    return result.rowcount
+
+async def run(session_factory):
+    # Background loop (started from the app lifespan)
+    while True:
+        await asyncio.sleep(PURGE_SECONDS)
+        try:
+            async with session_factory() as db:
+                await purge_expired(db)
+        except Exception:
+            logger.exception("idempotency_purge_failed")
@@ -0,0 +1,156 @@
+import ipaddress
+import logging
+import re
+import threading
+import time
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import models
+
+logger = logging.getLogger(__name__)
+
+# In-memory IP whitelist compiled from IPWhitelist rows (global or per outlet)
+# and each Outlet.ip_whitelist free-text list. Entries may be single addresses
+# or CIDR blocks. A lookup walks one binary trie per scope: O(prefix length).
+
+# Rebuild at least this often so changes made by other worker processes show up
+REFRESH_SECONDS = 60
+
+class PrefixTrie:
+    __slots__ = ("root",)
+
+    def __init__(self):
+        # Node: [child_0, child_1, terminal]
+        self.root = [None, None, False]
+
+    def insert(self, network):
+        node = self.root
+        bits = int(network.network_address)
+        width = network.max_prefixlen
+        for i in range(network.prefixlen):
+            bit = (bits >> (width - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, False]
+            node = node[bit]
+            if node[2]:
+                # A shorter prefix already covers this block
+                return
+        node[2] = True
+
+    def contains(self, address) -> bool:
+        node = self.root
+        if node[2]:
+            return True
+        bits = int(address)
+        width = address.max_prefixlen
+        for i in range(width):
+            node = node[(bits >> (width - 1 - i)) & 1]
+            if node is None:
+                return False
+            if node[2]:
+                return True
+        return False
+
+def parse_entry(entry: str):
+    entry = entry.strip()
+    if not entry:
+        return None
+    try:
+        return ipaddress.ip_network(entry, strict=False)
+    except ValueError:
+        return None
+
+def split_entries(text: Optional[str]):
+    # Outlet.ip_whitelist is free text: accept commas, semicolons, whitespace or newlines
+    if not text:
+        return []
+    return [e for e in re.split(r"[,;\s]+", text) if e]
+
+def normalize_ip(ip: Optional[str]):
+    if not ip:
+        return None
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    if address.version == 6:
+        if address.ipv4_mapped:
+            return address.ipv4_mapped
+        if address.is_loopback:
+            # In prototype, localhost might be ::1 or 127.0.0.1
+            return ipaddress.ip_address("127.0.0.1")
+    return address
+
+class WhitelistIndex:
+    def __init__(self):
+        self._global = {4: PrefixTrie(), 6: PrefixTrie()}
+        self._outlets = {}
+        self.loaded_at = None
+        self._lock = threading.Lock()
+
+    def build(self, entries: Iterable[Tuple[str, Optional[int]]]):
+        # entries: (ip or CIDR, outlet_id or None for global). Invalid entries are skipped.
+        global_tries = {4: PrefixTrie(), 6: PrefixTrie()}
+        outlet_tries = {}
+        skipped = []
+        for spec, outlet_id in entries:
+            network = parse_entry(spec)
+            if network is None:
+                skipped.append(spec)
+                continue
+            if outlet_id is None:
+                tries = global_tries
+            else:
+                tries = outlet_tries.setdefault(outlet_id, {4: PrefixTrie(), 6: PrefixTrie()})
+            tries[network.version].insert(network)
+        # Swap in whole so readers never see a half-built index
+        self._global, self._outlets = global_tries, outlet_tries
+        self.loaded_at = time.monotonic()
+        return skipped
+
+    def is_allowed(self, ip: Optional[str], outlet_id: Optional[int] = None) -> bool:
+        address = normalize_ip(ip)
+        if address is None:
+            return False
+        if self._global[address.version].contains(address):
+            return True
+        if outlet_id is not None:
+            tries = self._outlets.get(outlet_id)
+            if tries and tries[address.version].contains(address):
+                return True
+        return False
+
+    def _load(self, ip_rows, outlet_rows):
+        entries = [(ip, outlet_id) for ip, outlet_id in ip_rows]
+        for outlet_id, text in outlet_rows:
+            entries.extend((spec, outlet_id) for spec in split_entries(text))
+        with self._lock:
+            skipped = self.build(entries)
+        if skipped:
+            logger.warning("ip_whitelist_invalid_entries skipped=%s", skipped)
+
+    def needs_reload(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > REFRESH_SECONDS
+
+    def reload(self, db: Session):
+        self._load(db.execute(_IP_ROWS).all(), db.execute(_OUTLET_ROWS).all())
+
+    async def reload_async(self, db: AsyncSession):
+        self._load((await db.execute(_IP_ROWS)).all(), (await db.execute(_OUTLET_ROWS)).all())
+
+    def ensure_loaded(self, db: Session):
+        if self.needs_reload():
+            self.reload(db)
+
+    async def ensure_loaded_async(self, db: AsyncSession):
+        if self.needs_reload():
+            await self.reload_async(db)
+
+_IP_ROWS = select(models.IPWhitelist.ip_address, models.IPWhitelist.outlet_id)
+_OUTLET_ROWS = select(models.Outlet.id, models.Outlet.ip_whitelist).where(models.Outlet.ip_whitelist != None)
+
+whitelist = WhitelistIndex()
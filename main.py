@@ -1,19 +1,58 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Request, Form
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import FastAPI, Depends, HTTPException, status, Request, Form, Query
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import and_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List, Optional
-import models, schemas, auth
-from database import engine, get_db
+import models, schemas, auth, bcf, rollups, transactions, exports, provisioning, staff_import, heartbeats, pairing, idempotency, pos_batch, write_behind, game_rounds, metrics
+from database import engine, get_db, get_async_db, AsyncSessionLocal
+from events import RESYNC, terminal_events, terminal_snapshot
+from ip_whitelist import whitelist
 from datetime import timedelta, datetime
+import asyncio
+import json
+from contextlib import asynccontextmanager
+import logging
 import os
 
+# Application logs as key=value pairs after the level and logger name
+logging.basicConfig(
+    level=os.getenv("OMS_LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s level=%(levelname)s logger=%(name)s %(message)s",
+)
+
 models.Base.metadata.create_all(bind=engine)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Background work: heartbeat flushes, the offline sweeper, expired pairing codes,
+    # idempotency records and (optionally) the log write-behind queue
+    if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+        logging.getLogger(__name__).warning(
+            "terminal_events_single_process workers=%s: POS streams only see their own worker's changes",
+            os.getenv("WEB_CONCURRENCY"))
+    loops = [heartbeats.run, pairing.run, idempotency.run]
+    if write_behind.ENABLED:
+        loops.append(write_behind.writer.run)
+    tasks = [asyncio.create_task(loop(AsyncSessionLocal)) for loop in loops]
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if write_behind.ENABLED:
+            await write_behind.writer.drain(AsyncSessionLocal)
+        await asyncio.to_thread(auth.shutdown_bulk_hashing)
+
 # Trigger redeploy for Render
-app = FastAPI(title="OMS Prototype")
+app = FastAPI(title="OMS Prototype", lifespan=lifespan)
+if metrics.ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
@@ -21,54 +60,77 @@ templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
 
 # --- API Endpoints ---
 
-@app.post("/token", response_model=schemas.Token)
-async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    # 1. IP Check
-    # await auth.check_ip_whitelist(request, db)  # Disabled for public prototype demo
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    # Prometheus scrape target (metrics.py)
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics disabled")
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
-    # 2. Auth
-    user = db.query(models.User).options(auth.joinedload(models.User.role)).filter(models.User.username == form_data.username).first()
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+@app.post("/token", response_model=schemas.Token)
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    # 1. Auth
+    result = await db.execute(select(models.User).options(auth.joinedload(models.User.role)).where(models.User.username == form_data.username))
+    user = result.scalars().first()
+    if user:
+        user_id, hashed_password, outlet_id = user.id, user.hashed_password, user.outlet_id
+        role_name = user.role.name if user.role else "Unknown"
+
+    # 2. IP Check (OMS_IP_WHITELIST_ENABLED; in-memory, scoped to the user's outlet)
+    await auth.check_ip_whitelist_async(request, db, outlet_id=user.outlet_id if user else None)
+    # Hand the connection back to the pool before the slow hash check
+    await db.rollback()
+    
+    valid, new_hash = (False, None)
+    if user:
+        # bcrypt runs on the bounded hash pool, not the event loop
+        valid, new_hash = await auth.verify_password_async(form_data.password, hashed_password)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    role_name = user.role.name if user.role else "Unknown"
+    if new_hash:
+        # Stored hash uses an old cost factor; upgrade it transparently
+        await db.execute(update(models.User).where(models.User.id == user_id).values(hashed_password=new_hash))
+        await db.commit()
     
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
-        data={"sub": user.username, "role": role_name, "outlet_id": user.outlet_id}, expires_delta=access_token_expires
+        data={"sub": form_data.username, "role": role_name, "outlet_id": outlet_id}, expires_delta=access_token_expires
     )
-    return {"access_token": access_token, "token_type": "bearer", "role": role_name, "outlet_id": user.outlet_id}
+    return {"access_token": access_token, "token_type": "bearer", "role": role_name, "outlet_id": outlet_id}
 
 # --- Settings APIs ---
 
 @app.get("/api/settings/ip_whitelist", response_model=List[schemas.IPWhitelistOut])
-def get_ip_whitelist(current_user: models.User = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
+def get_ip_whitelist(current_user: auth.Principal = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
     return db.query(models.IPWhitelist).all()
 
 @app.post("/api/settings/ip_whitelist", response_model=schemas.IPWhitelistOut)
-def create_ip_whitelist(ip: schemas.IPWhitelistCreate, current_user: models.User = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
+def create_ip_whitelist(ip: schemas.IPWhitelistCreate, current_user: auth.Principal = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
     db_ip = models.IPWhitelist(**ip.dict())
     db.add(db_ip)
     db.commit()
+    whitelist.reload(db)
     db.refresh(db_ip)
     return db_ip
 
 @app.delete("/api/settings/ip_whitelist/{id}")
-def delete_ip_whitelist(id: int, current_user: models.User = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
+def delete_ip_whitelist(id: int, current_user: auth.Principal = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
     db.query(models.IPWhitelist).filter(models.IPWhitelist.id == id).delete()
     db.commit()
+    whitelist.reload(db)
     return {"message": "Deleted"}
 
 @app.get("/api/settings/config")
-def get_system_config(current_user: models.User = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
+def get_system_config(current_user: auth.Principal = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
     return db.query(models.SystemConfig).all()
 
 @app.post("/api/settings/config")
-def update_system_config(key: str = Form(...), value: str = Form(...), current_user: models.User = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
+def update_system_config(key: str = Form(...), value: str = Form(...), current_user: auth.Principal = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
     config = db.query(models.SystemConfig).filter(models.SystemConfig.key == key).first()
     if config:
         config.value = value
@@ -78,20 +140,24 @@ def update_system_config(key: str = Form(...), value: str = Form(...), current_u
     db.commit()
     return {"message": "Config updated", "key": key, "value": value}
 
+@app.get("/api/system/write_behind")
+def get_write_behind_stats(current_user: auth.Principal = Depends(auth.require_permission("SETTINGS_MANAGE"))):
+    # Queue depth and flush counters of the log write-behind queue (OMS_LOG_WRITE_BEHIND)
+    return write_behind.writer.stats()
+
 # --- Terminal Management ---
-import secrets
 
 @app.get("/api/terminals", response_model=List[schemas.TerminalOut])
 def get_terminals(
     outlet_id: Optional[int] = None, 
     status: Optional[str] = None,
-    current_user: models.User = Depends(auth.require_permission("SETTINGS_MANAGE")), 
+    current_user: auth.Principal = Depends(auth.require_permission("SETTINGS_MANAGE")), 
     db: Session = Depends(get_db)
 ):
     query = db.query(models.Terminal)
     
     # Filter by Scope
-    if current_user.role.name == "Operator":
+    if current_user.role_name == "Operator":
         # Get outlets for this operator
         # Simplifying: Operator manages Terminals for their outlets.
         # Ideally we join outlets, but for prototype let's rely on passed outlet_id if user is admin/operator
@@ -115,14 +181,12 @@ def get_terminals(
 @app.post("/api/terminals", response_model=schemas.TerminalOut)
 def create_terminal(
     term: schemas.TerminalCreate,
-    current_user: models.User = Depends(auth.require_permission("SETTINGS_MANAGE")),
+    current_user: auth.Principal = Depends(auth.require_permission("SETTINGS_MANAGE")),
     db: Session = Depends(get_db)
 ):
-    # System Generate Code
-    # Format: T-{outlet_id}-{seq} or Random? PRD says generate unique.
-    # Let's use simple random for prototype or T-{timestamp}
-    import time
-    code = f"T-{int(time.time()*1000)}"
+    # System Generate Code from the outlet's counter (see provisioning.py)
+    outlet = provisioning.outlet_in_scope(db, current_user, term.outlet_id)
+    code = provisioning.allocate_code(db, outlet)
     
     db_term = models.Terminal(
         name=term.name,
@@ -135,11 +199,20 @@ def create_terminal(
     db.refresh(db_term)
     return db_term
 
+@app.post("/api/terminals/bulk", response_model=List[schemas.TerminalBulkOut])
+def create_terminals_bulk(
+    req: schemas.TerminalBulkCreate,
+    current_user: auth.Principal = Depends(auth.require_permission("SETTINGS_MANAGE")),
+    db: Session = Depends(get_db)
+):
+    outlet = provisioning.outlet_in_scope(db, current_user, req.outlet_id)
+    return provisioning.create_terminals(db, outlet, count=req.count, names=req.names)
+
 @app.put("/api/terminals/{id}", response_model=schemas.TerminalOut)
 def update_terminal(
     id: int, 
     term_update: schemas.TerminalCreate, # Reusing Create schema for simplicity, or create Update schema
-    current_user: models.User = Depends(auth.require_permission("SETTINGS_MANAGE")),
+    current_user: auth.Principal = Depends(auth.require_permission("SETTINGS_MANAGE")),
     db: Session = Depends(get_db)
 ):
     term = db.query(models.Terminal).filter(models.Terminal.id == id).first()
@@ -152,10 +225,29 @@ def update_terminal(
     db.refresh(term)
     return term
 
+@app.post("/api/terminals/heartbeat", status_code=202)
+async def terminal_heartbeat(request: Request, db: AsyncSession = Depends(get_async_db)):
+    # Paired machines ping with their device token (same check as round ingest).
+    # One indexed read per ping; the last_seen writes are buffered and batched (heartbeats.py)
+    terminal = await game_rounds.authenticate(db, request.headers.get(game_rounds.DEVICE_TOKEN_HEADER))
+    await db.rollback()
+    if not heartbeats.heartbeat_buffer.record(terminal.hardware_id):
+        raise HTTPException(status_code=503, detail="Heartbeat buffer full")
+    return {"accepted": True}
+
+@app.post("/api/rounds/ingest", response_model=schemas.RoundIngestReport)
+async def ingest_rounds(request: Request, db: AsyncSession = Depends(get_async_db)):
+    # Paired machines post NDJSON bet/win rounds in batches (game_rounds.py)
+    terminal = await game_rounds.authenticate(db, request.headers.get(game_rounds.DEVICE_TOKEN_HEADER))
+    # Hand the connection back to the pool while the batch uploads
+    await db.rollback()
+    lines = game_rounds.parse_lines(await game_rounds.read_body(request))
+    return await game_rounds.ingest(db, terminal, lines)
+
 @app.post("/api/terminals/{id}/pair")
 def generate_pairing_code(
     id: int,
-    current_user: models.User = Depends(auth.require_permission("SETTINGS_MANAGE")),
+    current_user: auth.Principal = Depends(auth.require_permission("SETTINGS_MANAGE")),
     db: Session = Depends(get_db)
 ):
     term = db.query(models.Terminal).filter(models.Terminal.id == id).first()
@@ -165,17 +257,26 @@ def generate_pairing_code(
     if not term.is_active:
         raise HTTPException(status_code=400, detail="Terminal is disabled")
         
-    code = secrets.token_hex(3).upper()
-    term.pairing_code = code
-    term.pairing_expires_at = datetime.utcnow() + timedelta(minutes=10)
+    code = pairing.issue_code(db, term)
     db.commit()
     
     return {"pairing_code": code, "expires_at": term.pairing_expires_at}
 
+@app.post("/api/terminals/pair/redeem")
+async def redeem_pairing_code(req: schemas.TerminalBind, db: AsyncSession = Depends(get_async_db)):
+    # Called by the device itself: pairing_key is the code shown in the admin UI
+    paired = await pairing.redeem(db, req.pairing_key, req.hardware_id)
+    if paired is None:
+        raise HTTPException(status_code=400, detail="Invalid or expired pairing code")
+    terminal, device_token = paired
+    # device_token is shown only once; the device sends it with every round batch
+    return {"terminal_id": terminal.id, "code": terminal.code, "name": terminal.name, "outlet_id": terminal.outlet_id,
+            "device_token": device_token}
+
 @app.post("/api/terminals/{id}/unpair")
 def unpair_terminal(
     id: int,
-    current_user: models.User = Depends(auth.require_permission("SETTINGS_MANAGE")),
+    current_user: auth.Principal = Depends(auth.require_permission("SETTINGS_MANAGE")),
     db: Session = Depends(get_db)
 ):
     term = db.query(models.Terminal).filter(models.Terminal.id == id).first()
@@ -184,69 +285,107 @@ def unpair_terminal(
         
     term.is_paired = False
     term.hardware_id = None
+    term.device_token_hash = None
     term.pairing_code = None
     db.commit()
     return {"message": "Unpaired successfully"}
 
+def _with_player_and_wallet(query):
+    # Terminal -> current Player -> that player's Wallet at the terminal's outlet, in one SELECT
+    return query.outerjoin(
+        models.Player, models.Player.id == models.Terminal.current_player_id
+    ).outerjoin(
+        models.Wallet, and_(
+            models.Wallet.player_id == models.Terminal.current_player_id,
+            models.Wallet.outlet_id == models.Terminal.outlet_id
+        )
+    )
+
 @app.get("/api/pos/terminals")
-def get_pos_terminals(
-    current_user: models.User = Depends(auth.require_permission("POS_OPERATE")), 
-    db: Session = Depends(get_db)
+async def get_pos_terminals(
+    current_user: auth.Principal = Depends(auth.require_whitelisted_ip(auth.require_permission("POS_OPERATE", auth.get_current_user_async))), 
+    db: AsyncSession = Depends(get_async_db)
 ):
     if not current_user.outlet_id:
         raise HTTPException(status_code=400, detail="User must belong to an outlet")
         
-    terms = db.query(models.Terminal).filter(
-        models.Terminal.outlet_id == current_user.outlet_id,
-        models.Terminal.is_active == True
-    ).all()
+    rows = (await db.execute(
+        _with_player_and_wallet(
+            select(models.Terminal, models.Player, models.Wallet)
+        ).where(
+            models.Terminal.outlet_id == current_user.outlet_id,
+            models.Terminal.is_active == True
+        )
+    )).all()
     
     res = []
-    for t in terms:
-        player_info = None
-        balance = 0.0
-        if t.status == models.TerminalStatus.OCCUPIED and t.current_player_id:
-            # Get nickname
-            player = db.query(models.Player).filter(models.Player.id == t.current_player_id).first()
-            if player:
-                # Get wallet for this outlet
-                wallet = db.query(models.Wallet).filter(
-                    models.Wallet.player_id == player.id,
-                    models.Wallet.outlet_id == current_user.outlet_id
-                ).first()
-                balance = wallet.balance if wallet else 0.0
-                player_info = {
-                    "nickname": player.nickname,
-                    "id": player.id,
-                    "phone": player.phone
-                }
-        
-        res.append({
-            "id": t.id,
-            "name": t.name,
-            "code": t.code,
-            "status": t.status,
-            "player": player_info,
-            "credits": balance
-        })
+    for t, player, wallet in rows:
+        balance = wallet.balance if wallet else 0.0
+        res.append(terminal_snapshot(t, player, balance))
     return res
 
+STREAM_KEEPALIVE_SECONDS = 15
+
+@app.get("/api/pos/terminals/stream")
+async def stream_pos_terminals(request: Request, token: str):
+    # EventSource cannot send an Authorization header, so the JWT comes in as ?token=.
+    # Own short session, not Depends(get_async_db): a dependency session would hold its
+    # pooled connection for as long as the stream stays open.
+    async with AsyncSessionLocal() as db:
+        current_user = await auth.get_current_user_async(token, db)
+        auth.check_permission(current_user, "POS_OPERATE")
+        await auth.check_ip_whitelist_async(request, db, outlet_id=current_user.outlet_id)
+    if not current_user.outlet_id:
+        raise HTTPException(status_code=400, detail="User must belong to an outlet")
+    outlet_id = current_user.outlet_id
+
+    async def event_source():
+        queue = terminal_events.subscribe(outlet_id)
+        try:
+            # Tell the browser how long to wait before reconnecting
+            yield "retry: 3000\n\n"
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    payload = await asyncio.wait_for(queue.get(), timeout=STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+                    continue
+                if payload is RESYNC:
+                    yield "event: resync\ndata: {}\n\n"
+                    continue
+                yield f"event: terminal\ndata: {json.dumps(payload)}\n\n"
+        finally:
+            terminal_events.unsubscribe(outlet_id, queue)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.delete("/api/terminals/{id}")
-def delete_terminal(id: int, current_user: models.User = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
+def delete_terminal(id: int, current_user: auth.Principal = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
+    term = db.query(models.Terminal).filter(models.Terminal.id == id).first()
+    if term:
+        # Don't lose float held by the machine
+        bcf.reclaim(db, term.outlet_id, term.id)
     db.query(models.Terminal).filter(models.Terminal.id == id).delete()
     db.commit()
     return {"message": "Deleted"}
 
 @app.get("/api/roles", response_model=List[schemas.RoleOut])
-def get_roles(current_user: models.User = Depends(auth.require_permission("USER_CREATE")), db: Session = Depends(get_db)):
+def get_roles(current_user: auth.Principal = Depends(auth.require_permission("USER_CREATE")), db: Session = Depends(get_db)):
     return db.query(models.Role).options(auth.joinedload(models.Role.permissions)).all()
 
 @app.get("/api/permissions", response_model=List[schemas.PermissionOut])
-def get_permissions(current_user: models.User = Depends(auth.require_permission("USER_CREATE")), db: Session = Depends(get_db)):
+def get_permissions(current_user: auth.Principal = Depends(auth.require_permission("USER_CREATE")), db: Session = Depends(get_db)):
     return db.query(models.Permission).all()
 
 @app.put("/api/roles/{role_id}")
-def update_role(role_id: int, role_data: schemas.RoleCreate, current_user: models.User = Depends(auth.require_permission("USER_CREATE")), db: Session = Depends(get_db)):
+def update_role(role_id: int, role_data: schemas.RoleCreate, current_user: auth.Principal = Depends(auth.require_permission("USER_CREATE")), db: Session = Depends(get_db)):
     role = db.query(models.Role).filter(models.Role.id == role_id).first()
     if not role:
         raise HTTPException(status_code=404, detail="Role not found")
@@ -266,11 +405,12 @@ def update_role(role_id: int, role_data: schemas.RoleCreate, current_user: model
             role.permissions.append(perm)
             
     db.commit()
+    auth.invalidate_principals()
     db.refresh(role)
     return role
 
 @app.delete("/api/roles/{role_id}")
-def delete_role(role_id: int, current_user: models.User = Depends(auth.require_permission("USER_CREATE")), db: Session = Depends(get_db)):
+def delete_role(role_id: int, current_user: auth.Principal = Depends(auth.require_permission("USER_CREATE")), db: Session = Depends(get_db)):
     role = db.query(models.Role).filter(models.Role.id == role_id).first()
     if not role:
         raise HTTPException(status_code=404, detail="Role not found")
@@ -282,10 +422,11 @@ def delete_role(role_id: int, current_user: models.User = Depends(auth.require_p
         
     db.delete(role)
     db.commit()
+    auth.invalidate_principals()
     return {"message": "Role deleted"}
 
 @app.post("/api/roles", response_model=schemas.RoleOut)
-def create_role(role: schemas.RoleCreate, current_user: models.User = Depends(auth.require_permission("USER_CREATE")), db: Session = Depends(get_db)):
+def create_role(role: schemas.RoleCreate, current_user: auth.Principal = Depends(auth.require_permission("USER_CREATE")), db: Session = Depends(get_db)):
     # Check if role exists
     existing = db.query(models.Role).filter(models.Role.name == role.name).first()
     if existing:
@@ -301,39 +442,34 @@ def create_role(role: schemas.RoleCreate, current_user: models.User = Depends(au
             
     db.add(new_role)
     db.commit()
+    auth.invalidate_principals()
     db.refresh(new_role)
     return new_role
 
 @app.get("/api/users", response_model=List[schemas.UserOut])
-def get_users(current_user: models.User = Depends(auth.require_permission("USER_CREATE")), db: Session = Depends(get_db)):
+def get_users(current_user: auth.Principal = Depends(auth.require_permission("USER_CREATE")), db: Session = Depends(get_db)):
     query = db.query(models.User).options(auth.joinedload(models.User.role))
     
     # Scope Guard: Filter users based on hierarchy
-    if current_user.role.name == "Operator":
+    if current_user.role_name == "Operator":
         # Can see users in their operator scope (including themselves, or their staff)
         # For simplicity, let's say they can see users linked to their outlets or operator_id
         # But User model has operator_id.
         query = query.filter(models.User.operator_id == current_user.operator_id)
-    elif current_user.role.name == "Store Mgr":
+    elif current_user.role_name == "Store Mgr":
         query = query.filter(models.User.outlet_id == current_user.outlet_id)
     
     return query.all()
 
 @app.post("/api/users", response_model=schemas.UserOut)
-def create_user(user: schemas.UserCreate, current_user: models.User = Depends(auth.require_permission("USER_CREATE")), db: Session = Depends(get_db)):
+def create_user(user: schemas.UserCreate, current_user: auth.Principal = Depends(auth.require_permission("USER_CREATE")), db: Session = Depends(get_db)):
     # 1. Level Guard
     target_role = db.query(models.Role).filter(models.Role.id == user.role_id).first()
     if not target_role:
         raise HTTPException(status_code=400, detail="Role not found")
     
-    creator_role = current_user.role.name
-    allowed_creation = {
-        "Admin": ["Admin", "Operator", "Area Mgr", "Store Mgr", "Cashier"],
-        "Operator": ["Area Mgr", "Store Mgr", "Cashier"],
-        "Store Mgr": ["Cashier"]
-    }
-    
-    if target_role.name not in allowed_creation.get(creator_role, []):
+    creator_role = current_user.role_name
+    if target_role.name not in auth.ALLOWED_CREATION.get(creator_role, []):
         raise HTTPException(status_code=403, detail=f"Level Guard: {creator_role} cannot create {target_role.name}")
 
     # 2. Scope Guard & Auto-Assign
@@ -353,7 +489,7 @@ def create_user(user: schemas.UserCreate, current_user: models.User = Depends(au
     
     db_user = models.User(
         username=user.username,
-        hashed_password=auth.get_password_hash(user.password),
+        hashed_password=auth.get_password_hash_pooled(user.password),
         role_id=user.role_id,
         outlet_id=final_outlet_id,
         operator_id=final_operator_id
@@ -363,36 +499,43 @@ def create_user(user: schemas.UserCreate, current_user: models.User = Depends(au
     db.refresh(db_user)
     return db_user
 
+@app.post("/api/users/import", response_model=schemas.UserImportReport)
+async def import_users(request: Request, current_user: auth.Principal = Depends(auth.require_permission("USER_CREATE")), db: Session = Depends(get_db)):
+    # Body is the raw file: text/csv or application/json
+    rows = staff_import.parse_rows(await request.body(), request.headers.get("content-type", ""))
+    return await run_in_threadpool(staff_import.import_users, db, current_user, rows)
+
 @app.put("/api/users/{id}", response_model=schemas.UserOut)
-def update_user(id: int, user: schemas.UserCreate, current_user: models.User = Depends(auth.require_permission("USER_CREATE")), db: Session = Depends(get_db)):
+def update_user(id: int, user: schemas.UserCreate, current_user: auth.Principal = Depends(auth.require_permission("USER_CREATE")), db: Session = Depends(get_db)):
     db_user = db.query(models.User).filter(models.User.id == id).first()
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
     
     # Simple scope check (can be improved)
-    if current_user.role.name == "Operator" and db_user.operator_id != current_user.operator_id:
+    if current_user.role_name == "Operator" and db_user.operator_id != current_user.operator_id:
          raise HTTPException(status_code=403, detail="Not in your scope")
          
     db_user.username = user.username
     if user.password:
-        db_user.hashed_password = auth.get_password_hash(user.password)
+        db_user.hashed_password = auth.get_password_hash_pooled(user.password)
     db_user.role_id = user.role_id
     db_user.outlet_id = user.outlet_id
     db_user.operator_id = user.operator_id
     
     db.commit()
+    auth.invalidate_principals(user_id=db_user.id)
     db.refresh(db_user)
     return db_user
 
 @app.get("/api/operators", response_model=List[schemas.OperatorOut])
-def get_operators(current_user: models.User = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
-    if current_user.role.name != "Admin":
+def get_operators(current_user: auth.Principal = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
+    if current_user.role_name != "Admin":
         raise HTTPException(status_code=403, detail="Only Admin can view operators")
     return db.query(models.Operator).all()
 
 @app.post("/api/operators", response_model=schemas.OperatorOut)
-def create_operator(op: schemas.OperatorCreate, current_user: models.User = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
-    if current_user.role.name != "Admin":
+def create_operator(op: schemas.OperatorCreate, current_user: auth.Principal = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
+    if current_user.role_name != "Admin":
         raise HTTPException(status_code=403, detail="Only Admin can create operators")
     db_op = models.Operator(
         name=op.name, 
@@ -406,8 +549,8 @@ def create_operator(op: schemas.OperatorCreate, current_user: models.User = Depe
     return db_op
 
 @app.put("/api/operators/{id}", response_model=schemas.OperatorOut)
-def update_operator(id: int, op: schemas.OperatorCreate, current_user: models.User = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
-    if current_user.role.name != "Admin":
+def update_operator(id: int, op: schemas.OperatorCreate, current_user: auth.Principal = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
+    if current_user.role_name != "Admin":
         raise HTTPException(status_code=403, detail="Only Admin can update operators")
     
     db_op = db.query(models.Operator).filter(models.Operator.id == id).first()
@@ -424,11 +567,11 @@ def update_operator(id: int, op: schemas.OperatorCreate, current_user: models.Us
     return db_op
 
 @app.get("/api/outlets", response_model=List[schemas.OutletOut])
-def get_outlets(current_user: models.User = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
+def get_outlets(current_user: auth.Principal = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
     query = db.query(models.Outlet)
-    if current_user.role.name == "Operator":
+    if current_user.role_name == "Operator":
         query = query.filter(models.Outlet.operator_id == current_user.operator_id)
-    elif current_user.role.name != "Admin":
+    elif current_user.role_name != "Admin":
         # Store Mgr / Cashier / Area Mgr?
         # Area Mgr can view multiple, Store Mgr view single
         if current_user.outlet_id:
@@ -438,13 +581,13 @@ def get_outlets(current_user: models.User = Depends(auth.require_permission("SET
     return query.all()
 
 @app.post("/api/outlets", response_model=schemas.OutletOut)
-def create_outlet(outlet: schemas.OutletCreate, current_user: models.User = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
+def create_outlet(outlet: schemas.OutletCreate, current_user: auth.Principal = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
     # Admin or Operator
-    if current_user.role.name not in ["Admin", "Operator"]:
+    if current_user.role_name not in ["Admin", "Operator"]:
         raise HTTPException(status_code=403, detail="Permission denied")
     
     op_id = outlet.operator_id
-    if current_user.role.name == "Operator":
+    if current_user.role_name == "Operator":
         op_id = current_user.operator_id # Force own scope
     
     db_outlet = models.Outlet(
@@ -456,12 +599,13 @@ def create_outlet(outlet: schemas.OutletCreate, current_user: models.User = Depe
     )
     db.add(db_outlet)
     db.commit()
+    whitelist.reload(db)
     db.refresh(db_outlet)
     return db_outlet
 
 @app.put("/api/outlets/{id}", response_model=schemas.OutletOut)
-def update_outlet(id: int, outlet: schemas.OutletCreate, current_user: models.User = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
-    if current_user.role.name not in ["Admin", "Operator"]:
+def update_outlet(id: int, outlet: schemas.OutletCreate, current_user: auth.Principal = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
+    if current_user.role_name not in ["Admin", "Operator"]:
         raise HTTPException(status_code=403, detail="Permission denied")
     
     db_outlet = db.query(models.Outlet).filter(models.Outlet.id == id).first()
@@ -469,201 +613,276 @@ def update_outlet(id: int, outlet: schemas.OutletCreate, current_user: models.Us
         raise HTTPException(status_code=404, detail="Outlet not found")
         
     # Scope check
-    if current_user.role.name == "Operator" and db_outlet.operator_id != current_user.operator_id:
+    if current_user.role_name == "Operator" and db_outlet.operator_id != current_user.operator_id:
         raise HTTPException(status_code=403, detail="Not in your scope")
 
     db_outlet.name = outlet.name
+    # The posted balance is the outlet's whole float: pull terminal escrow back first
+    bcf.reclaim(db, db_outlet.id)
     db_outlet.bcf_balance = outlet.bcf_balance
     db_outlet.address = outlet.address
     db_outlet.ip_whitelist = outlet.ip_whitelist
     # Operator ID usually shouldn't change, but if Admin wants to move it? Let's allow if Admin.
-    if current_user.role.name == "Admin" and outlet.operator_id:
+    if current_user.role_name == "Admin" and outlet.operator_id:
         db_outlet.operator_id = outlet.operator_id
     
     db.commit()
+    whitelist.reload(db)
     db.refresh(db_outlet)
     return db_outlet
 
 @app.get("/api/dashboard", response_model=schemas.OutletStats)
-def get_dashboard_stats(current_user: models.User = Depends(auth.require_permission("DASHBOARD_VIEW")), db: Session = Depends(get_db)):
-    if not current_user.outlet_id:
-        # Admin/Operator view (Mock aggregate)
-        return {"bcf_balance": 999999.0, "active_terminals": 10, "total_turnover": 50000.0, "total_ggr": 5000.0, "net_cash": 10000.0}
-    
-    outlet = db.query(models.Outlet).filter(models.Outlet.id == current_user.outlet_id).first()
-    active_terminals = db.query(models.Terminal).filter(models.Terminal.outlet_id == outlet.id, models.Terminal.status != models.TerminalStatus.OFFLINE).count()
-    
-    # Mock financial stats for prototype
-    return {
-        "bcf_balance": outlet.bcf_balance,
-        "active_terminals": active_terminals,
-        "total_turnover": 12000.0,
-        "total_ggr": 1200.0,
-        "net_cash": 5000.0
-    }
+def get_dashboard_stats(current_user: auth.Principal = Depends(auth.require_permission("DASHBOARD_VIEW")), db: Session = Depends(get_db)):
+    # Today's (UTC) totals from the hourly rollups, with a per-outlet breakdown
+    if current_user.outlet_id:
+        return rollups.dashboard_stats(db, outlet_id=current_user.outlet_id)
+    if current_user.role_name == "Admin":
+        return rollups.dashboard_stats(db, all_outlets=True)
+    # Operator / Area Mgr: every outlet under their operator
+    return rollups.dashboard_stats(db, operator_id=current_user.operator_id)
+
+@app.get("/api/transactions", response_model=schemas.TransactionPage)
+def get_transactions(
+    outlet_id: Optional[int] = None,
+    terminal_id: Optional[int] = None,
+    player_id: Optional[int] = None,
+    staff_id: Optional[int] = None,
+    type: Optional[models.TransactionType] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(transactions.DEFAULT_PAGE_SIZE, ge=1, le=transactions.MAX_PAGE_SIZE),
+    current_user: auth.Principal = Depends(auth.require_permission("FINANCE_VIEW")),
+    db: Session = Depends(get_db)
+):
+    # Newest first; follow next_cursor for older pages. start/end are UTC, end exclusive.
+    query = transactions.scoped_query(
+        current_user, outlet_id=outlet_id, terminal_id=terminal_id, player_id=player_id,
+        staff_id=staff_id, txn_type=type.value if type else None, start=start, end=end
+    )
+    return transactions.paginate(db, query, cursor, limit)
+
+@app.get("/api/exports/transactions")
+def export_transactions(
+    format: str = "csv",
+    gzip: bool = False,
+    outlet_id: Optional[int] = None,
+    terminal_id: Optional[int] = None,
+    player_id: Optional[int] = None,
+    staff_id: Optional[int] = None,
+    type: Optional[models.TransactionType] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: auth.Principal = Depends(auth.require_permission("FINANCE_VIEW")),
+    db: Session = Depends(get_db)
+):
+    query = transactions.scoped_query(
+        current_user, outlet_id=outlet_id, terminal_id=terminal_id, player_id=player_id,
+        staff_id=staff_id, txn_type=type.value if type else None, start=start, end=end
+    )
+    return exports.export_response(
+        db, exports.transaction_export_query(query), exports.TRANSACTION_COLUMNS, format, gzip, "transactions"
+    )
+
+@app.get("/api/exports/bcf_logs")
+def export_bcf_logs(
+    format: str = "csv",
+    gzip: bool = False,
+    outlet_id: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: auth.Principal = Depends(auth.require_permission("FINANCE_VIEW")),
+    db: Session = Depends(get_db)
+):
+    query = exports.bcf_log_export_query(current_user, outlet_id=outlet_id, start=start, end=end)
+    return exports.export_response(db, query, exports.BCF_LOG_COLUMNS, format, gzip, "bcf_logs")
 
 @app.get("/api/terminals", response_model=List[schemas.TerminalOut])
-def get_terminals(current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    query = db.query(models.Terminal)
+def get_terminals(current_user: auth.Principal = Depends(auth.get_current_user), db: Session = Depends(get_db)):
+    query = db.query(models.Terminal, models.Player, models.Wallet)
     
-    if current_user.role.name == "Admin":
+    if current_user.role_name == "Admin":
         pass # See all
-    elif current_user.role.name == "Operator":
+    elif current_user.role_name == "Operator":
         # See all terminals in their outlets
-        query = query.join(models.Outlet).filter(models.Outlet.operator_id == current_user.operator_id)
+        query = query.join(models.Outlet, models.Outlet.id == models.Terminal.outlet_id).filter(models.Outlet.operator_id == current_user.operator_id)
     elif current_user.outlet_id:
         query = query.filter(models.Terminal.outlet_id == current_user.outlet_id)
     else:
         return []
 
-    terminals = query.all()
     result = []
-    for t in terminals:
+    for t, player, wallet in _with_player_and_wallet(query).all():
         p_name = None
         p_bal = None
-        if t.current_player_id:
-            player = db.query(models.Player).filter(models.Player.id == t.current_player_id).first()
-            if player:
-                p_name = player.nickname
-                wallet = db.query(models.Wallet).filter(models.Wallet.player_id == player.id, models.Wallet.outlet_id == t.outlet_id).first()
-                p_bal = wallet.balance if wallet else 0.0
+        if player:
+            p_name = player.nickname
+            p_bal = wallet.balance if wallet else 0.0
         
         result.append({
             "id": t.id,
             "code": t.code,
             "status": t.status,
-            "pairing_key": t.pairing_key,
+            "pairing_key": t.pairing_code,
             "outlet_id": t.outlet_id,
             "current_player_name": p_name,
             "current_balance": p_bal
         })
     return result
 
-@app.post("/api/terminals", response_model=schemas.TerminalOut)
-def create_terminal(term: schemas.TerminalCreate, current_user: models.User = Depends(auth.require_permission("SETTINGS_MANAGE")), db: Session = Depends(get_db)):
-    # Check permissions
-    if current_user.role.name not in ["Admin", "Operator"]:
-        raise HTTPException(status_code=403, detail="Permission denied")
-        
-    # Check outlet scope
-    if current_user.role.name == "Operator":
-        outlet = db.query(models.Outlet).filter(models.Outlet.id == term.outlet_id, models.Outlet.operator_id == current_user.operator_id).first()
-        if not outlet:
-            raise HTTPException(status_code=400, detail="Outlet not in scope")
-            
-    import secrets
-    pairing_key = secrets.token_hex(4).upper()
-    
-    db_term = models.Terminal(
-        code=term.code,
-        outlet_id=term.outlet_id,
-        pairing_key=pairing_key,
-        status=models.TerminalStatus.IDLE,
-        hardware_id=term.hardware_id
-    )
-    db.add(db_term)
-    db.commit()
-    db.refresh(db_term)
-    
-    return {
-        "id": db_term.id,
-        "code": db_term.code,
-        "status": db_term.status,
-        "pairing_key": db_term.pairing_key,
-        "outlet_id": db_term.outlet_id,
-        "current_player_name": None,
-        "current_balance": None
-    }
-
 @app.post("/api/bind_terminal")
-def bind_terminal(terminal_id: int = Form(...), phone: str = Form(...), current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
+async def bind_terminal(request: Request, terminal_id: int = Form(...), phone: str = Form(...), current_user: auth.Principal = Depends(auth.require_whitelisted_ip()), db: AsyncSession = Depends(get_async_db)):
+    # 0. Replay a completed request with the same Idempotency-Key
+    idem_key = idempotency.scoped_key(request, current_user, "bind_terminal", {"terminal_id": terminal_id, "phone": phone})
+    if (done := await idempotency.lookup(db, idem_key)) is not None:
+        return idempotency.replay(done)
+
     # 1. Find Terminal
-    terminal = db.query(models.Terminal).filter(models.Terminal.id == terminal_id, models.Terminal.outlet_id == current_user.outlet_id).first()
+    terminal = await db.scalar(select(models.Terminal).where(models.Terminal.id == terminal_id, models.Terminal.outlet_id == current_user.outlet_id))
     if not terminal or terminal.status != models.TerminalStatus.IDLE:
         raise HTTPException(status_code=400, detail="Terminal not available")
     
     # 2. Find Player
-    player = db.query(models.Player).filter(models.Player.phone == phone).first()
+    player = await db.scalar(select(models.Player).where(models.Player.phone == phone))
     if not player:
         # Auto create for prototype
         player = models.Player(phone=phone, nickname=f"Player_{phone[-4:]}")
         db.add(player)
-        db.commit()
-        db.refresh(player)
+        await db.flush()
     
     # 3. Check/Create Wallet
-    wallet = db.query(models.Wallet).filter(models.Wallet.player_id == player.id, models.Wallet.outlet_id == current_user.outlet_id).first()
+    wallet = await db.scalar(select(models.Wallet).where(models.Wallet.player_id == player.id, models.Wallet.outlet_id == current_user.outlet_id))
     if not wallet:
         wallet = models.Wallet(player_id=player.id, outlet_id=current_user.outlet_id, balance=0.0)
         db.add(wallet)
-        db.commit()
     
-    # 4. Bind
-    terminal.status = models.TerminalStatus.OCCUPIED
-    terminal.current_player_id = player.id
-    db.commit()
-    return {"message": "Terminal bound successfully", "player": player.nickname, "balance": wallet.balance}
+    # 4. Bind, only if nobody else bound it since step 1
+    bound = await db.execute(
+        update(models.Terminal)
+        .where(models.Terminal.id == terminal.id, models.Terminal.status == models.TerminalStatus.IDLE)
+        .values(status=models.TerminalStatus.OCCUPIED, current_player_id=player.id)
+    )
+    if bound.rowcount != 1:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Terminal not available")
+    response, applied = await idempotency.commit(db, idem_key, {"message": "Terminal bound successfully", "player": player.nickname, "balance": wallet.balance})
+    if not applied:
+        return idempotency.replay(response)
+    terminal_events.publish(terminal.outlet_id, terminal_snapshot(terminal, player, wallet.balance))
+    return response
+
+async def _occupied_terminal(db: AsyncSession, terminal_id: int, outlet_id: int):
+    # Terminal in the caller's outlet with its current player, or 400
+    row = (await db.execute(
+        select(models.Terminal, models.Player)
+        .join(models.Player, models.Player.id == models.Terminal.current_player_id)
+        .where(models.Terminal.id == terminal_id, models.Terminal.outlet_id == outlet_id)
+    )).first()
+    if not row:
+        raise HTTPException(status_code=400, detail="Terminal not active")
+    return row
+
+# Balance moves are single conditional UPDATEs: the funds check is part of the
+# statement, so concurrent cashiers cannot lose updates or overdraw the outlet.
+# Batch variants live in pos_batch.py.
 
 @app.post("/api/deposit")
-def deposit(req: schemas.DepositRequest, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    # 1. Check BCF
-    outlet = db.query(models.Outlet).filter(models.Outlet.id == current_user.outlet_id).first()
-    if outlet.bcf_balance < req.amount:
+async def deposit(request: Request, req: schemas.DepositRequest, current_user: auth.Principal = Depends(auth.require_whitelisted_ip()), db: AsyncSession = Depends(get_async_db)):
+    idem_key = idempotency.scoped_key(request, current_user, "deposit", req)
+    if (done := await idempotency.lookup(db, idem_key)) is not None:
+        return idempotency.replay(done)
+    terminal, player = await _occupied_terminal(db, req.terminal_id, current_user.outlet_id)
+    
+    # 1. Take BCF from the outlet (or the terminal's escrow), if it has enough
+    if not await bcf.take(db, current_user.outlet_id, terminal.id, req.amount):
+        await db.rollback()
         raise HTTPException(status_code=400, detail="Insufficient BCF Balance")
     
-    terminal = db.query(models.Terminal).filter(models.Terminal.id == req.terminal_id).first()
-    if not terminal or not terminal.current_player_id:
+    # 2. Credit the wallet of the player still bound to the terminal
+    new_balance = await db.scalar(
+        update(models.Wallet)
+        .where(models.Wallet.player_id == player.id, models.Wallet.outlet_id == current_user.outlet_id, pos_batch.still_bound(terminal.id, player.id))
+        .values(balance=models.Wallet.balance + req.amount)
+        .returning(models.Wallet.balance)
+    )
+    if new_balance is None:
+        await db.rollback()
         raise HTTPException(status_code=400, detail="Terminal not active")
-        
-    wallet = db.query(models.Wallet).filter(models.Wallet.player_id == terminal.current_player_id, models.Wallet.outlet_id == current_user.outlet_id).first()
-    
-    # 2. Transaction
-    outlet.bcf_balance -= req.amount
-    wallet.balance += req.amount
     
     txn = models.Transaction(
         type=models.TransactionType.DEPOSIT,
         amount=req.amount,
-        outlet_id=outlet.id,
+        outlet_id=current_user.outlet_id,
         terminal_id=terminal.id,
-        player_id=terminal.current_player_id,
+        player_id=player.id,
         staff_id=current_user.id
     )
-    db.add(txn)
-    db.commit()
-    return {"message": "Deposit successful", "new_balance": wallet.balance}
+    await write_behind.log(db, [txn])
+    response, applied = await idempotency.commit(db, idem_key, {"message": "Deposit successful", "new_balance": new_balance})
+    if not applied:
+        return idempotency.replay(response)
+    terminal_events.publish(terminal.outlet_id, terminal_snapshot(terminal, player, new_balance))
+    return response
 
 @app.post("/api/settle")
-def settle(req: schemas.SettleRequest, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    terminal = db.query(models.Terminal).filter(models.Terminal.id == req.terminal_id).first()
-    if not terminal or not terminal.current_player_id:
-        raise HTTPException(status_code=400, detail="Terminal not active")
-    
-    wallet = db.query(models.Wallet).filter(models.Wallet.player_id == terminal.current_player_id, models.Wallet.outlet_id == current_user.outlet_id).first()
-    amount_to_return = wallet.balance
-    
-    # 1. Zero Balance
-    outlet = db.query(models.Outlet).filter(models.Outlet.id == current_user.outlet_id).first()
-    outlet.bcf_balance += amount_to_return
-    wallet.balance = 0.0
-    
-    # 2. Log
+async def settle(request: Request, req: schemas.SettleRequest, current_user: auth.Principal = Depends(auth.require_whitelisted_ip()), db: AsyncSession = Depends(get_async_db)):
+    idem_key = idempotency.scoped_key(request, current_user, "settle", req)
+    if (done := await idempotency.lookup(db, idem_key)) is not None:
+        return idempotency.replay(done)
+    terminal, player = await _occupied_terminal(db, req.terminal_id, current_user.outlet_id)
+    
+    # 1. Unbind, then zero the wallet (same order as the batch settle)
+    try:
+        amount_to_return = await pos_batch.release_player(db, terminal, player, current_user.outlet_id)
+    except HTTPException:
+        await db.rollback()
+        raise
+    
+    # 2. Return the cash to the outlet (or the terminal's escrow)
+    await bcf.give(db, current_user.outlet_id, terminal.id, amount_to_return)
+    
+    # 3. Log
     txn = models.Transaction(
         type=models.TransactionType.WITHDRAW,
         amount=amount_to_return,
-        outlet_id=outlet.id,
+        outlet_id=current_user.outlet_id,
         terminal_id=terminal.id,
-        player_id=terminal.current_player_id,
+        player_id=player.id,
         staff_id=current_user.id
     )
-    db.add(txn)
-    
-    # 3. Unbind
-    terminal.status = models.TerminalStatus.IDLE
-    terminal.current_player_id = None
-    
-    db.commit()
-    return {"message": "Settled successfully", "returned_cash": amount_to_return}
+    await write_behind.log(db, [txn])
+    
+    response, applied = await idempotency.commit(db, idem_key, {"message": "Settled successfully", "returned_cash": amount_to_return})
+    if not applied:
+        return idempotency.replay(response)
+    terminal_events.publish(terminal.outlet_id, terminal_snapshot(terminal, None, 0.0))
+    return response
+
+@app.post("/api/deposit/batch", response_model=schemas.BatchReport)
+async def deposit_batch(request: Request, req: schemas.DepositBatchRequest, current_user: auth.Principal = Depends(auth.require_whitelisted_ip()), db: AsyncSession = Depends(get_async_db)):
+    idem_key = idempotency.scoped_key(request, current_user, "deposit_batch", req)
+    if (done := await idempotency.lookup(db, idem_key)) is not None:
+        return idempotency.replay(done)
+    results, events = await pos_batch.deposit_many(db, current_user, [(i.terminal_id, i.amount) for i in req.items])
+    response, applied = await idempotency.commit(db, idem_key, {"results": results})
+    if not applied:
+        return idempotency.replay(response)
+    for terminal, player, balance in events:
+        terminal_events.publish(terminal.outlet_id, terminal_snapshot(terminal, player, balance))
+    return response
+
+@app.post("/api/settle/batch", response_model=schemas.BatchReport)
+async def settle_batch(request: Request, req: schemas.SettleBatchRequest, current_user: auth.Principal = Depends(auth.require_whitelisted_ip()), db: AsyncSession = Depends(get_async_db)):
+    idem_key = idempotency.scoped_key(request, current_user, "settle_batch", req)
+    if (done := await idempotency.lookup(db, idem_key)) is not None:
+        return idempotency.replay(done)
+    results, events = await pos_batch.settle_many(db, current_user, req.terminal_ids)
+    response, applied = await idempotency.commit(db, idem_key, {"results": results})
+    if not applied:
+        return idempotency.replay(response)
+    for terminal, player, balance in events:
+        terminal_events.publish(terminal.outlet_id, terminal_snapshot(terminal, player, balance))
+    return response
 
 # --- Web Pages ---
 
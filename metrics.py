@@ -0,0 +1,223 @@
+import contextvars
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import write_behind
+
+# Per-route request metrics in the Prometheus text format, served at /metrics.
+# MetricsMiddleware times every HTTP request; SQLAlchemy engine events attribute
+# statement counts and DB time to the request that issued them (through a context
+# variable, which follows the request into the threadpool and the async driver).
+# Background components (the log write-behind queue) are read at scrape time.
+# Each uvicorn worker process keeps its own numbers; scrape every worker.
+
+ENABLED = os.getenv("OMS_METRICS_ENABLED", "1") == "1"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}  # label values -> value
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {v}" for k, v in items]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def add(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # [per-bucket counts..., sum, count]
+                entry = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = self.header()
+        names = self.label_names + ("le",)
+        for labels, entry in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, entry):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {entry[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {entry[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {entry[-1]}")
+        return lines
+
+class Observed(_Metric):
+    # Unlabelled value read from a callable on every scrape
+    def __init__(self, name: str, help_text: str, kind: str, read):
+        super().__init__(name, help_text)
+        self.kind = kind
+        self._read = read
+
+    def render(self):
+        return self.header() + [f"{self.name} {self._read()}"]
+
+def _write_behind(attr):
+    # The writer is looked up per scrape: tests swap in their own
+    return lambda: getattr(write_behind.writer, attr)
+
+request_duration = Histogram("oms_http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+requests_total = Counter("oms_http_requests_total", "HTTP responses by route and status code", ("method", "route", "status"))
+requests_in_flight = Gauge("oms_http_requests_in_flight", "HTTP requests currently being served", ("method",))
+db_statements = Histogram("oms_db_statements_per_request", "SQL statements issued per HTTP request", ("method", "route"), STATEMENT_BUCKETS)
+db_seconds = Histogram("oms_db_seconds_per_request", "Time spent executing SQL per HTTP request", ("method", "route"))
+
+write_behind_metrics = (
+    Observed("oms_write_behind_running", "1 while the log write-behind queue accepts rows", "gauge", lambda: int(write_behind.writer.running)),
+    Observed("oms_write_behind_queue_depth", "Log rows waiting to be written", "gauge", lambda: write_behind.writer.depth()),
+    Observed("oms_write_behind_queue_max_depth", "Highest queue depth seen", "gauge", _write_behind("max_depth")),
+    Observed("oms_write_behind_lag_seconds", "Age of the oldest log row still queued", "gauge", lambda: write_behind.writer.lag_seconds()),
+    Observed("oms_write_behind_last_flush_seconds", "Duration of the last successful batch flush", "gauge",
+             lambda: write_behind.writer.last_flush_ms / 1000),
+    Observed("oms_write_behind_rows_enqueued_total", "Log rows queued", "counter", _write_behind("enqueued")),
+    Observed("oms_write_behind_rows_written_total", "Log rows written by the queue", "counter", _write_behind("written")),
+    Observed("oms_write_behind_rows_dropped_total", "Log rows dropped after repeated write failures", "counter", _write_behind("dropped")),
+    Observed("oms_write_behind_flushes_total", "Successful write-behind commits", "counter", _write_behind("flushes")),
+    Observed("oms_write_behind_flush_failures_total", "Failed write-behind batch flushes", "counter", _write_behind("failures")),
+)
+
+REGISTRY = (request_duration, requests_total, requests_in_flight, db_statements, db_seconds) + write_behind_metrics
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+def reset():
+    # Request metrics only; write-behind figures belong to the writer
+    for metric in REGISTRY:
+        metric.clear()
+
+# --- SQL attribution ---
+
+class RequestStats:
+    __slots__ = ("statements", "db_seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+
+current_request = contextvars.ContextVar("oms_request_stats", default=None)
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_request.get() is not None:
+        conn.info.setdefault("oms_query_start", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_request.get()
+    starts = conn.info.get("oms_query_start")
+    if stats is None or not starts:
+        return
+    stats.statements += 1
+    stats.db_seconds += time.perf_counter() - starts.pop()
+
+@event.listens_for(Engine, "handle_error")
+def _on_error(exception_context):
+    # Failed statements never reach after_cursor_execute
+    conn = exception_context.connection
+    stats = current_request.get()
+    if conn is None or stats is None:
+        return
+    starts = conn.info.get("oms_query_start")
+    if starts:
+        stats.statements += 1
+        stats.db_seconds += time.perf_counter() - starts.pop()
+
+# --- Middleware ---
+
+UNMATCHED = "<unmatched>"
+
+class MetricsMiddleware:
+    # Plain ASGI middleware (not BaseHTTPMiddleware): streaming responses such as the
+    # SSE terminal feed pass through untouched and are timed until their last chunk.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        stats = RequestStats()
+        token = current_request.set(stats)
+        requests_in_flight.add(method)
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            requests_in_flight.add(method, amount=-1)
+            current_request.reset(token)
+            # Route template, not the raw path, so ids do not explode the label set
+            route = getattr(scope.get("route"), "path", None) or UNMATCHED
+            request_duration.observe(elapsed, method, route)
+            requests_total.inc(method, route, str(status))
+            db_statements.observe(stats.statements, method, route)
+            db_seconds.observe(stats.db_seconds, method, route)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime, Float, Enum, Table
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime, Float, Enum, Table, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
@@ -86,6 +86,7 @@ class Outlet(Base):
     bcf_balance = Column(Float, default=0.0) # L2 -> L3 balance
     address = Column(String, nullable=True)
     ip_whitelist = Column(String, nullable=True)
+    terminal_seq = Column(Integer, default=0, nullable=False) # Last allocated terminal code number
     
     operator = relationship("Operator", back_populates="outlets")
     terminals = relationship("Terminal", back_populates="outlet")
@@ -96,7 +97,7 @@ class Terminal(Base):
     id = Column(Integer, primary_key=True, index=True)
     code = Column(String, unique=True) # System Gen ID (e.g., T-0001)
     name = Column(String, nullable=True) # User defined name (e.g., 1號機)
-    outlet_id = Column(Integer, ForeignKey("outlets.id"))
+    outlet_id = Column(Integer, ForeignKey("outlets.id"), index=True)
     
     # Statuses
     is_active = Column(Boolean, default=True) # Admin Status: Active/Disabled
@@ -104,11 +105,20 @@ class Terminal(Base):
     
     # Pairing Info
     is_paired = Column(Boolean, default=False)
-    pairing_code = Column(String, nullable=True)
-    pairing_expires_at = Column(DateTime, nullable=True)
-    hardware_id = Column(String, nullable=True) # Device fingerprint
+    pairing_code = Column(String, nullable=True, unique=True) # Indexed for redemption (pairing.py)
+    pairing_expires_at = Column(DateTime, nullable=True, index=True)
+    hardware_id = Column(String, nullable=True, index=True) # Device fingerprint
+    device_token_hash = Column(String, nullable=True, unique=True) # sha256 of the credential issued at pairing
     last_seen = Column(DateTime, nullable=True)
     
+    # BCF float pre-allocated from the outlet (escrow mode, see bcf.py)
+    bcf_escrow = Column(Float, default=0.0, nullable=False)
+    
+    # Lifetime play totals, folded in from game_rounds ingestion
+    bet_total = Column(Float, default=0.0, nullable=False)
+    win_total = Column(Float, default=0.0, nullable=False)
+    round_count = Column(Integer, default=0, nullable=False)
+    
     # Current Session Info
     current_player_id = Column(Integer, ForeignKey("players.id"), nullable=True)
     
@@ -125,6 +135,8 @@ class Player(Base):
 
 class Wallet(Base):
     __tablename__ = "wallets"
+    # One wallet per player per outlet; also serves the (player, outlet) lookup on every POS write
+    __table_args__ = (UniqueConstraint("player_id", "outlet_id"),)
     id = Column(Integer, primary_key=True, index=True)
     player_id = Column(Integer, ForeignKey("players.id"))
     outlet_id = Column(Integer, ForeignKey("outlets.id"))
@@ -145,6 +157,15 @@ class Transaction(Base):
     player_id = Column(Integer, ForeignKey("players.id"))
     staff_id = Column(Integer, ForeignKey("users.id"))
 
+    # History is read newest-first by (timestamp, id) within one filter column
+    __table_args__ = (
+        Index("ix_transactions_timestamp_id", "timestamp", "id"),
+        Index("ix_transactions_outlet_timestamp", "outlet_id", "timestamp", "id"),
+        Index("ix_transactions_terminal_timestamp", "terminal_id", "timestamp", "id"),
+        Index("ix_transactions_player_timestamp", "player_id", "timestamp", "id"),
+        Index("ix_transactions_staff_timestamp", "staff_id", "timestamp", "id"),
+    )
+
 class BCFLog(Base):
     __tablename__ = "bcf_logs"
     id = Column(Integer, primary_key=True, index=True)
@@ -153,3 +174,47 @@ class BCFLog(Base):
     amount = Column(Float)
     from_user_id = Column(Integer, ForeignKey("users.id"))
     target_outlet_id = Column(Integer, ForeignKey("outlets.id"))
+
+    __table_args__ = (
+        Index("ix_bcf_logs_outlet_timestamp", "target_outlet_id", "timestamp", "id"),
+    )
+
+class OutletRollup(Base):
+    # Per outlet, per hour cash and play totals. Maintained by rollups.py in the same
+    # transaction as each Transaction / GameRound insert; rebuild with `python rollups.py`.
+    __tablename__ = "outlet_rollups"
+    outlet_id = Column(Integer, ForeignKey("outlets.id"), primary_key=True)
+    bucket = Column(DateTime, primary_key=True) # UTC, truncated to the hour
+    deposit_total = Column(Float, default=0.0, nullable=False)
+    deposit_count = Column(Integer, default=0, nullable=False)
+    withdraw_total = Column(Float, default=0.0, nullable=False)
+    withdraw_count = Column(Integer, default=0, nullable=False)
+    bet_total = Column(Float, default=0.0, nullable=False)
+    win_total = Column(Float, default=0.0, nullable=False)
+    round_count = Column(Integer, default=0, nullable=False)
+
+class IdempotencyRecord(Base):
+    # Stored response of a completed POS write, keyed by "<user_id>:<endpoint>:<Idempotency-Key>".
+    # Written in the same transaction as the write itself (see idempotency.py).
+    __tablename__ = "idempotency_records"
+    key = Column(String, primary_key=True)
+    request_hash = Column(String, nullable=False) # sha256 of the request parameters
+    response = Column(String, nullable=False) # JSON
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class GameRound(Base):
+    # One reported game round (bet/win) from a terminal. Append-only; see game_rounds.py
+    __tablename__ = "game_rounds"
+    id = Column(Integer, primary_key=True)
+    terminal_id = Column(Integer, ForeignKey("terminals.id"), nullable=False)
+    outlet_id = Column(Integer, ForeignKey("outlets.id"), nullable=False)
+    round_ref = Column(String, nullable=False) # Machine's own round id; retries are ignored
+    bet = Column(Float, nullable=False)
+    win = Column(Float, nullable=False)
+    played_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("terminal_id", "round_ref"),
+        Index("ix_game_rounds_outlet_played_at", "outlet_id", "played_at"),
+    )
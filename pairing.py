@@ -0,0 +1,86 @@
+import asyncio
+import datetime
+import hashlib
+import logging
+import os
+import secrets
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import models
+
+logger = logging.getLogger(__name__)
+
+# Device pairing: an admin issues a short code for a terminal; the device
+# redeems it with its hardware_id. Redemption is one UPDATE on the unique
+# pairing_code index, so a wave of devices re-pairing costs one indexed
+# statement each. Expired codes are cleared by a background sweep.
+# Redeeming also issues the device its credential for machine-to-server calls
+# (round ingestion); only its hash is stored, and unpairing revokes it.
+
+CODE_TTL_MINUTES = int(os.getenv("OMS_PAIRING_CODE_TTL_MINUTES", "10"))
+SWEEP_SECONDS = float(os.getenv("OMS_PAIRING_SWEEP_SECONDS", "60"))
+
+Terminal = models.Terminal
+
+def hash_device_token(token: str) -> str:
+    # Tokens are 256-bit random, so a plain digest is enough and stays indexable
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def issue_code(db: Session, terminal: models.Terminal) -> str:
+    # 6 hex chars; retry the (rare) clash with another live code
+    while True:
+        code = secrets.token_hex(3).upper()
+        if not db.scalar(select(Terminal.id).where(Terminal.pairing_code == code)):
+            break
+    terminal.pairing_code = code
+    terminal.pairing_expires_at = datetime.datetime.utcnow() + datetime.timedelta(minutes=CODE_TTL_MINUTES)
+    return code
+
+async def redeem(db: AsyncSession, code: str, hardware_id: str):
+    # Returns (paired terminal row (id, code, name, outlet_id), device token) or None
+    now = datetime.datetime.utcnow()
+    token = secrets.token_urlsafe(32)
+    row = (await db.execute(
+        update(Terminal)
+        .where(
+            Terminal.pairing_code == code.strip().upper(),
+            Terminal.pairing_expires_at > now,
+            Terminal.is_active == True,
+        )
+        .values(is_paired=True, hardware_id=hardware_id, device_token_hash=hash_device_token(token),
+                pairing_code=None, pairing_expires_at=None, last_seen=now)
+        .returning(Terminal.id, Terminal.code, Terminal.name, Terminal.outlet_id)
+    )).first()
+    if row is None:
+        await db.rollback()
+        return None
+    # A device belongs to one terminal: release any earlier pairing of this hardware
+    await db.execute(
+        update(Terminal)
+        .where(Terminal.hardware_id == hardware_id, Terminal.id != row.id)
+        .values(is_paired=False, hardware_id=None, device_token_hash=None)
+    )
+    await db.commit()
+    return row, token
+
+async def sweep_expired(db: AsyncSession, now: datetime.datetime = None) -> int:
+    result = await db.execute(
+        update(Terminal)
+        .where(Terminal.pairing_expires_at < (now or datetime.datetime.utcnow()))
+        .values(pairing_code=None, pairing_expires_at=None)
+    )
+    await db.commit()
+    return result.rowcount
+
+async def run(session_factory):
+    # Background loop (started from the app lifespan)
+    while True:
+        await asyncio.sleep(SWEEP_SECONDS)
+        try:
+            async with session_factory() as db:
+                await sweep_expired(db)
+        except Exception:
+            logger.exception("pairing_sweep_failed")
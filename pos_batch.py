@@ -0,0 +1,141 @@
+from fastapi import HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import bcf
+import models
+import write_behind
+
+# Multi-terminal deposit and settle (e.g. closing the whole floor). Every item is
+# checked and applied inside one transaction with one commit; an item that cannot
+# be applied is reported and leaves no trace, the rest go through.
+
+MAX_BATCH_ITEMS = 500
+SETTLE_MAX_ATTEMPTS = 3
+
+def still_bound(terminal_id: int, player_id: int):
+    # Guards wallet writes against a concurrent settle/re-bind of the terminal
+    return select(models.Terminal.id).where(
+        models.Terminal.id == terminal_id, models.Terminal.current_player_id == player_id
+    ).exists()
+
+async def release_player(db: AsyncSession, terminal, player, outlet_id: int) -> float:
+    # Settle's unbind + wallet zeroing, shared by the single and batch paths.
+    # Returns the cash to hand back; raises HTTPException with nothing written.
+    # 1. Unbind first: once unbound, no deposit can credit the wallet any more
+    unbound = await db.execute(
+        update(models.Terminal)
+        .where(models.Terminal.id == terminal.id, models.Terminal.current_player_id == player.id)
+        .values(status=models.TerminalStatus.IDLE, current_player_id=None)
+    )
+    if unbound.rowcount != 1:
+        raise HTTPException(status_code=400, detail="Terminal not active")
+
+    # 2. Zero the wallet (compare-and-swap on the balance read)
+    for _ in range(SETTLE_MAX_ATTEMPTS):
+        wallet_id, amount = (await db.execute(
+            select(models.Wallet.id, models.Wallet.balance)
+            .where(models.Wallet.player_id == player.id, models.Wallet.outlet_id == outlet_id)
+        )).one()
+        zeroed = await db.execute(
+            update(models.Wallet).where(models.Wallet.id == wallet_id, models.Wallet.balance == amount).values(balance=0.0)
+        )
+        if zeroed.rowcount == 1:
+            return amount
+    # Put the player back so the caller's transaction stays consistent
+    await db.execute(
+        update(models.Terminal).where(models.Terminal.id == terminal.id)
+        .values(status=models.TerminalStatus.OCCUPIED, current_player_id=player.id)
+    )
+    raise HTTPException(status_code=409, detail="Wallet busy, please retry")
+
+def _check_size(count: int):
+    if not 1 <= count <= MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Between 1 and {MAX_BATCH_ITEMS} items per batch")
+
+async def _occupied_terminals(db: AsyncSession, terminal_ids, outlet_id: int) -> dict:
+    # terminal_id -> (Terminal, Player) for the occupied terminals of the outlet, one query
+    rows = (await db.execute(
+        select(models.Terminal, models.Player)
+        .join(models.Player, models.Player.id == models.Terminal.current_player_id)
+        .where(models.Terminal.id.in_(set(terminal_ids)), models.Terminal.outlet_id == outlet_id)
+    )).all()
+    return {t.id: (t, p) for t, p in rows}
+
+def _txn(txn_type, amount, user, terminal, player):
+    return models.Transaction(
+        type=txn_type, amount=amount, outlet_id=user.outlet_id,
+        terminal_id=terminal.id, player_id=player.id, staff_id=user.id
+    )
+
+def _error(terminal_id, detail):
+    return {"terminal_id": terminal_id, "status": "error", "detail": detail}
+
+async def deposit_many(db: AsyncSession, user, items):
+    # items: [(terminal_id, amount)]. Returns (results, events) where events are
+    # (terminal, player, new_balance) for the caller to publish after commit.
+    _check_size(len(items))
+    bound = await _occupied_terminals(db, [tid for tid, _ in items], user.outlet_id)
+    results = [None] * len(items)
+    candidates = []
+    for i, (terminal_id, amount) in enumerate(items):
+        if terminal_id not in bound:
+            results[i] = _error(terminal_id, "Terminal not active")
+        else:
+            candidates.append(i)
+
+    # 1. Take BCF for the whole batch (one outlet debit when it covers everything)
+    taken = await bcf.take_many(db, user.outlet_id, [items[i] for i in candidates])
+    refunds, txns, events = [], [], []
+    for i, ok in zip(candidates, taken):
+        terminal_id, amount = items[i]
+        if not ok:
+            results[i] = _error(terminal_id, "Insufficient BCF Balance")
+            continue
+        # 2. Credit the wallet of the player still bound to the terminal
+        terminal, player = bound[terminal_id]
+        new_balance = await db.scalar(
+            update(models.Wallet)
+            .where(models.Wallet.player_id == player.id, models.Wallet.outlet_id == user.outlet_id, still_bound(terminal.id, player.id))
+            .values(balance=models.Wallet.balance + amount)
+            .returning(models.Wallet.balance)
+        )
+        if new_balance is None:
+            refunds.append((terminal_id, amount))
+            results[i] = _error(terminal_id, "Terminal not active")
+            continue
+        txns.append(_txn(models.TransactionType.DEPOSIT, amount, user, terminal, player))
+        events.append((terminal, player, new_balance))
+        results[i] = {"terminal_id": terminal_id, "status": "ok", "new_balance": new_balance}
+
+    # 3. Hand back BCF taken for items that did not go through, then log in bulk
+    await bcf.give_many(db, user.outlet_id, refunds)
+    await write_behind.log(db, txns)
+    return results, events
+
+async def settle_many(db: AsyncSession, user, terminal_ids):
+    # Returns (results, events) like deposit_many; events carry the now idle terminals
+    _check_size(len(terminal_ids))
+    bound = await _occupied_terminals(db, terminal_ids, user.outlet_id)
+    results, returns, txns, events = [], [], [], []
+    for terminal_id in terminal_ids:
+        if terminal_id not in bound:
+            results.append(_error(terminal_id, "Terminal not active"))
+            continue
+        terminal, player = bound.pop(terminal_id) # a repeated id is settled once
+
+        try:
+            amount = await release_player(db, terminal, player, user.outlet_id)
+        except HTTPException as e:
+            results.append(_error(terminal_id, e.detail))
+            continue
+
+        returns.append((terminal.id, amount))
+        txns.append(_txn(models.TransactionType.WITHDRAW, amount, user, terminal, player))
+        events.append((terminal, None, 0.0))
+        results.append({"terminal_id": terminal_id, "status": "ok", "returned_cash": amount})
+
+    # Return the cash to the outlet and log in bulk
+    await bcf.give_many(db, user.outlet_id, returns)
+    await write_behind.log(db, txns)
+    return results, events
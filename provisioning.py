@@ -0,0 +1,67 @@
+from typing import List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+
+import models
+
+# Terminal code allocation and bulk creation.
+# Codes come from a per-outlet counter (Outlet.terminal_seq) bumped atomically,
+# so concurrent requests never hand out the same code.
+
+MAX_BULK_TERMINALS = 1000
+
+def terminal_code(outlet: models.Outlet, seq: int) -> str:
+    return f"OP{outlet.operator_id or 0}-O{outlet.id}-T{seq:04d}"
+
+def allocate_seq(db: Session, outlet: models.Outlet, count: int) -> range:
+    # Reserve `count` sequence numbers in one statement; caller commits
+    last = db.execute(
+        update(models.Outlet)
+        .where(models.Outlet.id == outlet.id)
+        .values(terminal_seq=models.Outlet.terminal_seq + count)
+        .returning(models.Outlet.terminal_seq)
+    ).scalar_one()
+    return range(last - count + 1, last + 1)
+
+def allocate_code(db: Session, outlet: models.Outlet) -> str:
+    return terminal_code(outlet, allocate_seq(db, outlet, 1)[0])
+
+def outlet_in_scope(db: Session, user, outlet_id: int) -> models.Outlet:
+    if user.role_name not in ["Admin", "Operator"]:
+        raise HTTPException(status_code=403, detail="Permission denied")
+    outlet = db.query(models.Outlet).filter(models.Outlet.id == outlet_id).first()
+    if not outlet:
+        raise HTTPException(status_code=404, detail="Outlet not found")
+    if user.role_name == "Operator" and outlet.operator_id != user.operator_id:
+        raise HTTPException(status_code=400, detail="Outlet not in scope")
+    return outlet
+
+def create_terminals(db: Session, outlet: models.Outlet, count: Optional[int] = None, names: Optional[List[str]] = None) -> List[dict]:
+    # Exactly one of count / names. One transaction, one batched INSERT.
+    if (count is None) == (names is None):
+        raise HTTPException(status_code=400, detail="Provide either count or names")
+    if names is not None:
+        count = len(names)
+    if not 1 <= count <= MAX_BULK_TERMINALS:
+        raise HTTPException(status_code=400, detail=f"Between 1 and {MAX_BULK_TERMINALS} terminals per request")
+
+    rows = [
+        {
+            "code": terminal_code(outlet, seq),
+            "name": names[i] if names is not None else f"{seq}號機",
+            "outlet_id": outlet.id,
+            "status": models.TerminalStatus.IDLE,
+            "is_active": True,
+            "is_paired": False,
+        }
+        for i, seq in enumerate(allocate_seq(db, outlet, count))
+    ]
+    created = db.execute(insert(models.Terminal).returning(models.Terminal.id, models.Terminal.code), rows).all()
+    db.commit()
+    by_code = {r["code"]: r for r in rows}
+    return [
+        {"id": t.id, "code": t.code, "name": by_code[t.code]["name"], "status": models.TerminalStatus.IDLE, "outlet_id": outlet.id}
+        for t in created
+    ]
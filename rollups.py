@@ -0,0 +1,239 @@
+import datetime
+import os
+from typing import Optional
+
+from sqlalchemy import case, delete, func, insert, select, true, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import models
+from cache import TTLCache
+
+# Incrementally maintained cash and play totals per (outlet, hour).
+# Dashboard reads sum at most 24 rows per outlet for "today", however long the
+# transaction history gets. The row for a Transaction (or a batch of game rounds)
+# is bumped in the same DB transaction as its insert, so the two never drift apart.
+
+Rollup = models.OutletRollup
+
+# Multi-outlet (operator / all) dashboard totals are cached briefly: they are
+# read far more often than a few seconds of staleness matters.
+DASHBOARD_CACHE_TTL_SECONDS = float(os.getenv("OMS_DASHBOARD_CACHE_TTL", "5"))
+dashboard_cache = TTLCache(maxsize=1024, ttl=DASHBOARD_CACHE_TTL_SECONDS)
+
+# Transaction type -> (total column, count column)
+_COLUMNS = {
+    models.TransactionType.DEPOSIT: ("deposit_total", "deposit_count"),
+    models.TransactionType.WITHDRAW: ("withdraw_total", "withdraw_count"),
+}
+
+def bucket_for(ts: datetime.datetime) -> datetime.datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+def day_start(ts: Optional[datetime.datetime] = None) -> datetime.datetime:
+    ts = ts or datetime.datetime.utcnow()
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _increments(txn_type, amount: float) -> dict:
+    total_col, count_col = _COLUMNS[txn_type]
+    return {total_col: amount, count_col: 1}
+
+def _upsert(dialect_name: str, outlet_id: int, bucket: datetime.datetime, incs: dict):
+    # Single-statement upsert where the dialect has one
+    bump = {col: getattr(Rollup, col) + value for col, value in incs.items()}
+    if dialect_name == "postgresql":
+        stmt = postgresql.insert(Rollup)
+    elif dialect_name == "sqlite":
+        stmt = sqlite.insert(Rollup)
+    else:
+        return None
+    stmt = stmt.values(outlet_id=outlet_id, bucket=bucket, **incs)
+    return stmt.on_conflict_do_update(index_elements=[Rollup.outlet_id, Rollup.bucket], set_=bump)
+
+def _bump(outlet_id: int, bucket: datetime.datetime, incs: dict):
+    return (
+        update(Rollup)
+        .where(Rollup.outlet_id == outlet_id, Rollup.bucket == bucket)
+        .values({col: getattr(Rollup, col) + value for col, value in incs.items()})
+    )
+
+async def record(db: AsyncSession, txn: models.Transaction):
+    # Call after db.add(txn) and before commit. txn.timestamp is set here so
+    # the row and its bucket agree.
+    await record_many(db, [txn])
+
+async def record_many(db: AsyncSession, txns):
+    # One upsert per (outlet, hour) touched, however many transactions
+    now = datetime.datetime.utcnow()
+    grouped = {}
+    for txn in txns:
+        txn.timestamp = txn.timestamp or now
+        incs = grouped.setdefault((txn.outlet_id, bucket_for(txn.timestamp)), {})
+        for col, value in _increments(txn.type, txn.amount).items():
+            incs[col] = incs.get(col, 0) + value
+    await _apply(db, grouped)
+
+async def record_rounds(db: AsyncSession, rounds):
+    # rounds: [(outlet_id, played_at, bet, win)] of newly stored game rounds
+    grouped = {}
+    for outlet_id, played_at, bet, win in rounds:
+        incs = grouped.setdefault((outlet_id, bucket_for(played_at)), {"bet_total": 0.0, "win_total": 0.0, "round_count": 0})
+        incs["bet_total"] += bet
+        incs["win_total"] += win
+        incs["round_count"] += 1
+    await _apply(db, grouped)
+
+async def _apply(db: AsyncSession, grouped: dict):
+    dialect_name = db.get_bind().dialect.name
+    for (outlet_id, bucket), incs in grouped.items():
+        stmt = _upsert(dialect_name, outlet_id, bucket, incs)
+        if stmt is not None:
+            await db.execute(stmt)
+            continue
+        # Generic fallback: update, else insert
+        if (await db.execute(_bump(outlet_id, bucket, incs))).rowcount == 0:
+            await db.execute(insert(Rollup).values(outlet_id=outlet_id, bucket=bucket, **incs))
+
+def dashboard_figures(deposits: float, withdrawals: float, bets: float, wins: float) -> dict:
+    # Turnover and GGR come from reported game rounds; net cash from the cashier
+    return {
+        "total_turnover": bets,
+        "total_ggr": bets - wins,
+        "net_cash": deposits - withdrawals,
+    }
+
+def outlet_breakdown_query(since: datetime.datetime, operator_id: Optional[int] = None, outlet_id: Optional[int] = None):
+    # Operator -> Outlet -> Terminal in one statement: terminals and today's
+    # rollups are each grouped by outlet, then joined onto the outlets in scope.
+    # The scope is applied inside both groupings too, so they read only the
+    # outlets asked for (by index) instead of every outlet's history.
+    def scoped(column):
+        if outlet_id is not None:
+            return column == outlet_id
+        if operator_id is not None:
+            return column.in_(select(models.Outlet.id).where(models.Outlet.operator_id == operator_id))
+        return true()
+
+    terminals = (
+        select(
+            models.Terminal.outlet_id.label("outlet_id"),
+            func.sum(models.Terminal.bcf_escrow).label("escrow"),
+            func.sum(case((models.Terminal.status != models.TerminalStatus.OFFLINE, 1), else_=0)).label("active"),
+        )
+        .where(scoped(models.Terminal.outlet_id))
+        .group_by(models.Terminal.outlet_id)
+        .subquery()
+    )
+    cash = (
+        select(
+            Rollup.outlet_id.label("outlet_id"),
+            func.sum(Rollup.deposit_total).label("deposits"),
+            func.sum(Rollup.withdraw_total).label("withdrawals"),
+            func.sum(Rollup.bet_total).label("bets"),
+            func.sum(Rollup.win_total).label("wins"),
+        )
+        .where(scoped(Rollup.outlet_id), Rollup.bucket >= since)
+        .group_by(Rollup.outlet_id)
+        .subquery()
+    )
+    query = (
+        select(
+            models.Outlet.id,
+            models.Outlet.name,
+            (func.coalesce(models.Outlet.bcf_balance, 0.0) + func.coalesce(terminals.c.escrow, 0.0)).label("bcf_balance"),
+            func.coalesce(terminals.c.active, 0).label("active_terminals"),
+            func.coalesce(cash.c.deposits, 0.0).label("deposits"),
+            func.coalesce(cash.c.withdrawals, 0.0).label("withdrawals"),
+            func.coalesce(cash.c.bets, 0.0).label("bets"),
+            func.coalesce(cash.c.wins, 0.0).label("wins"),
+        )
+        .outerjoin(terminals, terminals.c.outlet_id == models.Outlet.id)
+        .outerjoin(cash, cash.c.outlet_id == models.Outlet.id)
+        .order_by(models.Outlet.id)
+    )
+    if operator_id is not None:
+        query = query.where(models.Outlet.operator_id == operator_id)
+    if outlet_id is not None:
+        query = query.where(models.Outlet.id == outlet_id)
+    return query
+
+def _summarize(rows) -> dict:
+    outlets = []
+    totals = {"bcf_balance": 0.0, "active_terminals": 0, "deposits": 0.0, "withdrawals": 0.0, "bets": 0.0, "wins": 0.0}
+    for row in rows:
+        outlets.append({
+            "outlet_id": row.id,
+            "name": row.name,
+            "bcf_balance": row.bcf_balance,
+            "active_terminals": row.active_terminals,
+            **dashboard_figures(row.deposits, row.withdrawals, row.bets, row.wins)
+        })
+        for key in totals:
+            totals[key] += getattr(row, key)
+    return {
+        "bcf_balance": totals["bcf_balance"],
+        "active_terminals": totals["active_terminals"],
+        **dashboard_figures(totals["deposits"], totals["withdrawals"], totals["bets"], totals["wins"]),
+        "outlets": outlets,
+    }
+
+def dashboard_stats(db: Session, operator_id: Optional[int] = None, outlet_id: Optional[int] = None, all_outlets: bool = False) -> dict:
+    # Today's (UTC) figures for one outlet, every outlet of an operator, or every outlet.
+    # The caller picks the scope; an empty scope yields zeros.
+    since = day_start()
+    if outlet_id is not None:
+        return _summarize(db.execute(outlet_breakdown_query(since, outlet_id=outlet_id)))
+    if not all_outlets and operator_id is None:
+        return _summarize([])
+
+    key = ("all" if all_outlets else operator_id, since)
+    stats = dashboard_cache.get(key)
+    if stats is None:
+        stats = _summarize(db.execute(outlet_breakdown_query(since, operator_id=None if all_outlets else operator_id)))
+        dashboard_cache.set(key, stats)
+    return stats
+
+def _empty_totals():
+    return {"deposit_total": 0.0, "deposit_count": 0, "withdraw_total": 0.0, "withdraw_count": 0,
+            "bet_total": 0.0, "win_total": 0.0, "round_count": 0}
+
+def rebuild(db: Session, batch_size: int = 5000) -> int:
+    # Recompute every rollup row from `transactions` and `game_rounds`. Streams the
+    # history so memory is bounded by the number of (outlet, hour) buckets.
+    totals = {}
+    rows = db.execute(
+        select(models.Transaction.outlet_id, models.Transaction.timestamp, models.Transaction.type, models.Transaction.amount)
+        .where(models.Transaction.outlet_id != None, models.Transaction.timestamp != None)
+        .execution_options(yield_per=batch_size)
+    )
+    for outlet_id, ts, txn_type, amount in rows:
+        key = (outlet_id, bucket_for(ts))
+        entry = totals.setdefault(key, _empty_totals())
+        for col, value in _increments(models.TransactionType(txn_type), amount or 0.0).items():
+            entry[col] += value
+
+    rounds = db.execute(
+        select(models.GameRound.outlet_id, models.GameRound.played_at, models.GameRound.bet, models.GameRound.win)
+        .execution_options(yield_per=batch_size)
+    )
+    for outlet_id, played_at, bet, win in rounds:
+        entry = totals.setdefault((outlet_id, bucket_for(played_at)), _empty_totals())
+        entry["bet_total"] += bet
+        entry["win_total"] += win
+        entry["round_count"] += 1
+
+    db.execute(delete(Rollup))
+    if totals:
+        db.execute(insert(Rollup), [{"outlet_id": o, "bucket": b, **v} for (o, b), v in totals.items()])
+    db.commit()
+    return len(totals)
+
+if __name__ == "__main__":
+    from database import SessionLocal, engine
+    models.Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        print(f"Rebuilt {rebuild(session)} outlet rollup rows")
+    finally:
+        session.close()
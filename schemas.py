@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import datetime
 
@@ -57,6 +57,27 @@ class UserOut(BaseModel):
     class Config:
         from_attributes = True
 
+class UserImportRow(BaseModel):
+    row: int # 1-based, header excluded
+    username: Optional[str] = None
+    status: str # created / error
+    detail: Optional[str] = None
+    id: Optional[int] = None
+
+class UserImportReport(BaseModel):
+    created: int
+    failed: int
+    results: List[UserImportRow]
+
+class RoundRejection(BaseModel):
+    line: int # 1-based line of the NDJSON batch
+    error: str
+
+class RoundIngestReport(BaseModel):
+    accepted: int
+    duplicates: int # already stored (re-sent) rounds
+    rejected: List[RoundRejection]
+
 class OperatorCreate(BaseModel):
     name: str
     wallet_balance: float = 0.0
@@ -110,34 +131,73 @@ class PlayerInfo(BaseModel):
 
 class DepositRequest(BaseModel):
     terminal_id: int
-    amount: float
+    amount: float = Field(..., gt=0)
 
 class SettleRequest(BaseModel):
     terminal_id: int
 
-class TerminalOut(BaseModel):
+class DepositBatchRequest(BaseModel):
+    items: List[DepositRequest]
+
+class SettleBatchRequest(BaseModel):
+    terminal_ids: List[int]
+
+class BatchItemResult(BaseModel):
+    terminal_id: int
+    status: str # ok / error
+    detail: Optional[str] = None
+    new_balance: Optional[float] = None # deposit
+    returned_cash: Optional[float] = None # settle
+
+class BatchReport(BaseModel):
+    results: List[BatchItemResult]
+
+class TerminalBulkCreate(BaseModel):
+    outlet_id: int
+    count: Optional[int] = None # Either a count (default names "N號機")
+    names: Optional[List[str]] = None # or one terminal per name
+
+class TerminalBulkOut(BaseModel):
     id: int
     code: str
+    name: Optional[str] = None
     status: str
-    pairing_key: Optional[str] = None
-    outlet_id: Optional[int] = None
-    current_player_name: Optional[str] = None
-    current_balance: Optional[float] = None
-    class Config:
-        from_attributes = True
-    pairing_key: Optional[str] = None
-
-class TerminalCreate(BaseModel):
-    code: str
     outlet_id: int
 
 class TerminalBind(BaseModel):
     pairing_key: str
     hardware_id: str
 
+class TransactionOut(BaseModel):
+    id: int
+    timestamp: datetime
+    type: str
+    amount: float
+    outlet_id: Optional[int] = None
+    terminal_id: Optional[int] = None
+    player_id: Optional[int] = None
+    staff_id: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+class TransactionPage(BaseModel):
+    items: List[TransactionOut]
+    next_cursor: Optional[str] = None # Pass back as ?cursor= for the next (older) page
+
+class OutletBreakdown(BaseModel):
+    outlet_id: int
+    name: Optional[str] = None
+    bcf_balance: float
+    active_terminals: int
+    total_turnover: float = 0.0
+    total_ggr: float = 0.0
+    net_cash: float = 0.0
+
 class OutletStats(BaseModel):
     bcf_balance: float
     active_terminals: int
-    total_turnover: float = 0.0 # Mock
-    total_ggr: float = 0.0 # Mock
-    net_cash: float = 0.0 # Mock
+    total_turnover: float = 0.0
+    total_ggr: float = 0.0
+    net_cash: float = 0.0
+    outlets: List[OutletBreakdown] = []
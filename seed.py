@@ -1,46 +1,58 @@
+import argparse
+import datetime
+import random
+
+from sqlalchemy import insert
+
 from database import SessionLocal, engine
 import models
+import provisioning
+import rollups
 from auth import get_password_hash
 
-models.Base.metadata.drop_all(bind=engine)
-models.Base.metadata.create_all(bind=engine)
+# Demo data (default) or a synthetic dataset of any size:
+#   python seed.py                                   # drop everything, demo accounts
+#   python seed.py --scale --operators 5 --outlets 20 --terminals 30 --players 50000 --months 6 --txns-per-day 40
+#   python seed.py --scale --keep ...                # add to the existing database
+# The scale generator is deterministic for a given --seed and --end, and writes with
+# multi-row inserts in batches of --batch-size rows.
 
-db = SessionLocal()
+PERMISSIONS = {
+    "DASHBOARD_VIEW": "View Dashboard",
+    "POS_OPERATE": "Operate POS",
+    "FINANCE_VIEW": "View Finance Reports",
+    "BCF_MANAGE": "Manage BCF",
+    "SETTINGS_MANAGE": "Manage Settings",
+    "USER_CREATE": "Create Users"
+}
 
-def init_db():
-    # 0. Create Permissions & Roles
-    perms = {
-        "DASHBOARD_VIEW": "View Dashboard",
-        "POS_OPERATE": "Operate POS",
-        "FINANCE_VIEW": "View Finance Reports",
-        "BCF_MANAGE": "Manage BCF",
-        "SETTINGS_MANAGE": "Manage Settings",
-        "USER_CREATE": "Create Users"
-    }
-    
-    perm_objs = {}
-    for code, desc in perms.items():
-        p = models.Permission(code=code, description=desc)
-        db.add(p)
-        perm_objs[code] = p
-    db.commit()
-    
-    roles_def = {
-        "Admin": ["DASHBOARD_VIEW", "POS_OPERATE", "FINANCE_VIEW", "BCF_MANAGE", "SETTINGS_MANAGE", "USER_CREATE"],
-        "Operator": ["DASHBOARD_VIEW", "POS_OPERATE", "FINANCE_VIEW", "BCF_MANAGE", "SETTINGS_MANAGE", "USER_CREATE"],
-        "Area Mgr": ["DASHBOARD_VIEW", "FINANCE_VIEW"],
-        "Store Mgr": ["DASHBOARD_VIEW", "POS_OPERATE", "FINANCE_VIEW"],
-        "Cashier": ["POS_OPERATE"]
-    }
-    
-    role_objs = {}
-    for r_name, p_codes in roles_def.items():
-        role = models.Role(name=r_name)
-        for code in p_codes:
-            role.permissions.append(perm_objs[code])
-        db.add(role)
-        role_objs[r_name] = role
+ROLES = {
+    "Admin": ["DASHBOARD_VIEW", "POS_OPERATE", "FINANCE_VIEW", "BCF_MANAGE", "SETTINGS_MANAGE", "USER_CREATE"],
+    "Operator": ["DASHBOARD_VIEW", "POS_OPERATE", "FINANCE_VIEW", "BCF_MANAGE", "SETTINGS_MANAGE", "USER_CREATE"],
+    "Area Mgr": ["DASHBOARD_VIEW", "FINANCE_VIEW"],
+    "Store Mgr": ["DASHBOARD_VIEW", "POS_OPERATE", "FINANCE_VIEW"],
+    "Cashier": ["POS_OPERATE"]
+}
+
+def ensure_roles(db) -> dict:
+    # Role name -> Role; creates permissions/roles missing from the database
+    perm_objs = {p.code: p for p in db.query(models.Permission)}
+    for code, desc in PERMISSIONS.items():
+        if code not in perm_objs:
+            perm_objs[code] = models.Permission(code=code, description=desc)
+            db.add(perm_objs[code])
+
+    role_objs = {r.name: r for r in db.query(models.Role)}
+    for r_name, p_codes in ROLES.items():
+        if r_name not in role_objs:
+            role_objs[r_name] = models.Role(name=r_name, permissions=[perm_objs[c] for c in p_codes])
+            db.add(role_objs[r_name])
     db.commit()
+    return role_objs
+
+def init_db(db):
+    # 0. Create Permissions & Roles
+    role_objs = ensure_roles(db)
 
     # 0.1 IP Whitelist
     ip = models.IPWhitelist(ip_address="127.0.0.1", description="Localhost")
@@ -51,40 +63,210 @@ def init_db():
     op = models.Operator(name="MegaOperator", wallet_balance=1000000.0)
     db.add(op)
     db.commit()
-    
+
     # 2. Create Outlet
-    outlet = models.Outlet(name="Taipei Flagship Store", operator_id=op.id, bcf_balance=50000.0)
+    outlet = models.Outlet(name="Taipei Flagship Store", operator_id=op.id, bcf_balance=50000.0, terminal_seq=10)
     db.add(outlet)
     db.commit()
-    
+
     # 3. Create Terminals
     for i in range(1, 11):
         t = models.Terminal(
-            code=f"OP1-TP-T{i:02d}", 
+            code=provisioning.terminal_code(outlet, i),
             name=f"{i}號機",
-            outlet_id=outlet.id, 
+            outlet_id=outlet.id,
             status=models.TerminalStatus.IDLE,
             is_active=True,
             is_paired=False
         )
         db.add(t)
     db.commit()
-    
+
     # 4. Create Users
     # Admin
     admin = models.User(username="admin", hashed_password=get_password_hash("admin123"), role=role_objs["Admin"])
     db.add(admin)
-    
+
     # Store Manager
     mgr = models.User(username="manager", hashed_password=get_password_hash("1234"), role=role_objs["Store Mgr"], outlet_id=outlet.id)
     db.add(mgr)
-    
+
     # Cashier
     cashier = models.User(username="cashier", hashed_password=get_password_hash("1234"), role=role_objs["Cashier"], outlet_id=outlet.id)
     db.add(cashier)
-    
+
     db.commit()
     print("Database initialized with seed data.")
 
+# --- Scale generator ---
+
+SCALE_PASSWORD = "1234"
+DEPOSIT_AMOUNTS = (100, 200, 300, 500, 1000, 2000)
+ROLLUP_CASH_COLUMNS = ("deposit_total", "deposit_count", "withdraw_total", "withdraw_count")
+
+def _insert_ids(db, table, rows) -> list:
+    # Multi-row insert returning the new ids in parameter order
+    if not rows:
+        return []
+    stmt = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+    return list(db.scalars(stmt, rows))
+
+def _sessions(rng, day, txns_per_day):
+    # One terminal-day: play sessions of 1-4 deposits then a settle, in time order.
+    # Yields (type, amount, timestamp) with about txns_per_day rows.
+    seconds = sorted(rng.randrange(86400) for _ in range(txns_per_day))
+    i = 0
+    while i < len(seconds):
+        deposits = min(rng.randint(1, 4), len(seconds) - i - 1)
+        if deposits < 1:
+            break
+        credit = 0
+        for s in seconds[i:i + deposits]:
+            amount = rng.choice(DEPOSIT_AMOUNTS)
+            credit += amount
+            yield models.TransactionType.DEPOSIT, amount, day + datetime.timedelta(seconds=s)
+        # Player leaves with 0-120% of what went in; the wallet is back to zero
+        yield models.TransactionType.WITHDRAW, round(credit * rng.uniform(0, 1.2)), day + datetime.timedelta(seconds=seconds[i + deposits])
+        i += deposits + 1
+
+def generate(db, operators=1, outlets=1, terminals=10, players=1000, months=1, txns_per_day=20,
+             seed=1, end=None, batch_size=10000, defer_indexes=False, log=print) -> dict:
+    # outlets/terminals are per operator/outlet. Players are spread over outlets
+    # (one wallet at their home outlet). Rollups are written from the same numbers.
+    rng = random.Random(seed)
+    end = rollups.day_start(end or datetime.datetime.utcnow())
+    days = [end - datetime.timedelta(days=d) for d in range(months * 30 - 1, -1, -1)]
+    tag = f"S{seed}"
+    role_ids = {name: role.id for name, role in ensure_roles(db).items()}
+    password_hash = get_password_hash(SCALE_PASSWORD)
+
+    # 1. Operators, outlets, staff
+    op_ids = _insert_ids(db, models.Operator.__table__, [
+        {"name": f"{tag}-Operator {o + 1}", "wallet_balance": 1e9} for o in range(operators)
+    ])
+    outlet_rows = [
+        {"name": f"{tag}-Outlet {o + 1}-{n + 1}", "operator_id": op_id, "bcf_balance": 1e7, "terminal_seq": terminals}
+        for o, op_id in enumerate(op_ids) for n in range(outlets)
+    ]
+    outlet_ids = _insert_ids(db, models.Outlet.__table__, outlet_rows)
+    outlets_ = [models.Outlet(id=oid, operator_id=row["operator_id"]) for oid, row in zip(outlet_ids, outlet_rows)]
+
+    # Every row carries the same keys: executemany takes its columns from the first row
+    users = [{"username": f"{tag}-op{o + 1}", "hashed_password": password_hash, "role_id": role_ids["Operator"],
+              "operator_id": op_id, "outlet_id": None} for o, op_id in enumerate(op_ids)]
+    cashier_rows = [{"username": f"{tag}-cashier{o.id}", "hashed_password": password_hash, "role_id": role_ids["Cashier"],
+                     "operator_id": o.operator_id, "outlet_id": o.id} for o in outlets_]
+    users += [{"username": f"{tag}-manager{o.id}", "hashed_password": password_hash, "role_id": role_ids["Store Mgr"],
+               "operator_id": o.operator_id, "outlet_id": o.id} for o in outlets_]
+    db.execute(insert(models.User.__table__), users)
+    cashier_ids = dict(zip(outlet_ids, _insert_ids(db, models.User.__table__, cashier_rows)))
+
+    # 2. Terminals, codes from the same sequence the provisioning API uses
+    terminal_ids = {}
+    for outlet in outlets_:
+        terminal_ids[outlet.id] = _insert_ids(db, models.Terminal.__table__, [
+            {"code": provisioning.terminal_code(outlet, seq), "name": f"{seq}號機", "outlet_id": outlet.id,
+             "status": models.TerminalStatus.IDLE, "is_active": True, "is_paired": False}
+            for seq in range(1, terminals + 1)
+        ])
+
+    # 3. Players and their home-outlet wallets
+    home_players = {oid: [] for oid in outlet_ids}
+    for start in range(0, players, batch_size):
+        chunk = range(start, min(start + batch_size, players))
+        # Synthetic numbers start with 8 so they never collide with real 09 mobiles
+        ids = _insert_ids(db, models.Player.__table__, [
+            {"phone": f"8{seed:03d}{n:09d}", "nickname": f"Player_{n}"} for n in chunk
+        ])
+        wallets = []
+        for n, pid in zip(chunk, ids):
+            oid = outlet_ids[n % len(outlet_ids)]
+            home_players[oid].append(pid)
+            wallets.append({"player_id": pid, "outlet_id": oid, "balance": 0.0})
+        db.execute(insert(models.Wallet.__table__), wallets)
+    db.commit()
+    log(f"{len(op_ids)} operators, {len(outlet_ids)} outlets, {len(outlet_ids) * terminals} terminals, {players} players")
+
+    # 4. Transactions, day by day, in batches
+    txn_table = models.Transaction.__table__
+    if defer_indexes:
+        # Building the indexes once at the end beats maintaining them per batch
+        for index in txn_table.indexes:
+            index.drop(db.connection(), checkfirst=True)
+        db.commit()
+
+    totals = {}  # (outlet_id, bucket) -> rollup columns
+    batch, written = [], 0
+    for day in days:
+        for oid in outlet_ids:
+            pool = home_players[oid]
+            if not pool:
+                continue
+            for tid in terminal_ids[oid]:
+                player = rng.choice(pool)
+                for txn_type, amount, ts in _sessions(rng, day, txns_per_day):
+                    batch.append({"timestamp": ts, "type": txn_type, "amount": amount, "outlet_id": oid,
+                                  "terminal_id": tid, "player_id": player, "staff_id": cashier_ids[oid]})
+                    entry = totals.setdefault((oid, rollups.bucket_for(ts)), dict.fromkeys(ROLLUP_CASH_COLUMNS, 0))
+                    side = "deposit" if txn_type == models.TransactionType.DEPOSIT else "withdraw"
+                    entry[f"{side}_total"] += amount
+                    entry[f"{side}_count"] += 1
+                    if txn_type == models.TransactionType.WITHDRAW:
+                        player = rng.choice(pool)
+                    if len(batch) >= batch_size:
+                        db.execute(insert(txn_table), batch)
+                        db.commit()
+                        written += len(batch)
+                        batch = []
+        log(f"{day:%Y-%m-%d}: {written + len(batch)} transactions")
+    if batch:
+        db.execute(insert(txn_table), batch)
+        written += len(batch)
+    db.commit()
+
+    if defer_indexes:
+        for index in txn_table.indexes:
+            index.create(db.connection(), checkfirst=True)
+        db.commit()
+
+    # 5. Dashboard rollups for what was just written
+    rollup_rows = [{"outlet_id": oid, "bucket": bucket, **cols} for (oid, bucket), cols in totals.items()]
+    for start in range(0, len(rollup_rows), batch_size):
+        db.execute(insert(models.OutletRollup.__table__), rollup_rows[start:start + batch_size])
+    db.commit()
+    log(f"{written} transactions, {len(rollup_rows)} rollup rows")
+    return {"operators": op_ids, "outlets": outlet_ids, "transactions": written}
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Initialise the database with demo or synthetic data")
+    parser.add_argument("--keep", action="store_true", help="Do not drop existing tables")
+    parser.add_argument("--scale", action="store_true", help="Generate a synthetic dataset instead of the demo accounts")
+    parser.add_argument("--operators", type=int, default=1)
+    parser.add_argument("--outlets", type=int, default=5, help="Per operator")
+    parser.add_argument("--terminals", type=int, default=20, help="Per outlet")
+    parser.add_argument("--players", type=int, default=10000)
+    parser.add_argument("--months", type=int, default=1, help="30-day months of history, ending today")
+    parser.add_argument("--txns-per-day", type=int, default=20, help="Per terminal")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--end", type=datetime.date.fromisoformat, default=None, help="Last day of history (YYYY-MM-DD, default today UTC)")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--defer-indexes", action="store_true", help="Drop transaction indexes during the load, rebuild after")
+    args = parser.parse_args()
+
+    if not args.keep:
+        models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+
+    db = SessionLocal()
+    try:
+        if not args.scale:
+            init_db(db)
+            return
+        end = datetime.datetime.combine(args.end, datetime.time()) if args.end else None
+        generate(db, args.operators, args.outlets, args.terminals, args.players, args.months, args.txns_per_day,
+                 args.seed, end, args.batch_size, args.defer_indexes)
+    finally:
+        db.close()
+
 if __name__ == "__main__":
-    init_db()
+    main_cli()
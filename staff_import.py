@@ -0,0 +1,111 @@
+import csv
+import io
+import json
+from typing import List
+
+from fastapi import HTTPException
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+import auth
+import models
+
+# Bulk staff import (CSV or JSON). Level Guard and Scope Guard are the same rules
+# as create_user, evaluated against roles/outlets/usernames loaded once per batch.
+# Valid rows are inserted in one transaction; every row gets a result entry.
+
+MAX_IMPORT_ROWS = 10000
+FIELDS = ("username", "password", "role", "outlet_id")
+
+def parse_rows(body: bytes, content_type: str) -> List[dict]:
+    # CSV needs a header row: username,password,role,outlet_id (role by name or role_id)
+    try:
+        text = body.decode("utf-8-sig")
+        if "json" in content_type:
+            rows = json.loads(text)
+            if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+                raise ValueError("expected a JSON array of objects")
+        else:
+            rows = list(csv.DictReader(io.StringIO(text)))
+    except (UnicodeDecodeError, ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Unreadable import file: {e}")
+    if len(rows) > MAX_IMPORT_ROWS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_IMPORT_ROWS} rows per import")
+    return rows
+
+def _clean(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+def import_users(db: Session, current_user: auth.Principal, rows: List[dict]) -> dict:
+    creator_role = current_user.role_name
+    allowed = set(auth.ALLOWED_CREATION.get(creator_role, []))
+
+    # 1. Load everything the guards need, once
+    roles = db.execute(select(models.Role.id, models.Role.name)).all()
+    role_by_name = {name: (rid, name) for rid, name in roles}
+    role_by_id = {str(rid): (rid, name) for rid, name in roles}
+    outlet_refs = {_clean(r.get("outlet_id")) for r in rows} - {None}
+    outlet_ids = {int(o) for o in outlet_refs if o.isdigit()}
+    outlets = dict(db.execute(select(models.Outlet.id, models.Outlet.operator_id).where(models.Outlet.id.in_(outlet_ids))).all())
+    usernames = {_clean(r.get("username")) for r in rows} - {None}
+    taken = set(db.scalars(select(models.User.username).where(models.User.username.in_(usernames))))
+
+    # 2. Validate rows
+    results, accepted = [], []
+    for n, raw in enumerate(rows, start=1):
+        username, password = _clean(raw.get("username")), _clean(raw.get("password"))
+        role_ref = _clean(raw.get("role")) or _clean(raw.get("role_id"))
+        outlet_ref = _clean(raw.get("outlet_id"))
+
+        def reject(detail):
+            results.append({"row": n, "username": username, "status": "error", "detail": detail})
+
+        if not username or not password or not role_ref:
+            reject("username, password and role are required")
+            continue
+        if username in taken:
+            reject("Username already exists")
+            continue
+        role = role_by_name.get(role_ref) or role_by_id.get(role_ref)
+        if not role:
+            reject("Role not found")
+            continue
+        if role[1] not in allowed:
+            reject(f"Level Guard: {creator_role} cannot create {role[1]}")
+            continue
+
+        outlet_id = int(outlet_ref) if outlet_ref and outlet_ref.isdigit() else None
+        if outlet_ref and outlet_id not in outlets:
+            reject("Outlet not found")
+            continue
+        operator_id = None
+        if creator_role == "Operator":
+            operator_id = current_user.operator_id
+            if outlet_id and outlets[outlet_id] != operator_id:
+                reject("Scope Guard: Outlet not found in your scope")
+                continue
+        elif creator_role == "Store Mgr":
+            outlet_id = current_user.outlet_id # Force lock
+            operator_id = current_user.operator_id
+
+        taken.add(username)
+        results.append({"row": n, "username": username, "status": "created", "detail": None})
+        accepted.append((results[-1], {
+            "username": username, "password": password, "role_id": role[0],
+            "outlet_id": outlet_id, "operator_id": operator_id
+        }))
+
+    # 3. Hash in parallel, insert in one transaction
+    if accepted:
+        hashes = auth.hash_passwords_bulk([values.pop("password") for _, values in accepted])
+        values = [dict(v, hashed_password=h) for (_, v), h in zip(accepted, hashes)]
+        ids = dict(db.execute(insert(models.User).returning(models.User.username, models.User.id), values).all())
+        db.commit()
+        for result, v in accepted:
+            result["id"] = ids[v["username"]]
+
+    created = len(accepted)
+    return {"created": created, "failed": len(results) - created, "results": results}
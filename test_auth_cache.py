@@ -0,0 +1,34 @@
+import auth
+from conftest import QueryCounter, login
+
+def test_principal_is_cached_per_token(client, db_engine, async_db_engine, org):
+    headers = login(client, "cashier")
+    client.get("/api/pos/terminals", headers=headers)
+
+    with QueryCounter(db_engine, async_db_engine) as counter:
+        resp = client.get("/api/pos/terminals", headers=headers)
+    assert resp.status_code == 200
+    # Only the terminal listing itself hits the DB
+    assert counter.count == 1
+
+def test_role_update_invalidates_cached_permissions(client, db, org):
+    admin = login(client, "admin")
+    cashier = login(client, "cashier")
+    assert client.get("/api/pos/terminals", headers=cashier).status_code == 200
+
+    cashier_role = org["roles"]["Cashier"]
+    resp = client.put(f"/api/roles/{cashier_role.id}", json={"name": "Cashier", "permission_ids": []}, headers=admin)
+    assert resp.status_code == 200
+
+    resp = client.get("/api/pos/terminals", headers=cashier)
+    assert resp.status_code == 403
+
+def test_invalidate_single_user(org):
+    auth.principal_cache.clear()
+    users = org["users"]
+    auth.principal_cache.set("token-a", auth.Principal.from_user(users["cashier"]))
+    auth.principal_cache.set("token-b", auth.Principal.from_user(users["manager"]))
+
+    auth.invalidate_principals(user_id=users["cashier"].id)
+    assert auth.principal_cache.get("token-a") is None
+    assert auth.principal_cache.get("token-b") is not None
@@ -0,0 +1,108 @@
+import datetime
+
+import models
+import rollups
+from conftest import QueryCounter, add_terminals, login
+
+def play(client, cashier, terminal, deposits, phone="0912345678"):
+    client.post("/api/bind_terminal", data={"terminal_id": terminal.id, "phone": phone}, headers=cashier)
+    for amount in deposits:
+        assert client.post("/api/deposit", json={"terminal_id": terminal.id, "amount": amount}, headers=cashier).status_code == 200
+
+def test_dashboard_reports_rollup_totals(client, db, org):
+    terminals = add_terminals(db, org["outlet"], count=2)
+    cashier = login(client, "cashier")
+    play(client, cashier, terminals[0], [300, 200])
+    play(client, cashier, terminals[1], [100], phone="0922222222")
+    # Player wins nothing back: settle returns the wallet as-is
+    assert client.post("/api/settle", json={"terminal_id": terminals[0].id}, headers=cashier).json()["returned_cash"] == 500
+
+    rows = db.query(models.OutletRollup).all()
+    assert sum(r.deposit_total for r in rows) == 600 and sum(r.deposit_count for r in rows) == 3
+    assert sum(r.withdraw_total for r in rows) == 500 and sum(r.withdraw_count for r in rows) == 1
+
+    stats = client.get("/api/dashboard", headers=login(client, "manager")).json()
+    # No rounds reported yet: no play, only cash
+    assert stats["total_turnover"] == 0
+    assert stats["total_ggr"] == 0
+    assert stats["net_cash"] == 100
+    assert stats["bcf_balance"] == 50000 - 100
+    assert stats["active_terminals"] == 2
+    assert [o["outlet_id"] for o in stats["outlets"]] == [org["outlet"].id]
+
+    # Admin and operator see the same single outlet in aggregate
+    for user in ("admin", "operator"):
+        assert client.get("/api/dashboard", headers=login(client, user)).json() == stats
+
+def test_dashboard_only_counts_today(client, db, org):
+    outlet = org["outlet"]
+    yesterday = rollups.bucket_for(datetime.datetime.utcnow() - datetime.timedelta(days=1))
+    db.add(models.OutletRollup(outlet_id=outlet.id, bucket=yesterday, deposit_total=999, deposit_count=1, bet_total=999, round_count=1))
+    db.commit()
+    stats = client.get("/api/dashboard", headers=login(client, "manager")).json()
+    assert stats["total_turnover"] == 0
+    assert stats["net_cash"] == 0
+
+def test_rebuild_matches_incremental_rollups(client, db, org):
+    terminal = add_terminals(db, org["outlet"])[0]
+    cashier = login(client, "cashier")
+    play(client, cashier, terminal, [300, 50])
+    client.post("/api/settle", json={"terminal_id": terminal.id}, headers=cashier)
+
+    def snapshot():
+        db.expire_all()
+        return sorted((r.outlet_id, r.bucket, r.deposit_total, r.deposit_count, r.withdraw_total, r.withdraw_count) for r in db.query(models.OutletRollup))
+
+    incremental = snapshot()
+    db.query(models.OutletRollup).delete()
+    db.commit()
+    assert rollups.rebuild(db) == len(incremental)
+    assert snapshot() == incremental
+
+def test_operator_dashboard_aggregates_outlets_in_one_query(client, db, db_engine, async_db_engine, org):
+    operator = org["operator"]
+    outlets = [models.Outlet(name=f"Outlet {i}", operator_id=operator.id, bcf_balance=100.0) for i in range(300)]
+    db.add_all(outlets)
+    db.flush()
+    today = rollups.bucket_for(datetime.datetime.utcnow())
+    for i, outlet in enumerate(outlets):
+        db.add(models.Terminal(code=f"T-{i}", name="1", outlet_id=outlet.id, status=models.TerminalStatus.IDLE, bcf_escrow=10.0))
+        db.add(models.Terminal(code=f"T-{i}-off", name="2", outlet_id=outlet.id, status=models.TerminalStatus.OFFLINE))
+        db.add(models.OutletRollup(outlet_id=outlet.id, bucket=today, deposit_total=50, deposit_count=1, withdraw_total=20, withdraw_count=1,
+                                   bet_total=80, win_total=60, round_count=4))
+    # Another operator's outlet stays out of scope
+    other = models.Operator(name="Other")
+    db.add(other)
+    db.flush()
+    db.add(models.Outlet(name="Elsewhere", operator_id=other.id, bcf_balance=1e6))
+    db.commit()
+
+    headers = login(client, "operator")
+    with QueryCounter(db_engine, async_db_engine) as counter:
+        stats = client.get("/api/dashboard", headers=headers).json()
+    # Auth lookup + one grouped query, however many outlets
+    assert counter.count <= 2
+
+    assert len(stats["outlets"]) == 301 # the fixture outlet plus 300
+    assert stats["bcf_balance"] == 50000 + 300 * 110
+    assert stats["active_terminals"] == 300
+    assert stats["total_turnover"] == 300 * 80
+    assert stats["total_ggr"] == 300 * 20
+    assert stats["net_cash"] == 300 * 30
+    breakdown = stats["outlets"][-1]
+    assert (breakdown["bcf_balance"], breakdown["active_terminals"], breakdown["total_ggr"], breakdown["net_cash"]) == (110, 1, 20, 30)
+
+    # Served from cache until the TTL runs out
+    with QueryCounter(db_engine, async_db_engine) as counter:
+        assert client.get("/api/dashboard", headers=headers).json() == stats
+    assert counter.count == 0
+
+def test_outlet_breakdown_reads_only_the_scoped_outlets(db_engine):
+    since = rollups.day_start()
+    for scope in ({"outlet_id": 5}, {"operator_id": 2}):
+        sql = str(rollups.outlet_breakdown_query(since, **scope).compile(db_engine, compile_kwargs={"literal_binds": True}))
+        with db_engine.connect() as conn:
+            plan = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+        # Both groupings go through the (outlet_id, ...) indexes instead of scanning every outlet's rows
+        assert not [step for step in plan if step.startswith(("SCAN terminals", "SCAN outlet_rollups"))], plan
+        assert any(step.startswith("SEARCH outlet_rollups") and "bucket>" in step for step in plan), plan
@@ -0,0 +1,97 @@
+import asyncio
+import datetime
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import game_rounds
+import heartbeats
+from events import terminal_events
+import models
+from conftest import QueryCounter, add_terminals, login, pair, run_with_session
+
+def ping(client, token):
+    headers = {game_rounds.DEVICE_TOKEN_HEADER: token} if token else {}
+    return client.post("/api/terminals/heartbeat", headers=headers)
+
+def test_pings_are_coalesced_into_one_batched_update(client, db, async_db_engine, org):
+    terminals = add_terminals(db, org["outlet"], count=50)
+    tokens = [pair(db, t, f"tok-{t.id}") for t in terminals]
+
+    for _ in range(5):
+        for token in tokens:
+            assert ping(client, token).status_code == 202
+    assert len(heartbeats.heartbeat_buffer) == 50
+
+    with QueryCounter(async_db_engine) as counter:
+        assert run_with_session(async_db_engine, heartbeats.heartbeat_buffer.flush) == 50
+    # One executemany UPDATE (+ transaction bookkeeping), not one write per ping
+    assert counter.count <= 2
+    assert len(heartbeats.heartbeat_buffer) == 0
+
+    db.expire_all()
+    assert all(t.last_seen is not None for t in db.query(models.Terminal))
+
+def test_pings_need_the_device_token_of_an_active_terminal(client, db, org):
+    live, disabled = add_terminals(db, org["outlet"], count=2)
+    pair(db, live, "live")
+    pair(db, disabled, "off")
+    disabled.is_active = False
+    db.commit()
+
+    assert ping(client, None).status_code == 401
+    assert ping(client, "forged").status_code == 401
+    assert ping(client, "off").status_code == 403
+    assert len(heartbeats.heartbeat_buffer) == 0
+    assert ping(client, "live").status_code == 202
+    assert heartbeats.heartbeat_buffer.drain().keys() == {"HW-live"}
+
+def test_sweeper_marks_silent_idle_terminals_offline(client, db, async_db_engine, org):
+    idle, busy, fresh, never = add_terminals(db, org["outlet"], count=4)
+    long_ago = datetime.datetime.utcnow() - datetime.timedelta(seconds=heartbeats.OFFLINE_AFTER_SECONDS + 10)
+    for t, hw in ((idle, "HW-idle"), (busy, "HW-busy"), (fresh, "HW-fresh")):
+        t.hardware_id = hw
+        t.last_seen = long_ago
+    busy.status = models.TerminalStatus.OCCUPIED
+    fresh.last_seen = datetime.datetime.utcnow()
+    db.commit()
+
+    assert run_with_session(async_db_engine, heartbeats.sweep) == 1
+    db.expire_all()
+    statuses = {t.id: t.status for t in db.query(models.Terminal)}
+    assert statuses == {
+        idle.id: models.TerminalStatus.OFFLINE,
+        busy.id: models.TerminalStatus.OCCUPIED,
+        fresh.id: models.TerminalStatus.IDLE,
+        never.id: models.TerminalStatus.IDLE,
+    }
+    assert client.get("/api/dashboard", headers=login(client, "manager")).json()["active_terminals"] == 3
+
+    # Next heartbeat brings it back
+    heartbeats.heartbeat_buffer.record("HW-idle")
+    run_with_session(async_db_engine, heartbeats.heartbeat_buffer.flush)
+    db.expire_all()
+    assert db.get(models.Terminal, idle.id).status == models.TerminalStatus.IDLE
+
+def test_status_changes_reach_pos_screens(client, db, async_db_engine, org):
+    terminal = add_terminals(db, org["outlet"], count=1)[0]
+    terminal.hardware_id = "HW-1"
+    terminal.last_seen = datetime.datetime.utcnow() - datetime.timedelta(seconds=heartbeats.OFFLINE_AFTER_SECONDS + 10)
+    db.commit()
+
+    async def scenario():
+        queue = terminal_events.subscribe(org["outlet"].id)
+        try:
+            async with AsyncSession(async_db_engine, expire_on_commit=False) as session:
+                await heartbeats.sweep(session)
+                heartbeats.heartbeat_buffer.record("HW-1")
+                await heartbeats.heartbeat_buffer.flush(session)
+            await asyncio.sleep(0)
+            return [queue.get_nowait() for _ in range(queue.qsize())]
+        finally:
+            terminal_events.unsubscribe(org["outlet"].id, queue)
+
+    received = asyncio.run(scenario())
+    assert [(e["id"], e["status"]) for e in received] == [
+        (terminal.id, models.TerminalStatus.OFFLINE),
+        (terminal.id, models.TerminalStatus.IDLE),
+    ]
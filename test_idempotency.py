@@ -0,0 +1,82 @@
+import asyncio
+import datetime
+
+import httpx
+
+import idempotency
+import main
+import models
+from conftest import add_terminals, login
+
+def bound_terminal(client, db, org):
+    terminal = add_terminals(db, org["outlet"])[0]
+    cashier = login(client, "cashier")
+    client.post("/api/bind_terminal", data={"terminal_id": terminal.id, "phone": "0912345678"}, headers=cashier)
+    return terminal, cashier
+
+def test_retried_deposit_is_applied_once(client, db, org):
+    terminal, cashier = bound_terminal(client, db, org)
+    headers = {**cashier, "Idempotency-Key": "dep-1"}
+    first = client.post("/api/deposit", json={"terminal_id": terminal.id, "amount": 300}, headers=headers)
+    retry = client.post("/api/deposit", json={"terminal_id": terminal.id, "amount": 300}, headers=headers)
+    assert first.json() == retry.json() == {"message": "Deposit successful", "new_balance": 300}
+    assert retry.headers["idempotent-replayed"] == "true"
+
+    # A new key is a new deposit
+    assert client.post("/api/deposit", json={"terminal_id": terminal.id, "amount": 100}, headers={**cashier, "Idempotency-Key": "dep-2"}).json()["new_balance"] == 400
+
+    db.expire_all()
+    assert db.query(models.Transaction).count() == 2
+    assert db.get(models.Outlet, org["outlet"].id).bcf_balance == 50000 - 400
+
+def test_reused_key_with_different_request_is_rejected(client, db, org):
+    terminal, cashier = bound_terminal(client, db, org)
+    headers = {**cashier, "Idempotency-Key": "dep-1"}
+    assert client.post("/api/deposit", json={"terminal_id": terminal.id, "amount": 300}, headers=headers).status_code == 200
+    for cleared in (False, True):
+        if cleared:
+            # Checked against the stored record too, not only the memory cache
+            idempotency.response_cache.clear()
+        resp = client.post("/api/deposit", json={"terminal_id": terminal.id, "amount": 500}, headers=headers)
+        assert resp.status_code == 422
+
+    db.expire_all()
+    assert db.query(models.Transaction).count() == 1
+    assert db.query(models.Wallet).one().balance == 300
+
+def test_replay_survives_memory_cache_loss(client, db, org):
+    terminal, cashier = bound_terminal(client, db, org)
+    client.post("/api/deposit", json={"terminal_id": terminal.id, "amount": 300}, headers=cashier)
+    headers = {**cashier, "Idempotency-Key": "settle-1"}
+    assert client.post("/api/settle", json={"terminal_id": terminal.id}, headers=headers).json()["returned_cash"] == 300
+    idempotency.response_cache.clear()
+    # Served from the table, not a second (failing) settle
+    resp = client.post("/api/settle", json={"terminal_id": terminal.id}, headers=headers)
+    assert resp.status_code == 200
+    assert resp.json()["returned_cash"] == 300
+
+def test_expired_record_does_not_replay(client, db, org):
+    terminal, cashier = bound_terminal(client, db, org)
+    headers = {**cashier, "Idempotency-Key": "dep-old"}
+    client.post("/api/deposit", json={"terminal_id": terminal.id, "amount": 10}, headers=headers)
+    idempotency.response_cache.clear()
+    db.query(models.IdempotencyRecord).update({"expires_at": datetime.datetime.utcnow() - datetime.timedelta(seconds=1)})
+    db.commit()
+    assert client.post("/api/deposit", json={"terminal_id": terminal.id, "amount": 10}, headers=headers).json()["new_balance"] == 20
+
+def test_concurrent_duplicates_credit_once(client, db, org):
+    terminal, cashier = bound_terminal(client, db, org)
+    headers = {**cashier, "Idempotency-Key": "storm"}
+
+    async def storm():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as c:
+            calls = [c.post("/api/deposit", json={"terminal_id": terminal.id, "amount": 50}, headers=headers) for _ in range(8)]
+            return await asyncio.gather(*calls)
+
+    responses = asyncio.run(storm())
+    assert all(r.status_code == 200 for r in responses)
+    assert {r.json()["new_balance"] for r in responses} == {50}
+    db.expire_all()
+    assert db.query(models.Transaction).count() == 1
+    assert db.query(models.Wallet).one().balance == 50
@@ -0,0 +1,47 @@
+from fastapi.testclient import TestClient
+
+import auth
+import main
+from conftest import login
+from ip_whitelist import WhitelistIndex, whitelist
+
+def test_cidr_and_scope_lookup():
+    index = WhitelistIndex()
+    skipped = index.build([
+        ("10.0.0.0/8", None),
+        ("192.168.1.15", 7),
+        ("2001:db8::/32", 7),
+        ("not-an-ip", None),
+    ])
+    assert skipped == ["not-an-ip"]
+
+    assert index.is_allowed("10.20.30.40")
+    assert index.is_allowed("::ffff:10.1.2.3")
+    assert not index.is_allowed("11.0.0.1")
+
+    assert index.is_allowed("192.168.1.15", outlet_id=7)
+    assert not index.is_allowed("192.168.1.15", outlet_id=8)
+    assert not index.is_allowed("192.168.1.15")
+    assert index.is_allowed("2001:db8:1::5", outlet_id=7)
+    assert not index.is_allowed("testclient")
+
+def test_whitelist_enforced_on_token_and_pos(client, db, org, monkeypatch):
+    monkeypatch.setattr(auth, "IP_WHITELIST_ENABLED", True)
+    monkeypatch.setattr(whitelist, "loaded_at", None)
+    # TestClient connects as "testclient"; nothing can match until the check is relaxed
+    resp = client.post("/token", data={"username": "cashier", "password": "1234"})
+    assert resp.status_code == 403
+
+    monkeypatch.setattr(auth, "IP_WHITELIST_ENABLED", False)
+    admin = login(client, "admin")
+    cashier = login(client, "cashier")
+    resp = client.post("/api/settings/ip_whitelist", json={"ip_address": "10.9.0.0/16", "description": "Shop LAN", "outlet_id": org["outlet"].id}, headers=admin)
+    assert resp.status_code == 200
+
+    monkeypatch.setattr(auth, "IP_WHITELIST_ENABLED", True)
+    assert client.get("/api/pos/terminals", headers=cashier).status_code == 403
+
+    # The new outlet-scoped entry is live immediately for that outlet's staff only
+    shop = TestClient(main.app, client=("10.9.3.4", 50000))
+    assert shop.get("/api/pos/terminals", headers=cashier).status_code == 200
+    assert shop.post("/token", data={"username": "admin", "password": "1234"}).status_code == 403
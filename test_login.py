@@ -0,0 +1,25 @@
+from passlib.context import CryptContext
+
+import auth
+import models
+from conftest import PASSWORD
+
+def test_login_rehashes_outdated_cost(client, db, org):
+    cashier = org["users"]["cashier"]
+    old_cost = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=4)
+    cashier.hashed_password = old_cost.hash(PASSWORD)
+    db.commit()
+
+    resp = client.post("/token", data={"username": "cashier", "password": PASSWORD})
+    assert resp.status_code == 200
+
+    db.expire_all()
+    stored = db.query(models.User).filter(models.User.id == cashier.id).one().hashed_password
+    assert stored.startswith(f"$2b${auth.BCRYPT_ROUNDS:02d}$")
+    assert auth.verify_password(PASSWORD, stored)
+
+def test_login_rejects_bad_password(client, org):
+    resp = client.post("/token", data={"username": "cashier", "password": "wrong"})
+    assert resp.status_code == 401
+    resp = client.post("/token", data={"username": "nobody", "password": PASSWORD})
+    assert resp.status_code == 401
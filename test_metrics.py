@@ -0,0 +1,74 @@
+import datetime
+import re
+
+import metrics
+import models
+import write_behind
+from conftest import add_terminals, login
+
+def sample(text, name, **labels):
+    # Value of one series; labels may come in any order
+    want = {k: str(v) for k, v in labels.items()}
+    for line in text.splitlines():
+        series, _, value = line.rpartition(" ")
+        if series.split("{")[0] == name and dict(re.findall(r'(\w+)="([^"]*)"', series)) == want:
+            return float(value)
+    return None
+
+def test_metrics_report_routes_status_and_sql(client, db, org):
+    terminal = add_terminals(db, org["outlet"])[0]
+    cashier = login(client, "cashier")
+    metrics.reset()
+
+    client.post("/api/bind_terminal", data={"terminal_id": terminal.id, "phone": "0912345678"}, headers=cashier)
+    for _ in range(3):
+        assert client.post("/api/deposit", json={"terminal_id": terminal.id, "amount": 10}, headers=cashier).status_code == 200
+    assert client.post("/api/deposit", json={"terminal_id": terminal.id, "amount": -1}, headers=cashier).status_code == 422
+    # Sync endpoint, runs in the threadpool
+    assert client.get("/api/users", headers=login(client, "admin")).status_code == 200
+    assert client.get(f"/api/terminals/{terminal.id}/nope").status_code == 404
+
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain")
+    text = resp.text
+
+    assert sample(text, "oms_http_requests_total", method="POST", route="/api/deposit", status=200) == 3
+    assert sample(text, "oms_http_requests_total", method="POST", route="/api/deposit", status=422) == 1
+    assert sample(text, "oms_http_requests_total", method="GET", route="<unmatched>", status=404) == 1
+    assert sample(text, "oms_http_request_duration_seconds_count", method="POST", route="/api/deposit") == 4
+    assert sample(text, "oms_http_request_duration_seconds_bucket", method="POST", route="/api/deposit", le="+Inf") == 4
+
+    # Statements are attributed to the request that ran them, async and sync alike
+    assert sample(text, "oms_db_statements_per_request_count", method="POST", route="/api/deposit") == 4
+    assert sample(text, "oms_db_statements_per_request_sum", method="POST", route="/api/deposit") >= 3 * 3
+    assert sample(text, "oms_db_statements_per_request_bucket", method="POST", route="/api/deposit", le=0) == 1  # the 422
+    assert sample(text, "oms_db_statements_per_request_sum", method="GET", route="/api/users") >= 1
+    assert sample(text, "oms_db_seconds_per_request_sum", method="GET", route="/api/users") > 0
+    # The scrape itself is in flight while rendering
+    assert sample(text, "oms_http_requests_in_flight", method="GET") == 1
+
+def test_histogram_buckets_are_cumulative():
+    h = metrics.Histogram("t_seconds", "test", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        h.observe(value, "/x")
+    lines = h.render()
+    assert 't_seconds_bucket{route="/x",le="0.1"} 1' in lines
+    assert 't_seconds_bucket{route="/x",le="1.0"} 3' in lines
+    assert 't_seconds_bucket{route="/x",le="+Inf"} 4' in lines
+    assert 't_seconds_count{route="/x"} 4' in lines
+
+def test_metrics_expose_the_write_behind_queue(client, org, monkeypatch):
+    writer = write_behind.LogWriter()
+    monkeypatch.setattr(write_behind, "writer", writer)
+    writer.enqueue([models.Transaction(timestamp=datetime.datetime.utcnow() - datetime.timedelta(seconds=30))])
+    writer.failures, writer.dropped = 2, 1
+
+    text = client.get("/metrics").text
+    assert sample(text, "oms_write_behind_queue_depth") == 1
+    assert sample(text, "oms_write_behind_rows_enqueued_total") == 1
+    assert sample(text, "oms_write_behind_flush_failures_total") == 2
+    assert sample(text, "oms_write_behind_rows_dropped_total") == 1
+    assert sample(text, "oms_write_behind_running") == 0
+    assert sample(text, "oms_write_behind_lag_seconds") >= 30
+    assert "# TYPE oms_write_behind_rows_written_total counter" in text
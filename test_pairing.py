@@ -0,0 +1,47 @@
+import datetime
+
+from sqlalchemy import text
+
+import models
+import pairing
+from conftest import add_terminals, login, run_with_session
+
+def test_issue_and_redeem_pairing_code(client, db, org):
+    first, second = add_terminals(db, org["outlet"], count=2)
+    admin = login(client, "admin")
+    code = client.post(f"/api/terminals/{first.id}/pair", headers=admin).json()["pairing_code"]
+
+    resp = client.post("/api/terminals/pair/redeem", json={"pairing_key": code.lower(), "hardware_id": "HW-1"})
+    assert resp.status_code == 200
+    assert resp.json()["terminal_id"] == first.id
+    # The device credential is handed out once; only its hash is kept
+    token = resp.json()["device_token"]
+    db.expire_all()
+    assert db.get(models.Terminal, first.id).device_token_hash == pairing.hash_device_token(token) != token
+    # Single use
+    assert client.post("/api/terminals/pair/redeem", json={"pairing_key": code, "hardware_id": "HW-1"}).status_code == 400
+
+    # Re-pairing the same device to another terminal releases the first one
+    code = client.post(f"/api/terminals/{second.id}/pair", headers=admin).json()["pairing_code"]
+    assert client.post("/api/terminals/pair/redeem", json={"pairing_key": code, "hardware_id": "HW-1"}).status_code == 200
+    db.expire_all()
+    first, second = db.get(models.Terminal, first.id), db.get(models.Terminal, second.id)
+    assert (first.is_paired, first.hardware_id, first.device_token_hash) == (False, None, None)
+    assert (second.is_paired, second.hardware_id, second.pairing_code) == (True, "HW-1", None)
+
+def test_expired_codes_are_rejected_and_swept(client, db, async_db_engine, org):
+    expired, live = add_terminals(db, org["outlet"], count=2)
+    now = datetime.datetime.utcnow()
+    expired.pairing_code, expired.pairing_expires_at = "AAAAAA", now - datetime.timedelta(minutes=1)
+    live.pairing_code, live.pairing_expires_at = "BBBBBB", now + datetime.timedelta(minutes=5)
+    db.commit()
+
+    assert client.post("/api/terminals/pair/redeem", json={"pairing_key": "AAAAAA", "hardware_id": "HW-9"}).status_code == 400
+    assert run_with_session(async_db_engine, pairing.sweep_expired) == 1
+    db.expire_all()
+    assert db.get(models.Terminal, expired.id).pairing_code is None
+    assert db.get(models.Terminal, live.id).pairing_code == "BBBBBB"
+
+def test_redeem_lookup_uses_index(db, org):
+    plan = " ".join(str(r) for r in db.execute(text("EXPLAIN QUERY PLAN UPDATE terminals SET is_paired = 1 WHERE pairing_code = 'ABCDEF'")))
+    assert "USING INDEX" in plan
@@ -0,0 +1,85 @@
+import pytest
+
+import models
+import pos_batch
+from conftest import add_terminals, login, outlet_bcf_total
+
+def bind_all(client, cashier, terminals):
+    for i, t in enumerate(terminals):
+        assert client.post("/api/bind_terminal", data={"terminal_id": t.id, "phone": f"09100000{i:02d}"}, headers=cashier).status_code == 200
+
+def test_batch_deposit_reports_each_item(client, db, org):
+    terminals = add_terminals(db, org["outlet"], count=4)
+    cashier = login(client, "cashier")
+    bind_all(client, cashier, terminals[:3])
+
+    items = [{"terminal_id": t.id, "amount": 100 * (i + 1)} for i, t in enumerate(terminals)]
+    resp = client.post("/api/deposit/batch", json={"items": items}, headers=cashier)
+    assert resp.status_code == 200
+    results = resp.json()["results"]
+    assert [r["status"] for r in results] == ["ok", "ok", "ok", "error"]
+    assert [r["new_balance"] for r in results[:3]] == [100, 200, 300]
+    assert results[3]["detail"] == "Terminal not active"
+
+    db.expire_all()
+    assert db.get(models.Outlet, org["outlet"].id).bcf_balance == 50000 - 600
+    assert db.query(models.Transaction).count() == 3
+    assert sum(r.deposit_total for r in db.query(models.OutletRollup)) == 600
+
+def test_batch_deposit_falls_back_when_outlet_cannot_cover_all(client, db, org):
+    outlet = org["outlet"]
+    terminals = add_terminals(db, outlet, count=3)
+    cashier = login(client, "cashier")
+    bind_all(client, cashier, terminals)
+    outlet.bcf_balance = 250.0
+    db.commit()
+
+    items = [{"terminal_id": t.id, "amount": 100} for t in terminals]
+    results = client.post("/api/deposit/batch", json={"items": items}, headers=cashier).json()["results"]
+    assert [r["status"] for r in results] == ["ok", "ok", "error"]
+    assert results[2]["detail"] == "Insufficient BCF Balance"
+    db.expire_all()
+    assert db.get(models.Outlet, outlet.id).bcf_balance == 50.0
+
+@pytest.mark.parametrize("escrow_mode", [False, True])
+def test_close_floor_in_one_request(client, db, db_engine, async_db_engine, org, request, escrow_mode):
+    if escrow_mode:
+        request.getfixturevalue("escrow")
+    outlet = org["outlet"]
+    # Room for a full escrow chunk on every machine
+    outlet.bcf_balance = 200000.0
+    terminals = add_terminals(db, outlet, count=100)
+    cashier = login(client, "cashier")
+    bind_all(client, cashier, terminals)
+    client.post("/api/deposit/batch", json={"items": [{"terminal_id": t.id, "amount": 10} for t in terminals]}, headers=cashier)
+
+    ids = [t.id for t in terminals]
+    resp = client.post("/api/settle/batch", json={"terminal_ids": ids + [ids[0]]}, headers=cashier)
+    results = resp.json()["results"]
+    assert [r["returned_cash"] for r in results[:100]] == [10] * 100
+    assert results[100]["status"] == "error" # repeated id is settled once
+
+    db.expire_all()
+    assert all(t.status == models.TerminalStatus.IDLE and t.current_player_id is None for t in db.query(models.Terminal))
+    assert all(w.balance == 0 for w in db.query(models.Wallet))
+    assert outlet_bcf_total(db, outlet) == 200000
+    assert db.query(models.Transaction).filter(models.Transaction.type == models.TransactionType.WITHDRAW).count() == 100
+
+def test_batch_size_is_bounded(client, org):
+    cashier = login(client, "cashier")
+    assert client.post("/api/settle/batch", json={"terminal_ids": []}, headers=cashier).status_code == 400
+    assert client.post("/api/settle/batch", json={"terminal_ids": list(range(501))}, headers=cashier).status_code == 400
+
+def test_busy_wallet_leaves_the_player_bound_in_both_settle_paths(client, db, org, monkeypatch):
+    terminals = add_terminals(db, org["outlet"], count=2)
+    cashier = login(client, "cashier")
+    bind_all(client, cashier, terminals)
+    monkeypatch.setattr(pos_batch, "SETTLE_MAX_ATTEMPTS", 0) # every compare-and-swap "loses"
+
+    assert client.post("/api/settle", json={"terminal_id": terminals[0].id}, headers=cashier).status_code == 409
+    results = client.post("/api/settle/batch", json={"terminal_ids": [terminals[1].id]}, headers=cashier).json()["results"]
+    assert results[0]["detail"] == "Wallet busy, please retry"
+
+    db.expire_all()
+    assert all(db.get(models.Terminal, t.id).status == models.TerminalStatus.OCCUPIED for t in terminals)
+    assert db.query(models.Transaction).filter_by(type=models.TransactionType.WITHDRAW).count() == 0
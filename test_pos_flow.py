@@ -0,0 +1,217 @@
+import asyncio
+import datetime
+
+import httpx
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+import auth
+import database
+import events
+import heartbeats
+import main
+import models
+from conftest import add_terminals, login, outlet_bcf_total
+
+def test_bind_deposit_settle(client, db, org):
+    outlet = org["outlet"]
+    terminal = add_terminals(db, outlet)[0]
+    cashier = login(client, "cashier")
+
+    resp = client.post("/api/bind_terminal", data={"terminal_id": terminal.id, "phone": "0912345678"}, headers=cashier)
+    assert resp.status_code == 200
+    assert resp.json()["player"] == "Player_5678"
+
+    resp = client.post("/api/deposit", json={"terminal_id": terminal.id, "amount": 300}, headers=cashier)
+    assert resp.status_code == 200
+    assert resp.json()["new_balance"] == 300
+
+    resp = client.post("/api/settle", json={"terminal_id": terminal.id}, headers=cashier)
+    assert resp.status_code == 200
+    assert resp.json()["returned_cash"] == 300
+
+    db.expire_all()
+    assert db.get(models.Outlet, outlet.id).bcf_balance == 50000.0
+    assert db.get(models.Terminal, terminal.id).status == models.TerminalStatus.IDLE
+    txns = db.query(models.Transaction).order_by(models.Transaction.id).all()
+    assert [(t.type, t.amount) for t in txns] == [(models.TransactionType.DEPOSIT, 300), (models.TransactionType.WITHDRAW, 300)]
+
+def test_bind_rejects_busy_terminal(client, db, org):
+    terminal = add_terminals(db, org["outlet"])[0]
+    cashier = login(client, "cashier")
+    assert client.post("/api/bind_terminal", data={"terminal_id": terminal.id, "phone": "0911111111"}, headers=cashier).status_code == 200
+    assert client.post("/api/bind_terminal", data={"terminal_id": terminal.id, "phone": "0922222222"}, headers=cashier).status_code == 400
+
+def test_deposit_rejects_insufficient_bcf(client, db, org):
+    terminal = add_terminals(db, org["outlet"])[0]
+    cashier = login(client, "cashier")
+    client.post("/api/bind_terminal", data={"terminal_id": terminal.id, "phone": "0912345678"}, headers=cashier)
+
+    resp = client.post("/api/deposit", json={"terminal_id": terminal.id, "amount": 60000}, headers=cashier)
+    assert resp.status_code == 400
+    assert resp.json()["detail"] == "Insufficient BCF Balance"
+
+def test_slow_subscriber_gets_resync_instead_of_lost_snapshots(monkeypatch):
+    monkeypatch.setattr(events, "SUBSCRIBER_QUEUE_SIZE", 2)
+
+    async def scenario():
+        broker = events.TerminalEventBroker()
+        queue = broker.subscribe(1)
+        for terminal_id in (1, 2, 3, 4):
+            broker.publish(1, {"id": terminal_id})
+        await asyncio.sleep(0)
+        return [queue.get_nowait() for _ in range(queue.qsize())]
+
+    # Third event overflowed: backlog replaced by one resync, then delivery resumes
+    assert asyncio.run(scenario()) == [events.RESYNC, {"id": 4}]
+
+@pytest.mark.parametrize("escrow_mode", [False, True])
+def test_concurrent_deposits_and_settles_conserve_funds(client, db, org, request, escrow_mode):
+    if escrow_mode:
+        request.getfixturevalue("escrow")
+    outlet = org["outlet"]
+    terminals = add_terminals(db, outlet, count=4)
+    cashier = login(client, "cashier")
+    for i, t in enumerate(terminals):
+        client.post("/api/bind_terminal", data={"terminal_id": t.id, "phone": f"09000000{i:02d}"}, headers=cashier)
+
+    async def storm():
+        transport = httpx.ASGITransport(app=main.app)
+        # Bounded like the production connection pool
+        sem = asyncio.Semaphore(10)
+
+        async def call(c, url, body):
+            async with sem:
+                return await c.post(url, json=body, headers=cashier)
+
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as c:
+            calls = [call(c, "/api/deposit", {"terminal_id": terminals[i % 4].id, "amount": 10}) for i in range(80)]
+            calls += [call(c, "/api/settle", {"terminal_id": t.id}) for t in terminals[:2]]
+            return await asyncio.gather(*calls)
+
+    responses = asyncio.run(storm())
+    assert all(r.status_code in (200, 400) for r in responses)
+
+    wallets = sum(w.balance for w in db.query(models.Wallet))
+    assert outlet_bcf_total(db, outlet) + wallets == 50000.0
+
+    deposited = sum(t.amount for t in db.query(models.Transaction).filter(models.Transaction.type == models.TransactionType.DEPOSIT))
+    returned = sum(t.amount for t in db.query(models.Transaction).filter(models.Transaction.type == models.TransactionType.WITHDRAW))
+    assert deposited - returned == wallets
+
+def test_deposit_rejects_non_positive_amount(client, db, org):
+    terminal = add_terminals(db, org["outlet"])[0]
+    cashier = login(client, "cashier")
+    client.post("/api/bind_terminal", data={"terminal_id": terminal.id, "phone": "0912345678"}, headers=cashier)
+    assert client.post("/api/deposit", json={"terminal_id": terminal.id, "amount": -100}, headers=cashier).status_code == 422
+
+def test_escrow_keeps_deposits_off_the_outlet_row(client, db, org, escrow):
+    outlet = org["outlet"]
+    terminal = add_terminals(db, outlet)[0]
+    cashier = login(client, "cashier")
+    manager = login(client, "manager")
+    client.post("/api/bind_terminal", data={"terminal_id": terminal.id, "phone": "0912345678"}, headers=cashier)
+
+    # First deposit refills one chunk; the next ones are served from escrow
+    for _ in range(3):
+        assert client.post("/api/deposit", json={"terminal_id": terminal.id, "amount": 300}, headers=cashier).status_code == 200
+    db.expire_all()
+    assert db.get(models.Outlet, outlet.id).bcf_balance == 49000.0
+    assert db.get(models.Terminal, terminal.id).bcf_escrow == 100.0
+
+    # Fourth deposit needs a refill
+    assert client.post("/api/deposit", json={"terminal_id": terminal.id, "amount": 300}, headers=cashier).status_code == 200
+    assert outlet_bcf_total(db, outlet) == 48800.0
+    assert client.get("/api/dashboard", headers=manager).json()["bcf_balance"] == 48800.0
+
+    # Settling lands in escrow; anything above the high-water mark goes back to the outlet
+    assert client.post("/api/settle", json={"terminal_id": terminal.id}, headers=cashier).json()["returned_cash"] == 1200.0
+    db.expire_all()
+    assert db.get(models.Terminal, terminal.id).bcf_escrow == 1000.0
+    assert outlet_bcf_total(db, outlet) == 50000.0
+    assert client.get("/api/dashboard", headers=manager).json()["bcf_balance"] == 50000.0
+
+def test_escrow_returns_to_outlet_when_terminal_goes_offline(client, db, async_db_engine, org, escrow):
+    outlet = org["outlet"]
+    terminal = add_terminals(db, outlet)[0]
+    cashier = login(client, "cashier")
+    client.post("/api/bind_terminal", data={"terminal_id": terminal.id, "phone": "0912345678"}, headers=cashier)
+    client.post("/api/deposit", json={"terminal_id": terminal.id, "amount": 300}, headers=cashier)
+    client.post("/api/settle", json={"terminal_id": terminal.id}, headers=cashier)
+    db.expire_all()
+    assert db.get(models.Terminal, terminal.id).bcf_escrow == 1000.0
+
+    # The outlet's BCF is its row plus escrow, before and after the sweep
+    manager = login(client, "manager")
+    assert client.get("/api/dashboard", headers=manager).json()["bcf_balance"] == 50000.0
+    db.get(models.Terminal, terminal.id).last_seen = datetime.datetime.utcnow() - datetime.timedelta(seconds=heartbeats.OFFLINE_AFTER_SECONDS + 10)
+    db.commit()
+
+    async def sweep():
+        async with AsyncSession(async_db_engine, expire_on_commit=False) as session:
+            return await heartbeats.sweep(session)
+
+    assert asyncio.run(sweep()) == 1
+    db.expire_all()
+    assert db.get(models.Terminal, terminal.id).bcf_escrow == 0.0
+    assert db.get(models.Outlet, outlet.id).bcf_balance == 50000.0
+    assert outlet_bcf_total(db, outlet) == 50000.0
+
+def stream_scope(token):
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": "/api/pos/terminals/stream", "raw_path": b"/api/pos/terminals/stream",
+        "query_string": f"token={token}".encode(), "root_path": "", "headers": [(b"host", b"test")],
+        "client": ("127.0.0.1", 50000), "server": ("test", 80),
+    }
+
+def test_open_streams_leave_the_pool_free(client, db, db_engine, org, monkeypatch):
+    add_terminals(db, org["outlet"])
+    token = login(client, "cashier")["Authorization"].split()[1]
+    # Pool of one connection, no overflow: a stream that kept its session would starve every request
+    engine = create_async_engine(database.to_async_url(str(db_engine.url)), pool_size=1, max_overflow=0, pool_timeout=1)
+    Session = async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+    async def override_get_async_db():
+        async with Session() as session:
+            yield session
+
+    monkeypatch.setattr(main, "AsyncSessionLocal", Session)
+    main.app.dependency_overrides[database.get_async_db] = override_get_async_db
+    auth.principal_cache.clear()
+
+    async def scenario():
+        disconnect = asyncio.Event()
+        streams = []
+        for _ in range(2):
+            opened = asyncio.Event()
+            statuses = []
+
+            async def receive():
+                await disconnect.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message, opened=opened, statuses=statuses):
+                if message["type"] == "http.response.start":
+                    statuses.append(message["status"])
+                elif message.get("body"):
+                    opened.set()
+
+            streams.append((asyncio.create_task(main.app(stream_scope(token), receive, send)), statuses))
+            await asyncio.wait_for(opened.wait(), 5)
+            # Stream authenticated against the database, not the principal cache
+            auth.principal_cache.clear()
+
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            resp = await ac.get("/api/pos/terminals", headers={"Authorization": f"Bearer {token}"})
+        disconnect.set()
+        await asyncio.wait_for(asyncio.gather(*(task for task, _ in streams)), 5)
+        await engine.dispose()
+        return resp, [s for _, s in streams]
+
+    resp, statuses = asyncio.run(scenario())
+    assert statuses == [[200], [200]]
+    assert resp.status_code == 200
+    assert len(resp.json()) == 3
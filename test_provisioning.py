@@ -0,0 +1,55 @@
+import models
+from conftest import QueryCounter, login
+
+def test_bulk_create_allocates_sequential_codes(client, db, db_engine, org):
+    outlet, operator = org["outlet"], org["operator"]
+    headers = login(client, "operator")
+
+    with QueryCounter(db_engine) as counter:
+        resp = client.post("/api/terminals/bulk", json={"outlet_id": outlet.id, "count": 500}, headers=headers)
+    assert resp.status_code == 200
+    created = resp.json()
+    assert len(created) == 500
+    assert created[0]["code"] == f"OP{operator.id}-O{outlet.id}-T0001"
+    assert created[-1]["code"] == f"OP{operator.id}-O{outlet.id}-T0500"
+    assert created[0]["name"] == "1號機"
+    # Auth + outlet lookup + counter bump + batched insert, not one round trip per machine
+    assert counter.count < 20
+
+    resp = client.post("/api/terminals/bulk", json={"outlet_id": outlet.id, "names": ["VIP-1", "VIP-2"]}, headers=headers)
+    assert [t["code"][-5:] for t in resp.json()] == ["T0501", "T0502"]
+    assert [t["name"] for t in resp.json()] == ["VIP-1", "VIP-2"]
+
+    db.expire_all()
+    assert db.query(models.Terminal).count() == 502
+    assert db.get(models.Outlet, outlet.id).terminal_seq == 502
+
+def test_bulk_create_validation_and_scope(client, db, org):
+    outlet = org["outlet"]
+    headers = login(client, "operator")
+    assert client.post("/api/terminals/bulk", json={"outlet_id": outlet.id}, headers=headers).status_code == 400
+    assert client.post("/api/terminals/bulk", json={"outlet_id": outlet.id, "count": 2, "names": ["a"]}, headers=headers).status_code == 400
+    assert client.post("/api/terminals/bulk", json={"outlet_id": outlet.id, "count": 5000}, headers=headers).status_code == 400
+
+    other = models.Operator(name="Other")
+    db.add(other)
+    db.flush()
+    foreign = models.Outlet(name="Foreign", operator_id=other.id)
+    db.add(foreign)
+    db.commit()
+    assert client.post("/api/terminals/bulk", json={"outlet_id": foreign.id, "count": 1}, headers=headers).status_code == 400
+    assert client.post("/api/terminals/bulk", json={"outlet_id": foreign.id, "count": 1}, headers=login(client, "admin")).status_code == 200
+
+def test_single_create_allocates_the_next_code(client, db, org):
+    outlet, operator = org["outlet"], org["operator"]
+    headers = login(client, "operator")
+    client.post("/api/terminals/bulk", json={"outlet_id": outlet.id, "count": 2}, headers=headers)
+
+    resp = client.post("/api/terminals", json={"name": "VIP", "outlet_id": outlet.id}, headers=headers)
+    assert resp.status_code == 200
+    created = resp.json()
+    assert created["code"] == f"OP{operator.id}-O{outlet.id}-T0003"
+    assert (created["name"], created["is_active"], created["is_paired"]) == ("VIP", True, False)
+
+    db.expire_all()
+    assert db.get(models.Outlet, outlet.id).terminal_seq == 3
@@ -0,0 +1,146 @@
+import datetime
+import json
+
+import game_rounds
+import models
+import rollups
+from conftest import QueryCounter, add_terminals, login, pair
+
+def ndjson(*events):
+    return "\n".join(json.dumps(e) for e in events).encode()
+
+def post_rounds(client, body, token):
+    headers = {"Content-Type": "application/x-ndjson"}
+    if token:
+        headers[game_rounds.DEVICE_TOKEN_HEADER] = token
+    return client.post("/api/rounds/ingest", content=body, headers=headers)
+
+def test_ingest_folds_rounds_into_totals(client, db, org):
+    t1, t2 = add_terminals(db, org["outlet"], count=2)
+    tok1, tok2 = pair(db, t1, "tok-1"), pair(db, t2, "tok-2")
+
+    resp = post_rounds(client, ndjson(
+        {"round_id": "r1", "bet": 10, "win": 0},
+        {"round_id": "r2", "bet": 10, "win": 25, "hardware_id": "HW-tok-1"},
+    ), tok1)
+    assert resp.status_code == 200
+    assert resp.json() == {"accepted": 2, "duplicates": 0, "rejected": []}
+    assert post_rounds(client, ndjson({"round_id": "r1", "bet": 5, "win": 2.5}), tok2).json()["accepted"] == 1
+
+    db.expire_all()
+    assert (db.get(models.Terminal, t1.id).bet_total, db.get(models.Terminal, t1.id).win_total, db.get(models.Terminal, t1.id).round_count) == (20, 25, 2)
+    assert db.get(models.Terminal, t2.id).round_count == 1
+    assert db.query(models.GameRound).count() == 3
+
+    stats = client.get("/api/dashboard", headers=login(client, "manager")).json()
+    assert stats["total_turnover"] == 25
+    assert stats["total_ggr"] == -2.5
+
+def test_ingest_requires_a_paired_device(client, db, org):
+    terminal, other = add_terminals(db, org["outlet"], count=2)
+    token = pair(db, terminal, "tok-1")
+    body = ndjson({"round_id": "r1", "bet": 10, "win": 0})
+
+    assert post_rounds(client, body, None).status_code == 401
+    assert post_rounds(client, body, "forged").status_code == 401
+    # Naming another terminal no longer routes rounds to it
+    resp = post_rounds(client, ndjson({"terminal": other.code, "hardware_id": "HW-other", "round_id": "r1", "bet": 10, "win": 0}), token)
+    assert resp.json()["rejected"] == [{"line": 1, "error": "hardware_id does not match the device"}]
+
+    # Unpairing revokes the token; a disabled terminal cannot report
+    terminal.is_active = False
+    db.commit()
+    assert post_rounds(client, body, token).status_code == 403
+    assert client.post(f"/api/terminals/{terminal.id}/unpair", headers=login(client, "admin")).status_code == 200
+    assert post_rounds(client, body, token).status_code == 401
+
+    db.expire_all()
+    assert db.query(models.GameRound).count() == 0
+    assert db.get(models.Terminal, other.id).bet_total == 0
+
+def test_ingest_skips_resent_rounds(client, db, org):
+    terminal = add_terminals(db, org["outlet"])[0]
+    token = pair(db, terminal, "tok-1")
+    body = ndjson(*[{"round_id": str(i), "bet": 1, "win": 0} for i in range(5)])
+    assert post_rounds(client, body, token).json()["accepted"] == 5
+
+    # A retried batch, plus a round repeated within the batch
+    retry = body + b"\n" + ndjson({"round_id": "5", "bet": 1, "win": 0}, {"round_id": "5", "bet": 1, "win": 0})
+    assert post_rounds(client, retry, token).json() == {"accepted": 1, "duplicates": 6, "rejected": []}
+
+    db.expire_all()
+    assert db.get(models.Terminal, terminal.id).round_count == 6
+    assert sum(r.round_count for r in db.query(models.OutletRollup)) == 6
+
+def test_ingest_reports_bad_lines_and_keeps_the_rest(client, db, org):
+    terminal = add_terminals(db, org["outlet"])[0]
+    token = pair(db, terminal, "tok-1")
+    now = datetime.datetime.now(datetime.timezone.utc)
+    local = now.astimezone(datetime.timezone(datetime.timedelta(hours=8))).replace(microsecond=0)
+    body = b"\n".join([
+        b"not json",
+        ndjson({"round_id": "a", "bet": -1, "win": 0}),
+        b"",
+        ndjson({"round_id": "b", "bet": 1, "win": 0, "ts": (now + datetime.timedelta(hours=1)).isoformat()}),
+        ndjson({"bet": 1, "win": 0}),
+        ndjson([1, 2]),
+        ndjson({"round_id": "c", "bet": 1, "win": 0, "ts": "2024-01-01T10:30:00+08:00"}),
+        ndjson({"round_id": "ok", "bet": 3, "win": 1, "ts": local.isoformat()}),
+    ])
+    report = post_rounds(client, body, token).json()
+    assert report["accepted"] == 1
+    assert [(r["line"], r["error"]) for r in report["rejected"]] == [
+        (1, "Invalid JSON"),
+        (2, "bet and win must be non-negative numbers"),
+        (4, "ts out of range"),
+        (5, "round_id is required"),
+        (6, "Expected a JSON object"),
+        (7, "ts out of range"),
+    ]
+    stored = db.query(models.GameRound).one()
+    assert stored.played_at == local.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+def test_ingest_batch_uses_constant_statements(client, db, db_engine, async_db_engine, org):
+    terminal = add_terminals(db, org["outlet"])[0]
+    token = pair(db, terminal, "tok-1")
+    body = ndjson(*[{"round_id": str(i), "bet": 2, "win": 1} for i in range(2000)])
+    with QueryCounter(db_engine, async_db_engine) as counter:
+        assert post_rounds(client, body, token).json()["accepted"] == 2000
+    # Device lookup, round insert, terminal totals, one rollup upsert - not one per round.
+    # (insertmanyvalues may split the insert into a few statements on SQLite.)
+    assert counter.count <= 10
+
+    db.expire_all()
+    assert db.get(models.Terminal, terminal.id).bet_total == 4000
+
+def test_ingest_rejects_oversized_batch(client, db, org, monkeypatch):
+    token = pair(db, add_terminals(db, org["outlet"])[0], "tok-1")
+    monkeypatch.setattr(game_rounds, "MAX_INGEST_LINES", 2)
+    body = ndjson(*[{"round_id": str(i), "bet": 1, "win": 0} for i in range(3)])
+    assert post_rounds(client, body, token).status_code == 400
+
+    # Byte cap applies while the body streams in, whatever Content-Length claims
+    monkeypatch.setattr(game_rounds, "MAX_INGEST_BYTES", 64)
+    assert post_rounds(client, body, token).status_code == 413
+
+    def chunks():
+        yield body[:40]
+        yield body[40:]
+
+    resp = client.post("/api/rounds/ingest", content=chunks(), headers={game_rounds.DEVICE_TOKEN_HEADER: token})
+    assert resp.status_code == 413
+
+def test_rebuild_includes_rounds(client, db, org):
+    terminal = add_terminals(db, org["outlet"])[0]
+    token = pair(db, terminal, "tok-1")
+    post_rounds(client, ndjson(*[{"round_id": str(i), "bet": 4, "win": 3} for i in range(10)]), token)
+
+    def snapshot():
+        db.expire_all()
+        return sorted((r.outlet_id, r.bucket, r.bet_total, r.win_total, r.round_count) for r in db.query(models.OutletRollup))
+
+    incremental = snapshot()
+    db.query(models.OutletRollup).delete()
+    db.commit()
+    rollups.rebuild(db)
+    assert snapshot() == incremental == [(org["outlet"].id, incremental[0][1], 40, 30, 10)]
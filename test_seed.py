@@ -0,0 +1,76 @@
+import datetime
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+import auth
+import models
+import rollups
+import seed
+
+END = datetime.datetime(2024, 3, 31)
+
+def generate(db, **kwargs):
+    params = dict(operators=2, outlets=2, terminals=3, players=40, months=1, txns_per_day=6, seed=7, end=END, batch_size=50, log=lambda msg: None)
+    params.update(kwargs)
+    return seed.generate(db, **params)
+
+def snapshot(db):
+    return db.execute(
+        select(models.Transaction.timestamp, models.Transaction.type, models.Transaction.amount,
+               models.Transaction.terminal_id, models.Transaction.player_id)
+        .order_by(models.Transaction.id)
+    ).all()
+
+def test_generator_is_deterministic(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(auth, "get_password_hash", lambda p: "x")
+    monkeypatch.setattr(seed, "get_password_hash", lambda p: "x")
+    first = generate(db)
+    other = create_engine(f"sqlite:///{tmp_path / 'other.db'}")
+    models.Base.metadata.create_all(bind=other)
+    other_db = sessionmaker(bind=other)()
+    assert generate(other_db) == first
+    assert snapshot(other_db) == snapshot(db)
+    other_db.close()
+    other.dispose()
+
+    assert first["transactions"] == len(snapshot(db)) > 0
+    assert db.scalar(select(func.count()).select_from(models.Terminal)) == 2 * 2 * 3
+    # Terminal codes match what provisioning would allocate next
+    outlet = db.get(models.Outlet, first["outlets"][0])
+    assert outlet.terminal_seq == 3
+    assert sorted(t.code for t in outlet.terminals)[-1] == f"OP{outlet.operator_id}-O{outlet.id}-T0003"
+    # Every transaction falls inside the requested window
+    first_ts, last_ts = db.execute(select(func.min(models.Transaction.timestamp), func.max(models.Transaction.timestamp))).one()
+    assert END - datetime.timedelta(days=29) <= first_ts and last_ts < END + datetime.timedelta(days=1)
+
+def test_generated_rollups_match_rebuild_and_keep_adds_data(db, monkeypatch):
+    monkeypatch.setattr(seed, "get_password_hash", lambda p: "x")
+    generate(db, defer_indexes=True)
+    # A second dataset with another seed lands next to the first
+    generate(db, seed=8, operators=1)
+    assert db.scalar(select(func.count()).select_from(models.Operator)) == 3
+
+    def rollup_rows():
+        db.expire_all()
+        return sorted((r.outlet_id, r.bucket, r.deposit_total, r.deposit_count, r.withdraw_total, r.withdraw_count) for r in db.query(models.OutletRollup))
+
+    generated = rollup_rows()
+    rollups.rebuild(db)
+    assert rollup_rows() == generated
+    index_names = {i["name"] for i in db.connection().dialect.get_indexes(db.connection(), "transactions")}
+    assert "ix_transactions_outlet_timestamp" in index_names
+
+def test_generated_staff_scopes(db, monkeypatch):
+    monkeypatch.setattr(seed, "get_password_hash", lambda p: "x")
+    generate(db)
+    staff = db.execute(
+        select(models.User.username, models.Role.name, models.User.operator_id, models.User.outlet_id).join(models.Role)
+    ).all()
+    by_role = {}
+    for username, role, operator_id, outlet_id in staff:
+        by_role.setdefault(role, []).append((operator_id, outlet_id))
+    assert len(by_role["Operator"]) == 2 and all(op and outlet is None for op, outlet in by_role["Operator"])
+    # Store managers and cashiers are scoped to their outlet, not to the whole operator
+    for role in ("Store Mgr", "Cashier"):
+        assert len(by_role[role]) == 4 and all(op and outlet for op, outlet in by_role[role])
@@ -0,0 +1,77 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import auth
+import main
+import models
+from conftest import login
+
+@pytest.fixture
+def cheap_hashing():
+    # Minimum bcrypt cost keeps a few dozen hashes fast
+    auth.configure_password_hashing(4, 2)
+    yield
+    auth.configure_password_hashing(auth.BCRYPT_ROUNDS, auth.PASSWORD_HASH_WORKERS)
+
+def test_csv_import_reports_every_row(client, db, org, cheap_hashing):
+    outlet = org["outlet"]
+    other = models.Operator(name="Other")
+    db.add(other)
+    db.flush()
+    foreign = models.Outlet(name="Foreign", operator_id=other.id)
+    db.add(foreign)
+    db.commit()
+
+    lines = ["username,password,role,outlet_id"]
+    lines += [f"cashier{i:03d},pw{i},Cashier,{outlet.id}" for i in range(40)]
+    lines += [
+        "cashier000,pw,Cashier,",           # duplicate within the batch
+        "cashier,pw,Cashier,",              # already exists
+        f"boss,pw,Admin,{outlet.id}",       # Level Guard
+        f"spy,pw,Cashier,{foreign.id}",     # Scope Guard
+        "ghost,pw,Croupier,",               # unknown role
+        ",pw,Cashier,",                     # missing username
+    ]
+    resp = client.post("/api/users/import", content="\n".join(lines), headers={**login(client, "operator"), "Content-Type": "text/csv"})
+    assert resp.status_code == 200, resp.text
+    report = resp.json()
+    assert report["created"] == 40
+    assert report["failed"] == 6
+    errors = {r["row"]: r["detail"] for r in report["results"] if r["status"] == "error"}
+    assert errors[41] == errors[42] == "Username already exists"
+    assert errors[43].startswith("Level Guard")
+    assert errors[44].startswith("Scope Guard")
+    assert errors[45] == "Role not found"
+
+    db.expire_all()
+    imported = db.query(models.User).filter(models.User.username == "cashier007").one()
+    assert imported.operator_id == org["operator"].id and imported.outlet_id == outlet.id
+    assert auth.verify_password("pw7", imported.hashed_password)
+
+def test_json_import_by_store_manager_locks_outlet(client, db, org, cheap_hashing):
+    rows = [{"username": "newbie", "password": "x", "role": "Cashier", "outlet_id": 999}]
+    resp = client.post("/api/users/import", json=rows, headers=login(client, "admin"))
+    assert resp.json()["results"][0]["detail"] == "Outlet not found"
+
+    # Store Mgr lacks USER_CREATE in the test roles; grant it for this check
+    manager_role = org["roles"]["Store Mgr"]
+    manager_role.permissions.append(db.query(models.Permission).filter(models.Permission.code == "USER_CREATE").one())
+    db.commit()
+    rows = [{"username": "newbie", "password": "x", "role": "Cashier"}, {"username": "boss", "password": "x", "role": "Store Mgr"}]
+    report = client.post("/api/users/import", json=rows, headers=login(client, "manager")).json()
+    assert [r["status"] for r in report["results"]] == ["created", "error"]
+    db.expire_all()
+    assert db.query(models.User).filter(models.User.username == "newbie").one().outlet_id == org["outlet"].id
+
+def test_import_rejects_unreadable_body(client, org):
+    resp = client.post("/api/users/import", content=b"{not json", headers={**login(client, "admin"), "Content-Type": "application/json"})
+    assert resp.status_code == 400
+
+def test_bulk_hash_pool_is_spawned_once_and_shut_down_with_the_app(cheap_hashing):
+    with TestClient(main.app):
+        hashes = auth.hash_passwords_bulk(["a", "b", "c"])
+        assert all(auth.pwd_context.verify(p, h) for p, h in zip("abc", hashes))
+        pool = auth.bulk_hash_executor
+        assert auth._bulk_hash_pool() is pool
+        assert pool._mp_context.get_start_method() == "spawn"
+    assert auth.bulk_hash_executor is None
@@ -0,0 +1,50 @@
+import auth
+import main
+import models
+from conftest import QueryCounter, login
+
+def seed_floor(db, outlet, machines=200):
+    # Every other machine is occupied by a player holding a wallet at this outlet
+    for i in range(1, machines + 1):
+        t = models.Terminal(code=f"T-{outlet.id}-{i:04d}", name=f"{i}", outlet_id=outlet.id, status=models.TerminalStatus.IDLE)
+        if i % 2 == 0:
+            player = models.Player(phone=f"09{outlet.id:02d}{i:06d}", nickname=f"Player_{i}")
+            db.add(player)
+            db.flush()
+            db.add(models.Wallet(player_id=player.id, outlet_id=outlet.id, balance=float(i)))
+            t.status = models.TerminalStatus.OCCUPIED
+            t.current_player_id = player.id
+        db.add(t)
+    db.commit()
+
+def test_pos_terminals_query_count_is_constant(client, db, db_engine, async_db_engine, org):
+    seed_floor(db, org["outlet"])
+    headers = login(client, "cashier")
+
+    with QueryCounter(db_engine, async_db_engine) as counter:
+        resp = client.get("/api/pos/terminals", headers=headers)
+    assert resp.status_code == 200
+    terminals = resp.json()
+    assert len(terminals) == 200
+
+    # Auth lookup + one joined Terminal/Player/Wallet query
+    assert counter.count <= 3
+
+    occupied = {t["id"]: t for t in terminals if t["status"] == models.TerminalStatus.OCCUPIED}
+    assert len(occupied) == 100
+    for t in occupied.values():
+        assert t["player"]["nickname"] == f"Player_{t['name']}"
+        assert t["credits"] == float(t["name"])
+
+def test_terminal_list_query_count_is_constant(db, db_engine, org):
+    seed_floor(db, org["outlet"])
+    operator = auth.Principal.from_user(org["users"]["operator"])
+
+    with QueryCounter(db_engine) as counter:
+        result = main.get_terminals(current_user=operator, db=db)
+    assert len(result) == 200
+    assert counter.count <= 2
+
+    balances = [t["current_balance"] for t in result if t["current_player_name"]]
+    assert len(balances) == 100
+    assert all(b > 0 for b in balances)
@@ -0,0 +1,75 @@
+import datetime
+
+from sqlalchemy import text
+
+import auth
+import models
+import transactions
+from conftest import login
+
+def seed_history(db, org, count=250):
+    outlet, cashier = org["outlet"], org["users"]["cashier"]
+    players = [models.Player(phone=f"09000000{i}", nickname=f"P{i}") for i in range(2)]
+    db.add_all(players)
+    db.flush()
+    base = datetime.datetime(2024, 1, 1)
+    for i in range(count):
+        db.add(models.Transaction(
+            # Pairs share a timestamp so the id tie-breaker is exercised
+            timestamp=base + datetime.timedelta(minutes=i // 2),
+            type=models.TransactionType.DEPOSIT if i % 2 == 0 else models.TransactionType.WITHDRAW,
+            amount=float(i), outlet_id=outlet.id, player_id=players[i % 2].id, staff_id=cashier.id
+        ))
+    db.commit()
+    return players
+
+def test_keyset_pages_cover_history_once(client, db, org):
+    seed_history(db, org)
+    headers = login(client, "manager")
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        params = {"limit": 100}
+        if cursor:
+            params["cursor"] = cursor
+        resp = client.get("/api/transactions", params=params, headers=headers)
+        assert resp.status_code == 200
+        page = resp.json()
+        seen += page["items"]
+        pages += 1
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
+    assert pages == 3
+    assert len(seen) == 250
+    keys = [(t["timestamp"], t["id"]) for t in seen]
+    assert keys == sorted(keys, reverse=True)
+    assert len({t["id"] for t in seen}) == 250
+
+def test_filters_and_time_window(client, db, org):
+    players = seed_history(db, org)
+    headers = login(client, "manager")
+    resp = client.get("/api/transactions", params={
+        "player_id": players[0].id, "type": "Deposit",
+        "start": "2024-01-01T00:10:00", "end": "2024-01-01T00:20:00"
+    }, headers=headers)
+    items = resp.json()["items"]
+    assert len(items) == 10
+    assert all(t["player_id"] == players[0].id and t["type"] == "Deposit" for t in items)
+
+def test_scope_and_validation(client, db, org):
+    seed_history(db, org, count=4)
+    assert client.get("/api/transactions", headers=login(client, "cashier")).status_code == 403
+    manager = login(client, "manager")
+    assert client.get("/api/transactions", params={"outlet_id": org["outlet"].id + 1}, headers=manager).status_code == 403
+    assert client.get("/api/transactions", params={"cursor": "not-a-cursor"}, headers=manager).status_code == 400
+    assert len(client.get("/api/transactions", headers=login(client, "operator")).json()["items"]) == 4
+
+def test_outlet_page_uses_composite_index(db, org):
+    manager = auth.Principal.from_user(org["users"]["manager"])
+    cursor = transactions.encode_cursor(models.Transaction(id=10, timestamp=datetime.datetime(2024, 1, 1)))
+    query = transactions.page_query(transactions.scoped_query(manager), cursor, 100)
+    compiled = query.compile(db.get_bind(), compile_kwargs={"literal_binds": True})
+    plan = " ".join(str(row) for row in db.execute(text(f"EXPLAIN QUERY PLAN {compiled}")))
+    assert "ix_transactions_outlet_timestamp" in plan
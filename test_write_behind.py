@@ -0,0 +1,96 @@
+import asyncio
+
+import httpx
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+import main
+import models
+import write_behind
+from conftest import add_terminals, login
+
+@pytest.fixture
+def writer(monkeypatch):
+    monkeypatch.setattr(write_behind, "ENABLED", True)
+    monkeypatch.setattr(write_behind, "writer", write_behind.LogWriter())
+    return write_behind.writer
+
+def test_log_rows_are_group_committed(client, db, async_db_engine, org, writer):
+    terminals = add_terminals(db, org["outlet"], count=4)
+    cashier = login(client, "cashier")
+    for i, t in enumerate(terminals):
+        client.post("/api/bind_terminal", data={"terminal_id": t.id, "phone": f"09200000{i:02d}"}, headers=cashier)
+    Session = async_sessionmaker(bind=async_db_engine, class_=AsyncSession, expire_on_commit=False)
+
+    async def scenario():
+        task = asyncio.create_task(writer.run(Session))
+        await asyncio.sleep(0)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as c:
+            calls = [c.post("/api/deposit", json={"terminal_id": terminals[i % 4].id, "amount": 10}, headers=cashier) for i in range(40)]
+            responses = await asyncio.gather(*calls)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await writer.drain(Session)
+        return responses
+
+    responses = asyncio.run(scenario())
+    assert all(r.status_code == 200 for r in responses)
+
+    stats = writer.stats()
+    assert stats["enqueued"] == stats["written"] == 40
+    assert stats["depth"] == 0
+    # Far fewer commits than deposits
+    assert stats["flushes"] < 40
+
+    db.expire_all()
+    assert db.query(models.Transaction).count() == 40
+    assert sum(r.deposit_total for r in db.query(models.OutletRollup)) == 400
+    assert db.get(models.Outlet, org["outlet"].id).bcf_balance == 50000 - 400
+
+def test_rolled_back_writes_queue_nothing(client, db, org, writer):
+    writer.running = True # accept rows without a background loop
+    terminal = add_terminals(db, org["outlet"])[0]
+    cashier = login(client, "cashier")
+    client.post("/api/bind_terminal", data={"terminal_id": terminal.id, "phone": "0912345678"}, headers=cashier)
+    headers = {**cashier, "Idempotency-Key": "k1"}
+    assert client.post("/api/deposit", json={"terminal_id": terminal.id, "amount": 10}, headers=headers).status_code == 200
+    assert client.post("/api/deposit", json={"terminal_id": terminal.id, "amount": 60000}, headers=cashier).status_code == 400
+    assert writer.depth() == 1
+
+    stats = client.get("/api/system/write_behind", headers=login(client, "admin")).json()
+    assert stats["depth"] == 1 and stats["enabled"] is True
+
+def test_disabled_writes_inline(client, db, org):
+    terminal = add_terminals(db, org["outlet"])[0]
+    cashier = login(client, "cashier")
+    client.post("/api/bind_terminal", data={"terminal_id": terminal.id, "phone": "0912345678"}, headers=cashier)
+    client.post("/api/deposit", json={"terminal_id": terminal.id, "amount": 10}, headers=cashier)
+    assert db.query(models.Transaction).count() == 1
+    assert write_behind.writer.depth() == 0
+
+def test_failing_row_is_isolated_and_dropped(client, db, async_db_engine, org, writer, monkeypatch):
+    monkeypatch.setattr(write_behind, "MAX_ATTEMPTS", 2)
+    outlet_id = org["outlet"].id
+    existing = models.Transaction(type=models.TransactionType.DEPOSIT, amount=1, outlet_id=outlet_id)
+    db.add(existing)
+    db.commit()
+    # Duplicate primary key: fails on every attempt
+    poison = models.Transaction(id=existing.id, type=models.TransactionType.DEPOSIT, amount=5, outlet_id=outlet_id)
+    good = [models.Transaction(type=models.TransactionType.DEPOSIT, amount=10, outlet_id=outlet_id) for _ in range(2)]
+    writer.enqueue([good[0], poison, good[1]])
+
+    async def flush():
+        async with AsyncSession(async_db_engine, expire_on_commit=False) as session:
+            return await writer.flush(session)
+
+    assert asyncio.run(flush()) == 2
+    assert writer.depth() == 1
+    assert asyncio.run(flush()) == 0
+    assert writer.depth() == 0
+
+    stats = writer.stats()
+    assert stats["written"] == 2 and stats["dropped"] == 1
+    db.expire_all()
+    assert sorted(t.amount for t in db.query(models.Transaction)) == [1, 10, 10]
+    assert sum(r.deposit_total for r in db.query(models.OutletRollup)) == 20
@@ -0,0 +1,75 @@
+import base64
+import datetime
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_, select
+
+import models
+
+# Transaction history reads: caller scoping, filters and keyset cursors.
+# Pages are ordered newest first by (timestamp, id); each page resumes strictly
+# after the last row of the previous one, so cost does not grow with depth.
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+Txn = models.Transaction
+
+def encode_cursor(row: models.Transaction) -> str:
+    raw = f"{row.timestamp.isoformat()}|{row.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        ts, txn_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.datetime.fromisoformat(ts), int(txn_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def naive_utc(ts: Optional[datetime.datetime]):
+    # Timestamps are stored as naive UTC
+    if ts is not None and ts.tzinfo is not None:
+        ts = ts.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return ts
+
+def scoped_query(user, outlet_id=None, terminal_id=None, player_id=None, staff_id=None, txn_type=None,
+                 start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None):
+    # Admin sees everything, outlet staff their outlet, operators their outlets
+    query = select(Txn)
+    if user.outlet_id:
+        if outlet_id is not None and outlet_id != user.outlet_id:
+            raise HTTPException(status_code=403, detail="Permission denied")
+        query = query.where(Txn.outlet_id == user.outlet_id)
+    elif user.role_name != "Admin":
+        operator_outlets = select(models.Outlet.id).where(models.Outlet.operator_id == user.operator_id)
+        query = query.where(Txn.outlet_id.in_(operator_outlets))
+
+    if outlet_id is not None:
+        query = query.where(Txn.outlet_id == outlet_id)
+    if terminal_id is not None:
+        query = query.where(Txn.terminal_id == terminal_id)
+    if player_id is not None:
+        query = query.where(Txn.player_id == player_id)
+    if staff_id is not None:
+        query = query.where(Txn.staff_id == staff_id)
+    if txn_type is not None:
+        query = query.where(Txn.type == txn_type)
+    if start is not None:
+        query = query.where(Txn.timestamp >= naive_utc(start))
+    if end is not None:
+        query = query.where(Txn.timestamp < naive_utc(end))
+    return query
+
+def page_query(query, cursor: Optional[str], limit: int):
+    if cursor:
+        ts, txn_id = decode_cursor(cursor)
+        # Row-value comparison spelled out so every backend can use the index
+        query = query.where(or_(Txn.timestamp < ts, and_(Txn.timestamp == ts, Txn.id < txn_id)))
+    # One extra row tells us whether another page exists
+    return query.order_by(Txn.timestamp.desc(), Txn.id.desc()).limit(limit + 1)
+
+def paginate(db, query, cursor: Optional[str], limit: int) -> dict:
+    rows = db.scalars(page_query(query, cursor, limit)).all()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return {"items": rows[:limit], "next_cursor": next_cursor}
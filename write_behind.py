@@ -0,0 +1,211 @@
+import asyncio
+import datetime
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event, exc
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import models
+import rollups
+
+logger = logging.getLogger(__name__)
+
+# Optional group commit for log rows (OMS_LOG_WRITE_BEHIND=1).
+# Balance changes still commit synchronously in the request. The audit rows that
+# go with them (Transaction, BCFLog) are queued in memory, and a background
+# writer inserts them, plus their rollups, in one transaction every
+# OMS_LOG_FLUSH_MS or as soon as OMS_LOG_FLUSH_ROWS are waiting. On shutdown the
+# queue is drained. Trade-off: a hard crash loses whatever is still queued.
+# A batch that fails on a database outage is retried whole; any other failure is
+# narrowed down row by row, and a row that keeps failing is logged and dropped.
+
+ENABLED = os.getenv("OMS_LOG_WRITE_BEHIND", "0") == "1"
+FLUSH_MS = float(os.getenv("OMS_LOG_FLUSH_MS", "50"))
+FLUSH_ROWS = int(os.getenv("OMS_LOG_FLUSH_ROWS", "500"))
+# Past this depth requests write their own rows again instead of queueing more
+MAX_QUEUE = int(os.getenv("OMS_LOG_MAX_QUEUE", "100000"))
+# Failed writes of one row before it is dropped
+MAX_ATTEMPTS = int(os.getenv("OMS_LOG_MAX_ATTEMPTS", "3"))
+
+class LogWriter:
+    def __init__(self):
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+        self.running = False
+        self.enqueued = 0
+        self.written = 0
+        self.flushes = 0
+        self.failures = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self._attempts = {}  # id(row) -> failed writes, for rows back in the queue
+        self.last_flush_ms = 0.0
+
+    def depth(self) -> int:
+        with self._lock:
+            return len(self._queue)
+
+    def lag_seconds(self) -> float:
+        # Age of the oldest row still waiting (rows are stamped when queued)
+        with self._lock:
+            oldest = self._queue[0].timestamp if self._queue else None
+        if oldest is None:
+            return 0.0
+        return max(0.0, (datetime.datetime.utcnow() - oldest).total_seconds())
+
+    def stats(self) -> dict:
+        return {
+            "enabled": ENABLED,
+            "running": self.running,
+            "depth": self.depth(),
+            "max_depth": self.max_depth,
+            "lag_seconds": round(self.lag_seconds(), 3),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+    def has_room(self, count: int) -> bool:
+        # False when the writer is not running or the queue is full: write them yourself
+        return self.running and self.depth() + count <= MAX_QUEUE
+
+    def enqueue(self, rows):
+        with self._lock:
+            self._queue.extend(rows)
+            depth = len(self._queue)
+            self.enqueued += len(rows)
+            self.max_depth = max(self.max_depth, depth)
+        if depth >= FLUSH_ROWS and self.running:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def flush(self, db: AsyncSession) -> int:
+        with self._lock:
+            batch = list(self._queue)
+            self._queue.clear()
+        if not batch:
+            return 0
+        started = time.perf_counter()
+        try:
+            await self._write(db, batch)
+        except exc.OperationalError:
+            # Database unavailable or locked: not the rows' fault, retry them all
+            await db.rollback()
+            self._requeue(batch)
+            self.failures += 1
+            raise
+        except Exception:
+            await db.rollback()
+            self.failures += 1
+            logger.exception("write_behind_batch_failed rows=%d", len(batch))
+            return await self._write_each(db, batch)
+        self._done(batch)
+        self.flushes += 1
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+        return len(batch)
+
+    async def _write(self, db: AsyncSession, rows):
+        db.add_all(rows)
+        await rollups.record_many(db, [r for r in rows if isinstance(r, models.Transaction)])
+        await db.commit()
+
+    async def _write_each(self, db: AsyncSession, batch) -> int:
+        # One transaction per row, so a bad row cannot hold back the others
+        written, retry = 0, []
+        for n, row in enumerate(batch):
+            try:
+                await self._write(db, [row])
+            except exc.OperationalError:
+                await db.rollback()
+                self._requeue(retry + batch[n:])
+                raise
+            except Exception:
+                await db.rollback()
+                attempts = self._attempts.pop(id(row), 0) + 1
+                if attempts < MAX_ATTEMPTS:
+                    self._attempts[id(row)] = attempts
+                    retry.append(row)
+                else:
+                    self.dropped += 1
+                    logger.exception("write_behind_row_dropped attempts=%d row=%r", attempts, _describe(row))
+                continue
+            self._done([row])
+            self.flushes += 1
+            written += 1
+        self._requeue(retry)
+        return written
+
+    def _requeue(self, rows):
+        # Back in front, in order, for the next flush
+        with self._lock:
+            self._queue.extendleft(reversed(rows))
+
+    def _done(self, rows):
+        for row in rows:
+            self._attempts.pop(id(row), None)
+        self.written += len(rows)
+
+    async def run(self, session_factory):
+        # Background loop (started from the app lifespan when ENABLED)
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self.running = True
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=FLUSH_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                async with session_factory() as db:
+                    await self.flush(db)
+            except Exception:
+                logger.exception("write_behind_flush_failed depth=%d", self.depth())
+
+    async def drain(self, session_factory):
+        # Shutdown: stop accepting, then write out everything still queued
+        self.running = False
+        while self.depth():
+            async with session_factory() as db:
+                await self.flush(db)
+
+def _describe(row) -> dict:
+    # Column values of a dropped row, for the log
+    return {c.key: getattr(row, c.key) for c in row.__table__.columns}
+
+writer = LogWriter()
+
+_PENDING = "write_behind_rows"
+
+async def log(db: AsyncSession, rows):
+    # Audit rows for the caller's write: queued when write-behind is on,
+    # otherwise added to the caller's transaction (with their rollups).
+    if ENABLED and writer.has_room(len(rows)):
+        # Stamped now, not at flush time, so rollup buckets match the operation
+        now = datetime.datetime.utcnow()
+        for row in rows:
+            row.timestamp = row.timestamp or now
+        # Held on the session and only queued once the caller's commit succeeds
+        db.sync_session.info.setdefault(_PENDING, []).extend(rows)
+        return
+    db.add_all(rows)
+    await rollups.record_many(db, [r for r in rows if isinstance(r, models.Transaction)])
+
+@event.listens_for(Session, "after_commit")
+def _queue_committed(session):
+    rows = session.info.pop(_PENDING, None)
+    if rows:
+        writer.enqueue(rows)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session):
+    session.info.pop(_PENDING, None)